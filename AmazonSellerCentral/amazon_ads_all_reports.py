@@ -1,30 +1,36 @@
+import csv
 import json
 import re
 import sys
 from pathlib import Path
 
 sys.path.append(str(Path(__file__).resolve().parent.parent))
-import requests
 from tenacity import retry, stop_after_attempt, wait_fixed, retry_if_result
-import pandas as pd
 from io import BytesIO
-from helper.utils import parse_args, save_content_to_file, upload_to_gcs, reset_cookie
+from helper.utils import parse_args, save_content_to_file, upload_to_gcs
 from helper.logging import logger
-from auth import login_and_get_cookie
+from helper.memory import MEMORY_BUDGET_MB, Content, content_size, exceeds_budget, new_spill_file, read_response
+from helper.rate_limit import rate_limited_request
+from helper.metrics import span, metrics_context, start_run
+from portal_client import PortalClient
 from datetime import datetime, timedelta
-import yaml
+from helper.config import load_config, render
+from helper.report_cache import load_cached_report, report_cache_key, store_cached_report
 
-BASE_URL = "https://advertising.amazon"
-COOKIE_STORAGE_PATH = Path(__file__).parent / "auth_state.json"
 CONFIG_FILE_PATH = Path(__file__).parent / "report_config" / "amazon_ads_report_config.yaml"
-with open(CONFIG_FILE_PATH, "r") as file:
-    config = yaml.safe_load(file)
+config = load_config(CONFIG_FILE_PATH)
 
 MARKET_PLACE_CONFIG_FILE_PATH = Path(__file__).parent / "report_config" / "market_place_config.yaml"
-with open(MARKET_PLACE_CONFIG_FILE_PATH, "r") as file:
-    market_place_config = yaml.safe_load(file)
-marketplace_config = None
-entity_id = None
+market_place_config = load_config(MARKET_PLACE_CONFIG_FILE_PATH)
+
+
+class AdsClient(PortalClient):
+    """Session of one account on Amazon Ads for a marketplace, with its CSRF token and ads entity id"""
+
+    BASE_URL = "https://advertising.amazon.{url_domain}"
+    amazon_ads = True
+    # Looked up by request_report, the entity id in market_place_config.yaml is only the default
+    entity_id = None
 
 
 def load_report_from_yaml(
@@ -34,7 +40,7 @@ def load_report_from_yaml(
     market_place: str,
 ):
     """
-    Load report configuration from a YAML file and update the start and end dates.
+    Get a copy of the report configuration with the start and end dates, url domain and entity id filled in.
 
     Args:
         report_name: Name of the report to load.
@@ -57,15 +63,16 @@ def load_report_from_yaml(
     logger.info(f"Report End Date Timestamp: {end_date_timestamp}")
 
     report = config.get("amazon_ads_report_config", {}).get(report_name)
-    global marketplace_config
     marketplace_config = market_place_config.get("marketplace_config", {}).get(market_place)
 
     if report and marketplace_config:
-        report["payload"]["reportStartDate"] = start_date_timestamp
-        report["payload"]["reportEndDate"] = end_date_timestamp
-        report["url"] = report["url"].format(url_domain=marketplace_config["url_domain"])
-        report["params"]["entityId"] = marketplace_config["entityId"]
-        return report
+        return render(
+            report,
+            start_date=start_date_timestamp,
+            end_date=end_date_timestamp,
+            url_domain=marketplace_config["url_domain"],
+            entityId=marketplace_config["entityId"],
+        )
     return None
 
 
@@ -98,7 +105,7 @@ def validate_parameters(report_start_date: str, report_end_date: str):
     wait=wait_fixed(5),
     retry=retry_if_result(lambda result: result[0] == 201 and result[1] is None),
 )
-def request_report(url: str, params: dict, payload: dict, cookie: dict, headers: dict):
+def request_report(url: str, params: dict, payload: dict, portal_client: AdsClient):
     """
     Request the sponsored brand report from Amazon Ads.
 
@@ -106,6 +113,7 @@ def request_report(url: str, params: dict, payload: dict, cookie: dict, headers:
         url: The URL to request the report.
         params: Query parameters for the request.
         payload: Request payload.
+        portal_client: Session of the account, its entity id is looked up first.
 
     Returns:
         A tuple containing the response status code and the report ID.
@@ -119,41 +127,46 @@ def request_report(url: str, params: dict, payload: dict, cookie: dict, headers:
 
     # Request payload
     payload = payload
-
-    global entity_id
+    marketplace_config = portal_client.marketplace_config
 
     try:
-        response = requests.get(
-            url=f"https://sellercentral.amazon.{marketplace_config["url_domain"]}/global-dashboard/rest/v1/widgets/link-farm/settings?category=ACCOUNT_MANAGEMENT",
-            cookies=cookie,
-        )
-
-        # Extract the value of 'encMerchantId'
-        response_json = response.json()
-        response_payload = json.loads(response_json["responsePayload"])
-        enc_merchant_id = response_payload["merchantLevelDataResponses"][0]["encMerchantId"]
-        logger.info(f"enc_merchant_id: {enc_merchant_id} ")
+        with span("entity_lookup"):
+            response = rate_limited_request(
+                "GET",
+                url=f"https://sellercentral.amazon.{marketplace_config["url_domain"]}/global-dashboard/rest/v1/widgets/link-farm/settings?category=ACCOUNT_MANAGEMENT",
+                cookies=portal_client.cookie,
+            )
 
-        locale = marketplace_config["locale"].replace("-", "_")
-        response = requests.get(
-            url=f"{BASE_URL}.{marketplace_config["url_domain"]}/reports/ref=xx_perftime_dnav_xx?merchantId={enc_merchant_id}&locale={locale}&ref=RedirectedFromSellerCentralByRoutingService",
-            cookies=cookie,
-        )
-        response_text = response.text
-        match = re.search(r'"entityId":\s?"([^"]+)"', response_text)
-        if match:
-            entity_id = match.group(1)
-            logger.info(f"Entity ID: {entity_id}")
-        else:
-            logger.info("entityId not found.")
+            # Extract the value of 'encMerchantId'
+            response_json = response.json()
+            response_payload = json.loads(response_json["responsePayload"])
+            enc_merchant_id = response_payload["merchantLevelDataResponses"][0]["encMerchantId"]
+            logger.info(f"enc_merchant_id: {enc_merchant_id} ")
+
+            locale = marketplace_config["locale"].replace("-", "_")
+            response = rate_limited_request(
+                "GET",
+                url=portal_client.url(f"/reports/ref=xx_perftime_dnav_xx?merchantId={enc_merchant_id}&locale={locale}&ref=RedirectedFromSellerCentralByRoutingService"),
+                cookies=portal_client.cookie,
+            )
+            response_text = response.text
+            match = re.search(r'"entityId":\s?"([^"]+)"', response_text)
+            if match:
+                portal_client.entity_id = match.group(1)
+                logger.info(f"Entity ID: {portal_client.entity_id}")
+            else:
+                logger.info("entityId not found.")
 
     except Exception as e:
         logger.error(f"Request failed while extracting entityID: {e}")
         return None, None
 
     try:
-        params["entityId"] = entity_id
-        response = requests.put(url=url, params=params, json=payload, cookies=cookie, headers=headers)
+        params["entityId"] = portal_client.entity_id
+        with span("submit"):
+            response = rate_limited_request(
+                "PUT", url=url, params=params, json=payload, cookies=portal_client.cookie, headers=portal_client.headers
+            )
 
         logger.info(f"Response Status: {response.status_code}")
         response.raise_for_status()
@@ -166,12 +179,13 @@ def request_report(url: str, params: dict, payload: dict, cookie: dict, headers:
         return None, None
 
 
-def check_report_status(requested_report_id: str, cookie: dict, headers: dict, retry_wait_time: int = 30):
+def check_report_status(requested_report_id: str, portal_client: AdsClient, retry_wait_time: int = 30):
     """
     Check the status of the requested report.
 
     Args:
         requested_report_id: The ID of the requested report.
+        portal_client: Session of the account.
         retry_wait_time: Time to wait between retries in seconds.
 
     Returns:
@@ -187,7 +201,7 @@ def check_report_status(requested_report_id: str, cookie: dict, headers: dict, r
         try:
             logger.info("Checking report Status")
 
-            url = f"{BASE_URL}.{marketplace_config["url_domain"]}/reports/api/subscriptions?entityId={entity_id}"
+            url = portal_client.url(f"/reports/api/subscriptions?entityId={portal_client.entity_id}")
 
             payload = {
                 "filters": [
@@ -195,11 +209,15 @@ def check_report_status(requested_report_id: str, cookie: dict, headers: dict, r
                 ]
             }
 
-            response = requests.post(url=url, json=payload, cookies=cookie, headers=headers)
+            with span("poll") as record:
+                response = rate_limited_request(
+                    "POST", url=url, json=payload, cookies=portal_client.cookie, headers=portal_client.headers
+                )
 
-            response.raise_for_status()
+                response.raise_for_status()
 
-            json_response = response.json()
+                json_response = response.json()
+                record["http_status"] = response.status_code
 
             if json_response.get("subscriptions", [{}])[0].get("earliestUnprocessedReportSummary", {}):
                 report_status = (
@@ -232,27 +250,88 @@ def check_report_status(requested_report_id: str, cookie: dict, headers: dict, r
     return inner()
 
 
+# xlsx files are zip compressed, parsed they take several times their size in memory
+XLSX_EXPANSION = 8
+
+
+def _csv_value(value) -> str:
+    """Format an Excel cell the way DataFrame.to_csv does."""
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.date().isoformat() if value.time() == datetime.min.time() else value.isoformat(sep=" ")
+    return str(value)
+
+
+def convert_excel_to_csv_streaming(excel_data: Content) -> tuple:
+    """
+    Convert the first sheet of an Excel report to a CSV file row by row with openpyxl's read-only mode.
+
+    Args:
+        excel_data: Excel report as bytes, or the path of a spilled file (removed once converted)
+
+    Returns:
+        tuple: (path of the spilled CSV file, number of rows)
+    """
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(
+        excel_data if isinstance(excel_data, Path) else BytesIO(excel_data), read_only=True, data_only=True
+    )
+    csv_path = new_spill_file(".csv")
+    rows = 0
+
+    try:
+        with open(csv_path, "w", encoding="utf-8", newline="") as file:
+            writer = csv.writer(file, lineterminator="\n")
+            for row in workbook.worksheets[0].iter_rows(values_only=True):
+                writer.writerow([_csv_value(value) for value in row])
+                rows += 1
+    finally:
+        workbook.close()
+
+    if isinstance(excel_data, Path):
+        excel_data.unlink()
+
+    return csv_path, max(rows - 1, 0)
+
+
 @retry(stop=stop_after_attempt(3), wait=wait_fixed(5), retry=retry_if_result(lambda result: result is None))
-def download_report_data(report_download_url: str, cookie: dict):
+def download_report_data(report_download_url: str, portal_client: AdsClient):
     """
     Download the report from the given URL.
 
+    Reports over the memory budget are streamed to disk and converted row by row.
+
     Args:
         report_download_url: The URL to download the report.
+        portal_client: Session of the account.
 
     Returns:
-        The CSV data of the report, or None if the download fails.
+        The CSV data of the report as bytes or the path of a spilled CSV file, or None if the download fails.
     """
     try:
         logger.info("Started downloading")
-        url = f"{BASE_URL}.{marketplace_config["url_domain"]}" + report_download_url
-        response = requests.get(url=url, cookies=cookie)
+        url = portal_client.url(report_download_url)
+        with span("download") as record:
+            response = rate_limited_request("GET", url=url, cookies=portal_client.cookie, stream=True)
 
-        response.raise_for_status()
+            response.raise_for_status()
+            excel_data = read_response(response, suffix=".xlsx")
+            record["bytes"] = content_size(excel_data)
+
+        with span("transform", bytes=content_size(excel_data)) as record:
+            if isinstance(excel_data, Path) or exceeds_budget(len(excel_data), expansion=XLSX_EXPANSION):
+                logger.info(f"Report exceeds the {MEMORY_BUDGET_MB} MB memory budget, converting row by row")
+                csv_data, record["rows"] = convert_excel_to_csv_streaming(excel_data)
+                record["chunked"] = True
+            else:
+                import pandas as pd
 
-        excel_file = BytesIO(response.content)
-        df = pd.read_excel(excel_file, engine="openpyxl")
-        csv_data = df.to_csv(index=False, encoding="utf-8").encode("utf-8")
+                excel_file = BytesIO(excel_data)
+                df = pd.read_excel(excel_file, engine="openpyxl")
+                csv_data = df.to_csv(index=False, encoding="utf-8").encode("utf-8")
+                record["rows"] = len(df)
         return csv_data
 
     except Exception as e:
@@ -269,8 +348,7 @@ def download_actual_report(
     file_prefix: str,
     folder_name: str,
     retry_wait_time: int,
-    cookie: dict,
-    headers: dict,
+    portal_client: AdsClient,
     client: str = "nexusbrand",
     brandname: str = "ExplodingKittens",
     bucket_name: str = "rpa_validation_bucket",
@@ -278,6 +356,9 @@ def download_actual_report(
     """
     Download Sponsored Brand Campaign report from Amazon Ads and upload to Google Cloud Storage.
 
+    A report of a final period that is in the report cache is uploaded from there, without a request. The
+    cache holds the report converted to CSV.
+
     Args:
         report_start_date: Start date in YYYY/MM/DD format.
         report_end_date: End date in YYYY/MM/DD format.
@@ -287,6 +368,7 @@ def download_actual_report(
         file_prefix: Prefix for the output file name.
         folder_name: Folder name to save the file.
         retry_wait_time: Time to wait between retries in seconds.
+        portal_client: Session of the account.
         client: Client name.
         brandname: Brand name.
         bucket_name: Google Cloud Storage bucket name.
@@ -296,50 +378,71 @@ def download_actual_report(
 
     Raises:
         ValueError: If date parameters are invalid.
+        QualityCheckError: If the report fails its data-quality rules, it is quarantined instead of uploaded.
         Exception: If any error occurs during download or upload process.
     """
     try:
         validate_parameters(report_start_date, report_end_date)
 
-        report_status, requested_report_id = request_report(
-            url=url, params=params, payload=payload, cookie=cookie, headers=headers
+        cache_key = report_cache_key(
+            "ads",
+            {"url": url, "params": params, "payload": payload},
+            portal_client.market_place,
+            portal_client.account,
+            report_start_date,
+            report_end_date,
         )
+        csv_data = load_cached_report(cache_key, suffix=".csv")
+
+        if csv_data is None:
+            report_status, requested_report_id = request_report(
+                url=url, params=params, payload=payload, portal_client=portal_client
+            )
+            if report_status != 201 or not requested_report_id:
+                return None
 
-        if report_status == 201 and requested_report_id:
             report_status, report_download_url = check_report_status(
-                requested_report_id, retry_wait_time=retry_wait_time, cookie=cookie, headers=headers
+                requested_report_id, retry_wait_time=retry_wait_time, portal_client=portal_client
             )
+            if report_status != "COMPLETED":
+                return None
 
-            if report_status == "COMPLETED":
-                start_date_formatted = datetime.strptime(report_start_date, "%Y/%m/%d").strftime("%Y%m%d")
-                end_date_formatted = datetime.strptime(report_end_date, "%Y/%m/%d").strftime("%Y%m%d")
-
-                output_file = f"{file_prefix}_{brandname}_{start_date_formatted}_{end_date_formatted}.csv"
-                csv_data = download_report_data(report_download_url, cookie)
-                file_path = save_content_to_file(content=csv_data, folder_name=folder_name, file_name=output_file)
-
-                if file_path:
-                    # Extract year and month from end_date
-                    end_date_obj = datetime.strptime(report_end_date, "%Y/%m/%d")
-                    year = end_date_obj.strftime("%Y")
-                    month = end_date_obj.strftime("%m")
-
-                    destination_blob_name = f"UIReport/AmazonSellingPartner/{client}/{brandname}/{file_prefix}/year={year}/month={month}/{output_file}"
-                    upload_to_gcs(
-                        local_file_name=output_file,
-                        local_folder_name=folder_name,
-                        bucket_name=bucket_name,
-                        destination_blob_name=destination_blob_name,
-                    )
-                else:
-                    logger.error("Failed to download report")
-                    return None
+            csv_data = download_report_data(report_download_url, portal_client)
+            store_cached_report(cache_key, csv_data)
 
-            else:
-                return None
-        else:
+        start_date_formatted = datetime.strptime(report_start_date, "%Y/%m/%d").strftime("%Y%m%d")
+        end_date_formatted = datetime.strptime(report_end_date, "%Y/%m/%d").strftime("%Y%m%d")
+
+        output_file = f"{file_prefix}_{brandname}_{start_date_formatted}_{end_date_formatted}.csv"
+        file_path = save_content_to_file(content=csv_data, folder_name=folder_name, file_name=output_file)
+
+        if not file_path:
+            logger.error("Failed to download report")
             return None
 
+        from helper.quality import check_landed_report
+
+        check_landed_report(
+            file_path=file_path,
+            folder_name=folder_name,
+            start_date=report_start_date,
+            end_date=report_end_date,
+            cache_key=cache_key,
+        )
+
+        # Extract year and month from end_date
+        end_date_obj = datetime.strptime(report_end_date, "%Y/%m/%d")
+        year = end_date_obj.strftime("%Y")
+        month = end_date_obj.strftime("%m")
+
+        destination_blob_name = f"UIReport/AmazonSellingPartner/{client}/{brandname}/{file_prefix}/year={year}/month={month}/{output_file}"
+        upload_to_gcs(
+            local_file_name=output_file,
+            local_folder_name=folder_name,
+            bucket_name=bucket_name,
+            destination_blob_name=destination_blob_name,
+        )
+
         return file_path
 
     except Exception as e:
@@ -356,53 +459,52 @@ if __name__ == "__main__":
         amazon_ads=True,
     )
 
-    report_list = args.report_list.split(",")
+    start_run(portal="amazon_ads", marketplace=args.market_place, brand=args.brandname)
 
-    cookie = {}
-    headers = {}
+    report_list = args.report_list.split(",")
 
-    while len(cookie) == 0 or len(headers) == 0:
-        reset_cookie(cookie_storage_path=COOKIE_STORAGE_PATH)
+    portal_client = AdsClient(
+        market_place=args.market_place,
+        username=args.user_name,
+        password=args.password,
+        otp_secret=args.otp_secret,
+        account=args.account,
+    )
 
-        cookie, headers = login_and_get_cookie(
-            amazon_ads=True,
-            market_place=args.market_place,
-            username=args.user_name,
-            password=args.password,
-            otp_secret=args.otp_secret,
-            account=args.account,
-        )
+    # A session without the CSRF token is logged in again
+    while not portal_client.has_session():
+        portal_client.login()
 
     for report_name in report_list:
 
-        logger.info(f"GENERATING REPORT FOR {report_name}")
+        with metrics_context(report=report_name):
+            logger.info(f"GENERATING REPORT FOR {report_name}")
 
-        report_config = load_report_from_yaml(
-            report_name=report_name,
-            report_start_date=args.start_date,
-            report_end_date=args.end_date,
-            market_place=args.market_place,
-        )
+            report_config = load_report_from_yaml(
+                report_name=report_name,
+                report_start_date=args.start_date,
+                report_end_date=args.end_date,
+                market_place=args.market_place,
+            )
 
-        url = report_config.get("url")
-        params = report_config.get("params")
-        payload = report_config.get("payload")
-        folder_name = report_config.get("folder_name")
-        file_prefix = report_config.get("file_prefix")
-        retry_wait_time = report_config.get("retry_wait_time")
-
-        download_actual_report(
-            report_start_date=args.start_date,
-            report_end_date=args.end_date,
-            url=url,
-            params=params,
-            payload=payload,
-            file_prefix=file_prefix,
-            folder_name=folder_name,
-            retry_wait_time=retry_wait_time,
-            client=args.client,
-            brandname=args.brandname,
-            bucket_name=args.bucket_name,
-            cookie=cookie,
-            headers=headers,
-        )
+            url = report_config.get("url")
+            params = report_config.get("params")
+            payload = report_config.get("payload")
+            folder_name = report_config.get("folder_name")
+            file_prefix = report_config.get("file_prefix")
+            retry_wait_time = report_config.get("retry_wait_time")
+
+            download_actual_report(
+                report_start_date=args.start_date,
+                report_end_date=args.end_date,
+                url=url,
+                params=params,
+                payload=payload,
+                file_prefix=file_prefix,
+                folder_name=folder_name,
+                retry_wait_time=retry_wait_time,
+                client=args.client,
+                brandname=args.brandname,
+                bucket_name=args.bucket_name,
+                portal_client=portal_client,
+            )
@@ -1,24 +1,30 @@
+import re
 import shutil
 from datetime import datetime
 from pathlib import Path
+from typing import TYPE_CHECKING
 import pyotp
-from playwright.sync_api import Page, Playwright, sync_playwright
 from tenacity import RetryCallState, retry, retry_if_exception_type, stop_after_attempt, wait_fixed
 from helper.logging import logger
-import yaml
+from helper.metrics import span
+from helper.config import load_config
+
+# Playwright is slow to import, it is only imported once a login starts, not for --help or argument errors
+if TYPE_CHECKING:
+    from playwright.sync_api import Page, Playwright
 
 # Constants
 MARKET_PLACE_CONFIG_FILE_PATH = Path(__file__).parent / "report_config" / "market_place_config.yaml"
-with open(MARKET_PLACE_CONFIG_FILE_PATH, "r") as file:
-    market_place_config = yaml.safe_load(file)
+market_place_config = load_config(MARKET_PLACE_CONFIG_FILE_PATH)
 
-USER_AGENT = (
-    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-    "AppleWebKit/537.36 (KHTML, like Gecko) "
-    "Chrome/119.0.0.0 Safari/537.36"
-)
-STORAGE_STATE_PATH = Path(__file__).parent / "auth_state.json"
+# Browser state (cookies, local storage) saved after a login, one file per account and marketplace
+STORAGE_STATE_DIR = Path(__file__).parent / "auth_state"
 SCREENSHOT_DIR = Path(__file__).parent / "screenshots"
+BROWSER_ARGS = [
+    "--disable-blink-features=AutomationControlled",
+    "--disable-web-security",
+    "--disable-features=IsolateOrigins,site-per-process",
+]
 
 # Timing constants
 WAIT_TIME = {
@@ -28,17 +34,19 @@ WAIT_TIME = {
     "page_load": 30000,
 }
 
-csrf_token = None
-headers = {}
-
-
 class AmazonAuthError(Exception):
     """Custom exception for Amazon authentication errors"""
 
     pass
 
 
-def take_screenshot(page: Page, prefix: str) -> Path:
+class SessionExpiredError(Exception):
+    """Raised when Amazon rejects the session cookie (401/403) and a new login is needed"""
+
+    pass
+
+
+def take_screenshot(page: "Page", prefix: str) -> Path:
     """Take a screenshot of the current page state"""
     SCREENSHOT_DIR.mkdir(parents=True, exist_ok=True)
     screenshot_path = SCREENSHOT_DIR / f"screenshot_{prefix}_{datetime.now().strftime(r'%Y%m%d_%H%M%S')}.png"
@@ -55,45 +63,244 @@ def log_retry_attempt(retry_state: RetryCallState) -> None:
         )
 
 
-def handle_2FA(page: Page, otp_secret: str) -> None:
-    """Handle the 2FA"""
+def handle_2FA(page: "Page", otp_secret: str):
+    """Steps of the 2FA, the code is generated when the login reaches the prompt so it is still valid"""
 
     # Handle 2FA
     logger.info("Handling 2FA...")
     totp = pyotp.TOTP(otp_secret)
     otp = totp.now()
     print(f"OTP: {otp}")
-    page.get_by_label("Enter OTP:").fill(otp)
-    page.get_by_label("Sign in").click()
-
-
-def handle_request(request):
-    global csrf_token
-    global headers
-    if csrf_token is None and "anti-csrftoken-a2z" in request.headers:
-        csrf_token = request.headers["anti-csrftoken-a2z"]
-        logger.info(f"Found CSRF token: {csrf_token}")
-        headers["anti-csrftoken-a2z"] = csrf_token
-
-
-def setup_browser(playwright: Playwright, headless: bool):
-    """Setup and return browser and context"""
-    browser = playwright.chromium.launch(
-        headless=headless,
-        args=[
-            "--disable-blink-features=AutomationControlled",
-            "--disable-web-security",
-            "--disable-features=IsolateOrigins,site-per-process",
-        ],
-    )
+    yield page.get_by_label("Enter OTP:").fill(otp)
+    yield page.get_by_label("Sign in").click()
+
+
+def capture_csrf_token(headers: dict):
+    """
+    Request listener for one login that stores the first anti-csrftoken-a2z header it sees in headers.
+
+    Args:
+        headers (dict): Headers returned by the login, the token is added to them.
+    """
+
+    def handle_request(request):
+        if "anti-csrftoken-a2z" not in headers and "anti-csrftoken-a2z" in request.headers:
+            headers["anti-csrftoken-a2z"] = request.headers["anti-csrftoken-a2z"]
+            logger.info(f"Found CSRF token: {headers['anti-csrftoken-a2z']}")
+
+    return handle_request
 
-    context = browser.new_context(
-        user_agent=USER_AGENT,
-        viewport={"width": 1920, "height": 1080},
-        storage_state=STORAGE_STATE_PATH if STORAGE_STATE_PATH.exists() else None,
+
+def storage_state_path(account: str, market_place: str) -> Path:
+    """Browser state file of an account and marketplace, runs for other accounts keep their own"""
+    name = re.sub(r"[^0-9A-Za-z_-]+", "_", f"{account}_{market_place}").strip("_")
+    return STORAGE_STATE_DIR / f"{name or 'default'}.json"
+
+
+def setup_browser(playwright: "Playwright", headless: bool):
+    """Launch the browser used for logging in"""
+    return playwright.chromium.launch(headless=headless, args=BROWSER_ARGS)
+
+
+def new_login_context(browser, state_path: Path = None):
+    """Browser context for one account, restored from its saved browser state if there is one"""
+    return browser.new_context(
+        locale="en-US", storage_state=state_path if state_path is not None and state_path.exists() else None
     )
 
-    return browser, context
+
+def sign_in_steps(
+    page,
+    context,
+    market_place: str,
+    username: str,
+    password: str,
+    otp_secret: str,
+    account: str,
+    amazon_ads: bool = False,
+    amazon_fulfillment: bool = False,
+):
+    """
+    The login flow, written once for Playwright's sync and async API.
+
+    Every page call is yielded to the driver running the flow, run_steps for a sync page and
+    auth_async.run_steps_async for an async one, which sends back its result or throws its error in.
+    Selector and wait changes therefore only have to be made here.
+
+    Returns:
+        tuple: Session cookies and headers, as the generator's return value.
+    """
+    headers = {}
+    marketplace_config = market_place_config.get("marketplace_config", {}).get(market_place)
+
+    # navigate to amazon seller central
+
+    yield page.goto("https://sellercentral.amazon.com/")
+    yield page.wait_for_load_state("networkidle")
+
+    if (yield page.get_by_role("link", name="Log in", exact=True).is_visible()):
+        yield page.get_by_role("link", name="Log in", exact=True).click()
+        yield page.get_by_label("Email or mobile phone number").click(modifiers=["ControlOrMeta"])
+        yield page.get_by_label("Email or mobile phone number").fill(username)
+        yield page.get_by_label("Continue").click()
+        yield page.get_by_label("Password").click()
+        yield page.get_by_label("Password").fill(password)
+        yield page.get_by_label("Sign in").click()
+
+        yield from handle_2FA(page=page, otp_secret=otp_secret)
+
+        yield page.wait_for_timeout(5000)
+        if not (yield page.get_by_role("button", name=market_place, exact=True).is_visible()):
+            yield page.get_by_role("button", name=account).click()
+        yield page.get_by_role("button", name=market_place, exact=True).click()
+        yield page.get_by_role("button", name="Select account").click()
+        yield page.wait_for_timeout(8000)
+
+        if (yield page.get_by_role("heading", name="Sign in", exact=True).count()) > 0:
+            yield page.get_by_label("Email or mobile phone number").click(modifiers=["ControlOrMeta"])
+            yield page.get_by_label("Email or mobile phone number").fill(username)
+            yield page.get_by_label("Continue").click()
+            yield page.get_by_label("Password").click()
+            yield page.get_by_label("Password").fill(password)
+            yield page.get_by_label("Sign in").click()
+            yield page.wait_for_timeout(30000)
+            yield from handle_2FA(page=page, otp_secret=otp_secret)
+
+        # Change the lanuguage
+        try:
+            if market_place != "United States":
+                yield page.get_by_label("Language").locator("div").filter(has_text="EN").locator("div").click()
+                yield page.get_by_role(
+                    "link",
+                    name=f"English {marketplace_config['english_country']} ({marketplace_config['locale']})",
+                ).click()
+                logger.info(
+                    f"Language changed to English {marketplace_config['english_country']} ({marketplace_config['locale']})"
+                )
+        except Exception:
+            logger.info(
+                f"Language Already Selected, English {marketplace_config['english_country']} ({marketplace_config['locale']})"
+            )
+
+    else:
+        logger.info("Already logged in, skipping login.")
+        if (yield page.get_by_role("button", name="Select account", exact=True).is_visible()):
+            yield page.get_by_role("button", name=market_place).click()
+            yield page.get_by_role("button", name="Select account").click()
+
+    if amazon_ads:
+        yield page.get_by_label("Navigation menu").click()
+        yield page.wait_for_timeout(20000)
+        # Listen to all requests
+        page.on("requestfinished", capture_csrf_token(headers))
+
+        yield page.locator("#sc-navbar-container").get_by_text("Reports", exact=True).click()
+        yield page.get_by_role("link", name="Advertising Reports External").click()
+        yield page.get_by_label("Sponsored ads reports", exact=True).click()
+
+    if amazon_fulfillment:
+        yield page.get_by_label("Navigation menu").click()
+        yield page.wait_for_timeout(10000)
+
+        # Listen to all requests
+        page.on("requestfinished", capture_csrf_token(headers))
+
+        yield page.locator("#sc-navbar-container").get_by_text("Reports", exact=True).click()
+        try:
+            yield page.get_by_role("link", name="Fulfillment Remove page from").click()
+        except Exception:
+            logger.info("Fulfillment Remove page from not found, trying another method")
+        try:
+            yield page.get_by_role("link", name="Fulfilment by Amazon Remove").click()
+        except Exception:
+            logger.info("Fulfilment by Amazon Remove, trying another method")
+        try:
+            yield page.get_by_role("link", name="Fulfillment Add page to").click()
+        except Exception:
+            logger.info("Fulfillment Add page to, trying another method")
+
+        try:
+            yield page.get_by_text("Show more...").nth(1).click()
+        except Exception:
+            pass
+        yield page.locator("#report-central-nav").get_by_role("link", name="All Orders").click()
+
+    # Collect session cookies
+    logger.info("Collecting session cookies...")
+    yield page.wait_for_timeout(10000)
+
+    # Get all cookies
+    all_cookies = yield context.cookies()
+    cookie = {cookie["name"]: cookie["value"] for cookie in all_cookies}
+
+    return cookie, headers
+
+
+def run_steps(steps):
+    """
+    Run a flow like sign_in_steps on a sync page.
+
+    Sync page calls already ran when they were yielded, their errors were raised inside the flow, so
+    every result is just sent back.
+
+    Returns:
+        The flow's return value.
+    """
+    try:
+        value = next(steps)
+        while True:
+            value = steps.send(value)
+    except StopIteration as stop:
+        return stop.value
+
+
+def sign_in(
+    page: "Page",
+    context,
+    market_place: str,
+    username: str,
+    password: str,
+    otp_secret: str,
+    account: str,
+    amazon_ads: bool = False,
+    amazon_fulfillment: bool = False,
+) -> tuple:
+    """
+    Log in on a page of the account's browser context and collect the session.
+
+    If the context's saved state is still signed in, the login form is skipped.
+
+    Returns:
+        tuple: Session cookies and headers, the headers hold the CSRF token for ads and fulfillment.
+
+    Raises:
+        AmazonAuthError: If the login fails, a screenshot of the page is saved.
+    """
+    try:
+        cookie, headers = run_steps(
+            sign_in_steps(
+                page=page,
+                context=context,
+                market_place=market_place,
+                username=username,
+                password=password,
+                otp_secret=otp_secret,
+                account=account,
+                amazon_ads=amazon_ads,
+                amazon_fulfillment=amazon_fulfillment,
+            )
+        )
+
+        # Cleanup
+        if SCREENSHOT_DIR.exists():
+            shutil.rmtree(SCREENSHOT_DIR, ignore_errors=True)
+
+        return cookie, headers
+
+    except Exception as e:
+        logger.error(f"\n=== ERROR ===\nURL: {page.url}\nError: {str(e)}")
+        take_screenshot(page, "error")
+        raise AmazonAuthError(f"Login failed: {str(e)}")
 
 
 @retry(
@@ -111,137 +318,88 @@ def login_and_get_cookie(
     headless: bool = True,
     amazon_ads: bool = False,
     amazon_fulfillment: bool = False,
-    context: Page = None,
-) -> str:
-    """Login to Amazon and get session cookie"""
+    expired_cookie: dict = None,
+) -> tuple:
+    """
+    Login to Amazon and get the session cookie and headers.
+
+    If the auth daemon (auth_daemon.py) is running, the session comes from its warm browser and is shared
+    with the other jobs of the account. Otherwise a browser is started for this login, restoring the
+    account's saved browser state.
+
+    Args:
+        market_place (str): Marketplace, e.g. "United States".
+        username (str): Amazon user name.
+        password (str): Amazon password.
+        otp_secret (str): TOTP secret of the 2FA.
+        account (str): Account to select after the login.
+        headless (bool): Run the local browser without a window.
+        amazon_ads (bool): Also capture the CSRF token of the advertising reports.
+        amazon_fulfillment (bool): Also capture the CSRF token of the fulfillment reports.
+        expired_cookie (dict): Cookie Amazon rejected, a new login is made instead of reusing the session.
+
+    Returns:
+        tuple: Session cookies and headers.
+
+    Raises:
+        AmazonAuthError: If the login fails.
+    """
+    # Imported here, auth_daemon imports this module
+    from auth_daemon import AuthDaemonError, AuthDaemonUnavailable, request_session
+
     logger.info("Logging in to Amazon...")
 
-    with sync_playwright() as p:
-        browser, context = setup_browser(p, headless)
-        context = browser.new_context(locale="en-US")
-        page = context.new_page()
-        global csrf_token
-        global headers
+    with span("login", account=account) as login_span:
         try:
-            marketplace_config = market_place_config.get("marketplace_config", {}).get(market_place)
-
-            # navigate to amazon seller central
-
-            page.goto("https://sellercentral.amazon.com/")
-            page.wait_for_load_state("networkidle")
-
-            if page.get_by_role("link", name="Log in", exact=True).is_visible():
-                page.get_by_role("link", name="Log in", exact=True).click()
-                page.get_by_label("Email or mobile phone number").click(modifiers=["ControlOrMeta"])
-                page.get_by_label("Email or mobile phone number").fill(username)
-                page.get_by_label("Continue").click()
-                page.get_by_label("Password").click()
-                page.get_by_label("Password").fill(password)
-                page.get_by_label("Sign in").click()
-
-                handle_2FA(page=page, otp_secret=otp_secret)
-
-                page.wait_for_timeout(5000)
-                if not page.get_by_role("button", name=market_place, exact=True).is_visible():
-                    page.get_by_role("button", name=account).click()
-                page.get_by_role("button", name=market_place, exact=True).click()
-                page.get_by_role("button", name="Select account").click()
-                page.wait_for_timeout(8000)
-
-                if page.get_by_role("heading", name="Sign in", exact=True).count() > 0:
-                    page.get_by_label("Email or mobile phone number").click(modifiers=["ControlOrMeta"])
-                    page.get_by_label("Email or mobile phone number").fill(username)
-                    page.get_by_label("Continue").click()
-                    page.get_by_label("Password").click()
-                    page.get_by_label("Password").fill(password)
-                    page.get_by_label("Sign in").click()
-                    page.wait_for_timeout(30000)
-                    handle_2FA(page=page, otp_secret=otp_secret)
-
-                # Change the lanuguage
-                try:
-                    if market_place != "United States":
-                        page.get_by_label("Language").locator("div").filter(has_text="EN").locator("div").click()
-                        page.get_by_role(
-                            "link",
-                            name=f"English {marketplace_config['english_country']} ({marketplace_config['locale']})",
-                        ).click()
-                        logger.info(
-                            f"Language changed to English {marketplace_config['english_country']} ({marketplace_config['locale']})"
-                        )
-                except:
-                    logger.info(
-                        f"Language Already Selected, English {marketplace_config['english_country']} ({marketplace_config['locale']})"
-                    )
-
-            else:
-                logger.info("Already logged in, skipping login.")
-                if page.get_by_role("button", name="Select account", exact=True).is_visible():
-                    page.get_by_role("button", name=market_place).click()
-                    page.get_by_role("button", name="Select account").click()
-
-            if amazon_ads:
-                page.get_by_label("Navigation menu").click()
-                page.wait_for_timeout(20000)
-                # Listen to all requests
-                page.on("requestfinished", handle_request)
-
-                page.locator("#sc-navbar-container").get_by_text("Reports", exact=True).click()
-                page.get_by_role("link", name="Advertising Reports External").click()
-                page.get_by_label("Sponsored ads reports", exact=True).click()
-
-            if amazon_fulfillment:
-                page.get_by_label("Navigation menu").click()
-                page.wait_for_timeout(10000)
-
-                # Listen to all requests
-                page.on("requestfinished", handle_request)
-
-                page.locator("#sc-navbar-container").get_by_text("Reports", exact=True).click()
-                try:
-                    page.get_by_role("link", name="Fulfillment Remove page from").click()
-                except:
-                    logger.info("Fulfillment Remove page from not found, trying another method")
-                try:
-                    page.get_by_role("link", name="Fulfilment by Amazon Remove").click()
-                except:
-                    logger.info("Fulfilment by Amazon Remove, trying another method")
-                try:
-                    page.get_by_role("link", name="Fulfillment Add page to").click()
-                except:
-                    logger.info("Fulfillment Add page to, trying another method")
-
-                try:
-                    page.get_by_text("Show more...").nth(1).click()
-                except:
-                    pass
-                page.locator("#report-central-nav").get_by_role("link", name="All Orders").click()
-
-            # Collect session cookies
-            logger.info("Collecting session cookies...")
-            page.wait_for_timeout(10000)
-
-            # Get all cookies
-            all_cookies = context.cookies()
-            cookie = {cookie["name"]: cookie["value"] for cookie in all_cookies}
-
-            # Cleanup
-            if SCREENSHOT_DIR.exists():
-                shutil.rmtree(SCREENSHOT_DIR)
-
-            # Save browser state
-            context.storage_state(path=STORAGE_STATE_PATH)
-
-            return cookie, headers
-
-        except Exception as e:
-            logger.error(f"\n=== ERROR ===\nURL: {page.url}\nError: {str(e)}")
-            take_screenshot(page, "error")
+            session = request_session(
+                market_place=market_place,
+                username=username,
+                password=password,
+                otp_secret=otp_secret,
+                account=account,
+                amazon_ads=amazon_ads,
+                amazon_fulfillment=amazon_fulfillment,
+                expired_cookie=expired_cookie,
+            )
+            login_span["auth_daemon"] = True
+            return session
+        except AuthDaemonUnavailable:
+            pass
+        except AuthDaemonError as e:
             raise AmazonAuthError(f"Login failed: {str(e)}")
 
-        finally:
-            context.close()
-            browser.close()
+        from playwright.sync_api import sync_playwright
+
+        state_path = storage_state_path(account, market_place)
+        if expired_cookie:
+            state_path.unlink(missing_ok=True)
+
+        with sync_playwright() as p:
+            browser = setup_browser(p, headless)
+            context = new_login_context(browser, state_path)
+            try:
+                page = context.new_page()
+                cookie, headers = sign_in(
+                    page=page,
+                    context=context,
+                    market_place=market_place,
+                    username=username,
+                    password=password,
+                    otp_secret=otp_secret,
+                    account=account,
+                    amazon_ads=amazon_ads,
+                    amazon_fulfillment=amazon_fulfillment,
+                )
+
+                # Save browser state
+                STORAGE_STATE_DIR.mkdir(parents=True, exist_ok=True)
+                context.storage_state(path=state_path)
+
+                return cookie, headers
+
+            finally:
+                context.close()
+                browser.close()
 
 
 if __name__ == "__main__":
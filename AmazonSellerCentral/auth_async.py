@@ -0,0 +1,238 @@
+"""
+Log in to many accounts at once: one Chromium with an isolated browser context per account and
+marketplace, driven by Playwright's async API.
+
+Each login restores and saves the account's browser state in auth_state/, the same files
+login_and_get_cookie uses, so refreshing all tenants in the morning lets the report jobs that follow
+start from a signed-in state.
+
+Usage:
+    python AmazonSellerCentral/auth_async.py --accounts accounts.json --concurrency 4
+
+The accounts file is a JSON list of login_and_get_cookie arguments:
+    [{"market_place": "United States", "username": "...", "password": "...", "otp_secret": "...",
+      "account": "...", "amazon_ads": false, "amazon_fulfillment": false}]
+"""
+
+import argparse
+import asyncio
+import inspect
+import json
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import TYPE_CHECKING
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_fixed
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from auth import (
+    BROWSER_ARGS,
+    SCREENSHOT_DIR,
+    STORAGE_STATE_DIR,
+    AmazonAuthError,
+    log_retry_attempt,
+    sign_in_steps,
+    storage_state_path,
+)
+from helper.logging import logger
+from helper.metrics import span
+
+if TYPE_CHECKING:
+    from playwright.async_api import Browser, BrowserContext, Page
+
+# Logins running at the same time, each one is a browser context with its own pages
+DEFAULT_CONCURRENCY = 4
+
+
+async def take_screenshot_async(page: "Page", prefix: str) -> Path:
+    """Take a screenshot of the current page state"""
+    SCREENSHOT_DIR.mkdir(parents=True, exist_ok=True)
+    screenshot_path = SCREENSHOT_DIR / f"screenshot_{prefix}_{datetime.now().strftime(r'%Y%m%d_%H%M%S')}.png"
+    await page.screenshot(path=str(screenshot_path), full_page=True)
+    logger.info(f"Screenshot saved to: {screenshot_path}")
+    return screenshot_path
+
+
+async def run_steps_async(steps):
+    """
+    Run a flow like auth.sign_in_steps on an async page.
+
+    Every yielded page call is awaited here, its result is sent back into the flow or its error thrown in,
+    so the flow's own try/except blocks handle it like they do on a sync page.
+
+    Returns:
+        The flow's return value.
+    """
+    value, error = None, None
+    try:
+        while True:
+            step = steps.throw(error) if error is not None else steps.send(value)
+            value, error = None, None
+            try:
+                value = await step if inspect.isawaitable(step) else step
+            except Exception as e:
+                error = e
+    except StopIteration as stop:
+        return stop.value
+
+
+async def sign_in_async(
+    page: "Page",
+    context: "BrowserContext",
+    market_place: str,
+    username: str,
+    password: str,
+    otp_secret: str,
+    account: str,
+    amazon_ads: bool = False,
+    amazon_fulfillment: bool = False,
+) -> tuple:
+    """
+    Async version of auth.sign_in, the same steps on a page of the account's own browser context.
+
+    Returns:
+        tuple: Session cookies and headers, the headers hold the CSRF token for ads and fulfillment.
+
+    Raises:
+        AmazonAuthError: If the login fails, a screenshot of the page is saved.
+    """
+    try:
+        return await run_steps_async(
+            sign_in_steps(
+                page=page,
+                context=context,
+                market_place=market_place,
+                username=username,
+                password=password,
+                otp_secret=otp_secret,
+                account=account,
+                amazon_ads=amazon_ads,
+                amazon_fulfillment=amazon_fulfillment,
+            )
+        )
+
+    except Exception as e:
+        logger.error(f"\n=== ERROR ===\nAccount: {account} ({market_place})\nURL: {page.url}\nError: {str(e)}")
+        await take_screenshot_async(page, f"error_{storage_state_path(account, market_place).stem}")
+        raise AmazonAuthError(f"Login failed for {account} ({market_place}): {str(e)}")
+
+
+@retry(
+    retry=retry_if_exception_type(AmazonAuthError),
+    stop=stop_after_attempt(3),
+    wait=wait_fixed(5),
+    before_sleep=log_retry_attempt,
+)
+async def login_account(
+    browser: "Browser",
+    market_place: str,
+    username: str,
+    password: str,
+    otp_secret: str,
+    account: str,
+    amazon_ads: bool = False,
+    amazon_fulfillment: bool = False,
+) -> tuple:
+    """
+    Log in to one account in a new browser context, restored from and saved to the account's state file.
+
+    Returns:
+        tuple: Session cookies and headers.
+
+    Raises:
+        AmazonAuthError: If the login fails three times.
+    """
+    state_path = storage_state_path(account, market_place)
+    context = await browser.new_context(locale="en-US", storage_state=state_path if state_path.exists() else None)
+    try:
+        page = await context.new_page()
+        with span("login", account=account, marketplace=market_place):
+            cookie, headers = await sign_in_async(
+                page=page,
+                context=context,
+                market_place=market_place,
+                username=username,
+                password=password,
+                otp_secret=otp_secret,
+                account=account,
+                amazon_ads=amazon_ads,
+                amazon_fulfillment=amazon_fulfillment,
+            )
+
+        STORAGE_STATE_DIR.mkdir(parents=True, exist_ok=True)
+        await context.storage_state(path=state_path)
+        return cookie, headers
+
+    finally:
+        await context.close()
+
+
+async def login_accounts(
+    accounts: list, concurrency: int = DEFAULT_CONCURRENCY, headless: bool = True, browser: "Browser" = None
+) -> dict:
+    """
+    Log in to several accounts in parallel in one browser.
+
+    Args:
+        accounts (list): Dicts with the arguments of login_and_get_cookie (market_place, username, password,
+            otp_secret, account and optionally amazon_ads or amazon_fulfillment).
+        concurrency (int): Logins running at the same time.
+        headless (bool): Run the browser without a window.
+        browser (Browser): Browser to use, by default one is launched for these logins and closed after.
+
+    Returns:
+        dict: (account, market_place) -> (cookie, headers) for every login that succeeded. Failed logins
+        are logged and left out.
+    """
+    from playwright.async_api import async_playwright
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def login(browser, account: dict) -> tuple:
+        async with semaphore:
+            logger.info(f"Logging in to {account['account']} ({account['market_place']})...")
+            return await login_account(browser=browser, **account)
+
+    async def login_all(browser) -> list:
+        return await asyncio.gather(*(login(browser, account) for account in accounts), return_exceptions=True)
+
+    if browser is not None:
+        results = await login_all(browser)
+    else:
+        async with async_playwright() as p:
+            browser = await p.chromium.launch(headless=headless, args=BROWSER_ARGS)
+            try:
+                results = await login_all(browser)
+            finally:
+                await browser.close()
+
+    sessions = {}
+    for account, result in zip(accounts, results):
+        key = (account["account"], account["market_place"])
+        if isinstance(result, BaseException):
+            logger.error(f"Login failed for {key[0]} ({key[1]}): {result}")
+        else:
+            sessions[key] = result
+
+    logger.info(f"Logged in to {len(sessions)} of {len(accounts)} accounts")
+    return sessions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Log in to several Amazon accounts in parallel")
+    parser.add_argument("--accounts", type=str, required=True, help="JSON file with the accounts to log in to")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help=f"Logins running at the same time (default: {DEFAULT_CONCURRENCY})",
+    )
+    parser.add_argument("--headed", action="store_true", help="Show the browser window")
+    args = parser.parse_args()
+
+    with open(args.accounts, "r", encoding="utf-8") as file:
+        accounts = json.load(file)
+
+    sessions = asyncio.run(login_accounts(accounts, concurrency=args.concurrency, headless=not args.headed))
+    if len(sessions) < len(accounts):
+        sys.exit(1)
@@ -0,0 +1,343 @@
+"""
+Auth daemon: one warm browser that logs in for every report job on this machine.
+
+It keeps a browser context per account and marketplace, restored from and saved to auth_state/, and
+hands the session cookies and CSRF headers to the jobs over a Unix socket. Logins run one at a time
+on the browser thread. Jobs asking for a session that is already being logged in wait for that login
+and share its result, so N parallel jobs of an account cost one login.
+
+The report scripts use the daemon when its socket exists and log in with their own browser otherwise.
+
+Usage:
+    python AmazonSellerCentral/auth_daemon.py --session_ttl 1800
+"""
+
+import argparse
+import json
+import os
+import queue
+import socket
+import socketserver
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from auth import STORAGE_STATE_DIR, new_login_context, setup_browser, sign_in, storage_state_path
+from helper.logging import logger
+from helper.metrics import span
+
+AUTH_DAEMON_SOCKET = Path(os.environ.get("AUTH_DAEMON_SOCKET", Path(__file__).parent / "auth_daemon.sock"))
+
+# Seconds a session is handed out before the daemon checks it again with the browser
+AUTH_SESSION_TTL = int(os.environ.get("AUTH_SESSION_TTL", 1800))
+
+# Seconds a job waits for its session, logins queued before it count towards this
+CLIENT_TIMEOUT = 600
+
+
+class AuthDaemonUnavailable(Exception):
+    """Raised when no auth daemon is listening, the job logs in with its own browser instead"""
+
+    pass
+
+
+class AuthDaemonError(Exception):
+    """Raised when the auth daemon could not log in"""
+
+    pass
+
+
+def session_flavor(amazon_ads: bool = False, amazon_fulfillment: bool = False) -> str:
+    """Kind of session a job needs, ads and fulfillment sessions carry their own CSRF token"""
+    if amazon_ads:
+        return "ads"
+    if amazon_fulfillment:
+        return "fulfillment"
+    return "seller"
+
+
+def session_id(cookie: dict) -> str:
+    """Session id of a cookie, None if there is no session"""
+    return (cookie or {}).get("session-id")
+
+
+class AuthDaemon:
+    """
+    Sessions of all accounts, logged in by one browser.
+
+    Playwright's sync API may only be used from the thread that started it, so every login is queued to
+    the browser thread. get_session is called from the socket handler threads.
+    """
+
+    def __init__(self, headless: bool = True, session_ttl: int = AUTH_SESSION_TTL):
+        self.headless = headless
+        self.session_ttl = session_ttl
+        self.jobs = queue.Queue()
+        self.ready = threading.Event()
+        self.lock = threading.Lock()
+        # (account, market_place, flavor) -> {"cookie", "headers", "created"}
+        self.sessions = {}
+        # (account, market_place, flavor) -> Future of the login in progress
+        self.in_flight = {}
+        # (account, market_place) -> browser context, only used on the browser thread
+        self.contexts = {}
+
+    def get_session(self, request: dict) -> tuple:
+        """
+        Get the session of an account, logging in if there is no valid one.
+
+        Args:
+            request (dict): Arguments of login_and_get_cookie.
+
+        Returns:
+            tuple: Session cookies and headers.
+        """
+        key = (
+            request["account"],
+            request["market_place"],
+            session_flavor(request.get("amazon_ads"), request.get("amazon_fulfillment")),
+        )
+        expired_session_id = session_id(request.get("expired_cookie"))
+
+        with self.lock:
+            session = self.sessions.get(key)
+            if (
+                session is not None
+                and time.monotonic() - session["created"] < self.session_ttl
+                # A job whose session was rejected gets the newer one if another job already logged in again
+                and (expired_session_id is None or session_id(session["cookie"]) != expired_session_id)
+            ):
+                logger.info(f"Sharing {key[2]} session of {key[0]} ({key[1]})")
+                return session["cookie"], session["headers"]
+
+            future = self.in_flight.get(key)
+            if future is None:
+                future = Future()
+                self.in_flight[key] = future
+                self.jobs.put((key, request, future))
+
+        return future.result()
+
+    def login(self, browser, key: tuple, request: dict, future: Future) -> None:
+        """Log in on the browser thread and resolve the jobs waiting for the session."""
+        account, market_place, flavor = key
+        state_path = storage_state_path(account, market_place)
+        context = self.contexts.get((account, market_place))
+        expired_session_id = session_id(request.get("expired_cookie"))
+
+        try:
+            # The session was rejected by Amazon, log in again from scratch
+            if context is not None and expired_session_id is not None:
+                cookies = {cookie["name"]: cookie["value"] for cookie in context.cookies()}
+                if session_id(cookies) == expired_session_id:
+                    self.close_context(account, market_place)
+                    state_path.unlink(missing_ok=True)
+                    context = None
+
+            if context is None:
+                context = new_login_context(browser, state_path)
+                self.contexts[(account, market_place)] = context
+
+            page = context.new_page()
+            try:
+                with span("login", account=account, flavor=flavor):
+                    cookie, headers = sign_in(
+                        page=page,
+                        context=context,
+                        market_place=market_place,
+                        username=request["username"],
+                        password=request["password"],
+                        otp_secret=request["otp_secret"],
+                        account=account,
+                        amazon_ads=flavor == "ads",
+                        amazon_fulfillment=flavor == "fulfillment",
+                    )
+            finally:
+                page.close()
+
+            STORAGE_STATE_DIR.mkdir(parents=True, exist_ok=True)
+            context.storage_state(path=state_path)
+
+        except Exception as e:
+            # The context may be half signed in, the next login starts from a new one
+            self.close_context(account, market_place)
+            with self.lock:
+                del self.in_flight[key]
+            future.set_exception(e)
+            return
+
+        with self.lock:
+            # Without its CSRF token an ads or fulfillment session is useless, the next job logs in again
+            if flavor == "seller" or headers:
+                self.sessions[key] = {"cookie": cookie, "headers": headers, "created": time.monotonic()}
+            del self.in_flight[key]
+        future.set_result((cookie, headers))
+
+    def close_context(self, account: str, market_place: str) -> None:
+        """Close the browser context of an account and forget its sessions."""
+        context = self.contexts.pop((account, market_place), None)
+        if context is not None:
+            try:
+                context.close()
+            except Exception as e:
+                logger.warning(f"Could not close the browser context of {account} ({market_place}): {e}")
+        with self.lock:
+            for key in [key for key in self.sessions if key[:2] == (account, market_place)]:
+                del self.sessions[key]
+
+    def run_browser(self) -> None:
+        """Start the browser and run the queued logins until stop is called."""
+        from playwright.sync_api import sync_playwright
+
+        with sync_playwright() as p:
+            browser = setup_browser(p, self.headless)
+            logger.info("Auth daemon browser started")
+            self.ready.set()
+            try:
+                while True:
+                    job = self.jobs.get()
+                    if job is None:
+                        break
+                    self.login(browser, *job)
+            finally:
+                for account, market_place in list(self.contexts):
+                    self.close_context(account, market_place)
+                browser.close()
+
+    def stop(self) -> None:
+        """Stop the browser thread after the login in progress."""
+        self.jobs.put(None)
+
+
+class AuthRequestHandler(socketserver.StreamRequestHandler):
+    """Answers newline-delimited JSON session requests with {"cookie", "headers"} or {"error"}."""
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                cookie, headers = self.server.auth_daemon.get_session(request)
+                response = {"cookie": cookie, "headers": headers}
+            except Exception as e:
+                logger.error(f"Auth daemon login failed: {str(e)}")
+                response = {"error": str(e)}
+            self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+
+
+def request_session(socket_path: Path = None, timeout: float = CLIENT_TIMEOUT, **request) -> tuple:
+    """
+    Get a session from the auth daemon.
+
+    Args:
+        socket_path (Path): Socket of the daemon, AUTH_DAEMON_SOCKET by default.
+        timeout (float): Seconds to wait for the session.
+        **request: Arguments of login_and_get_cookie.
+
+    Returns:
+        tuple: Session cookies and headers.
+
+    Raises:
+        AuthDaemonUnavailable: If no daemon is listening on the socket.
+        AuthDaemonError: If the daemon could not log in.
+    """
+    socket_path = Path(socket_path or AUTH_DAEMON_SOCKET)
+    if not hasattr(socket, "AF_UNIX") or not socket_path.exists():
+        raise AuthDaemonUnavailable(f"No auth daemon at {socket_path}")
+
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(timeout)
+    with client:
+        try:
+            client.connect(str(socket_path))
+        except (FileNotFoundError, ConnectionRefusedError) as e:
+            raise AuthDaemonUnavailable(f"No auth daemon at {socket_path}: {e}")
+        try:
+            client.sendall((json.dumps(request) + "\n").encode("utf-8"))
+            response = client.makefile("rb").readline()
+        except OSError as e:
+            raise AuthDaemonError(f"Auth daemon did not answer: {e}")
+
+    if not response:
+        raise AuthDaemonError("Auth daemon closed the connection")
+    response = json.loads(response)
+    if "error" in response:
+        raise AuthDaemonError(response["error"])
+
+    logger.info(f"Got session from the auth daemon at {socket_path}")
+    return response["cookie"], response["headers"]
+
+
+def remove_stale_socket(socket_path: Path) -> None:
+    """
+    Remove the socket file left by a daemon that did not shut down cleanly.
+
+    Raises:
+        RuntimeError: If another daemon is still listening on it.
+    """
+    if not socket_path.exists():
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+            client.connect(str(socket_path))
+        except ConnectionRefusedError:
+            socket_path.unlink(missing_ok=True)
+            return
+    raise RuntimeError(f"An auth daemon is already listening on {socket_path}")
+
+
+def serve(socket_path: Path = AUTH_DAEMON_SOCKET, headless: bool = True, session_ttl: int = AUTH_SESSION_TTL):
+    """
+    Run the auth daemon until it is interrupted.
+
+    Args:
+        socket_path (Path): Socket to listen on, only the current user may connect to it.
+        headless (bool): Run the browser without a window.
+        session_ttl (int): Seconds a session is shared before the browser checks it again.
+    """
+    socket_path = Path(socket_path)
+    remove_stale_socket(socket_path)
+
+    auth_daemon = AuthDaemon(headless=headless, session_ttl=session_ttl)
+    browser_thread = threading.Thread(target=auth_daemon.run_browser, name="auth-browser", daemon=True)
+    browser_thread.start()
+    while not auth_daemon.ready.wait(1):
+        if not browser_thread.is_alive():
+            raise RuntimeError("The auth daemon browser could not be started")
+
+    # The requests carry passwords and OTP secrets, the socket is created readable by its owner only
+    umask = os.umask(0o177)
+    try:
+        server = socketserver.ThreadingUnixStreamServer(str(socket_path), AuthRequestHandler)
+    finally:
+        os.umask(umask)
+    server.daemon_threads = True
+    server.auth_daemon = auth_daemon
+
+    logger.info(f"Auth daemon listening on {socket_path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Stopping auth daemon")
+    finally:
+        server.server_close()
+        socket_path.unlink(missing_ok=True)
+        auth_daemon.stop()
+        browser_thread.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep one browser logged in to Amazon for all report jobs")
+    parser.add_argument("--socket", type=str, default=str(AUTH_DAEMON_SOCKET), help="Unix socket to listen on")
+    parser.add_argument("--headed", action="store_true", help="Show the browser window")
+    parser.add_argument(
+        "--session_ttl",
+        type=int,
+        default=AUTH_SESSION_TTL,
+        help=f"Seconds a session is shared before it is checked again (default: {AUTH_SESSION_TTL})",
+    )
+    args = parser.parse_args()
+
+    serve(socket_path=Path(args.socket), headless=not args.headed, session_ttl=args.session_ttl)
@@ -1,34 +1,57 @@
 import sys
+import time
 from pathlib import Path
 
 sys.path.append(str(Path(__file__).resolve().parent.parent))
-from datetime import datetime
+from datetime import datetime, timedelta
 import requests
 from tenacity import retry, stop_after_attempt, wait_fixed, retry_if_result
-from auth import login_and_get_cookie
-from io import StringIO
-import pandas as pd
-from helper.utils import save_content_to_file, parse_args, upload_to_gcs, reset_cookie
+from io import BytesIO, StringIO
+from helper.utils import save_content_to_file, parse_args, upload_to_gcs
 from helper.logging import logger
-import yaml
-
-COOKIE_STORAGE_PATH = Path(__file__).parent / "auth_state.json"
+from helper.memory import (
+    CHUNK_ROWS,
+    MEMORY_BUDGET_MB,
+    Content,
+    content_size,
+    exceeds_budget,
+    new_spill_file,
+    read_response,
+)
+from helper.rate_limit import rate_limited_request
+from helper.metrics import span, metrics_context, start_run
+from helper.config import get_report_config, load_config
+from helper.report_cache import load_cached_report, report_cache_key, store_cached_report
+from portal_client import PortalClient
 
 CONFIG_FILE_PATH = Path(__file__).parent / "report_config" / "fulfillment_all_reports_config.yaml"
-with open(CONFIG_FILE_PATH, "r") as file:
-    config = yaml.safe_load(file)
+config = load_config(CONFIG_FILE_PATH)
+
+# Report central status polling, in batch mode and for check_download_status
+STATUS_POLL_INTERVAL = 30
+STATUS_MAX_POLLS = 15
+PENDING_STATUSES = ["InQueue", "InProgress"]
+
+# Lists the reports generated so far for a reportFRPId, as on the report's download history page
+REPORT_HISTORY_PATH = "/getDownloadReportHistory"
 
-MARKET_PLACE_CONFIG_FILE_PATH = Path(__file__).parent / "report_config" / "market_place_config.yaml"
-with open(MARKET_PLACE_CONFIG_FILE_PATH, "r") as file:
-    market_place_config = yaml.safe_load(file)
-marketplace_config = None
+# TSV reports are read with every value kept as its text, in memory and in chunks alike, so a report lands
+# the same whatever its size (no "00123" -> "123", reformatted floats or "NA" -> empty)
+TSV_READ_OPTIONS = {"sep": "\t", "encoding": "utf-8", "dtype": str, "keep_default_na": False}
 
-BASE_URL = None
 
+class FulfillmentClient(PortalClient):
+    """Session of one account on the report central API of a marketplace, with its CSRF token"""
 
-def load_report_from_yaml(report_name: str, market_place: str, start_date: str = None, end_date: str = None) -> dict:
+    BASE_URL = "https://sellercentral.amazon.{fulfillment_url_domain}/reportcentral/api/v1"
+    amazon_fulfillment = True
+
+
+def load_report_from_yaml(report_name: str, start_date: str = None, end_date: str = None) -> dict:
     """
-    Load configuration details from a YAML file based on the report name and replace start_date and end_date if provided.
+    Get a copy of the configuration of a report, with start_date and end_date filled in if provided.
+
+    The copy belongs to the caller, changing it does not affect other reports or jobs.
 
     Args:
         report_name: Name of the report to load configuration for
@@ -37,20 +60,14 @@ def load_report_from_yaml(report_name: str, market_place: str, start_date: str =
 
     Returns:
         dict: Configuration details for the specified report
+
+    Raises:
+        ConfigError: If the report is not defined
     """
-    global BASE_URL
-    global marketplace_config
-    marketplace_config = market_place_config.get("marketplace_config", {}).get(market_place)
-    BASE_URL = f"https://sellercentral.amazon.{marketplace_config["fulfillment_url_domain"]}/reportcentral/api/v1"
-
-    report_config = config["fulfillment_reports_config"].get(report_name, {})
-
-    if "reportStartDate" in report_config.get("params", {}) and "reportEndDate" in report_config.get("params", {}):
-        if start_date:
-            report_config["params"]["reportStartDate"] = start_date
-        if end_date:
-            report_config["params"]["reportEndDate"] = end_date
-    else:
+    dates = {key: value for key, value in {"start_date": start_date, "end_date": end_date}.items() if value}
+    report_config = get_report_config(config, "fulfillment_reports_config", report_name, **dates)
+
+    if "reportStartDate" not in report_config["params"] or "reportEndDate" not in report_config["params"]:
         today = datetime.now().strftime("%Y/%m/%d")
         report_config["params"]["reportStartDate"] = today
         report_config["params"]["reportEndDate"] = today
@@ -83,17 +100,15 @@ def validate_parameters(report_start_date: str, report_end_date: str):
 
 
 def request_report(
-    cookie: dict,
+    portal_client: FulfillmentClient,
     params: dict,
-    headers: dict,
 ) -> str:
     """
     Request an report from Amazon Seller Central.
 
     Args:
-        cookie: Configured session cookie dict
+        portal_client: Session of the account
         params: Parameters for the report request
-        headers: Headers for the request
 
     Returns:
         tuple: A tuple containing (report_reference_id, report_status)
@@ -106,14 +121,16 @@ def request_report(
     try:
         logger.info("Requesting report...")
 
-        url = BASE_URL + "/submitDownloadReport"
+        url = portal_client.url("/submitDownloadReport")
 
-        response = requests.post(
-            url=url,
-            params=params,
-            cookies=cookie,
-            headers=headers,
-        )
+        with span("submit"):
+            response = rate_limited_request(
+                "POST",
+                url=url,
+                params=params,
+                cookies=portal_client.cookie,
+                headers=portal_client.headers,
+            )
 
         logger.info(f" Response Status: {response.status_code}")
         response.raise_for_status()
@@ -134,17 +151,82 @@ def request_report(
         return None, None
 
 
+def parse_report_date(value: str):
+    """Parse a YYYY/MM/DD or ISO date from the report history, None if it is neither."""
+    for date_format in ("%Y/%m/%d", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(str(value)[:10], date_format)
+        except ValueError:
+            pass
+    return None
+
+
+def find_existing_report(portal_client: FulfillmentClient, params: dict):
+    """
+    Look for a finished report of the same type and date range that was generated before, e.g. by an
+    earlier run, so it can be downloaded without waiting for a new one.
+
+    Only reports generated after the end of their date range are reused, earlier ones may miss data.
+    Snapshot reports without a date range (e.g. FBA Inventory) are always generated again.
+
+    Args:
+        portal_client: Session of the account
+        params: Parameters the report would be requested with
+
+    Returns:
+        str: Reference ID of the matching report
+        None: If there is none, or the history could not be read
+    """
+    if "reportStartDate" not in params or "reportEndDate" not in params:
+        return None
+
+    start_date = datetime.strptime(params["reportStartDate"], "%Y/%m/%d")
+    end_date = datetime.strptime(params["reportEndDate"], "%Y/%m/%d")
+    # Generated once the range was over
+    complete_after = (end_date + timedelta(days=1)).timestamp() * 1000
+
+    try:
+        logger.info("Looking for an existing report...")
+        history_url = portal_client.url(REPORT_HISTORY_PATH)
+        with span("lookup") as record:
+            response = rate_limited_request(
+                "GET", url=history_url, params={"reportFRPId": params.get("reportFRPId")}, cookies=portal_client.cookie
+            )
+            response.raise_for_status()
+            history = response.json()
+
+            for report in history:
+                if (
+                    report.get("status") == "Done"
+                    and parse_report_date(report.get("reportStartDate")) == start_date
+                    and parse_report_date(report.get("reportEndDate")) == end_date
+                    and (report.get("requestDate") or 0) >= complete_after
+                ):
+                    record["reused"] = True
+                    logger.info(f"Reusing report {report['reportReferenceId']} requested at {report['requestDate']}")
+                    return report["reportReferenceId"]
+
+            record["reused"] = False
+
+        logger.info("No existing report found")
+        return None
+
+    except (requests.exceptions.RequestException, ValueError, TypeError, AttributeError, KeyError) as e:
+        logger.warning(f"Could not look up existing reports, generating a new one: {e}")
+        return None
+
+
 @retry(
-    stop=stop_after_attempt(15),
-    wait=wait_fixed(30),
-    retry=retry_if_result(lambda result: result in ["InQueue", "InProgress"]),
+    stop=stop_after_attempt(STATUS_MAX_POLLS),
+    wait=wait_fixed(STATUS_POLL_INTERVAL),
+    retry=retry_if_result(lambda result: result in PENDING_STATUSES),
 )
-def check_download_status(cookie: dict, report_reference_id: str):
+def check_download_status(portal_client: FulfillmentClient, report_reference_id: str):
     """
     Check the status of a report download request.
 
     Args:
-        cookie: Configured session cookie dict
+        portal_client: Session of the account
         report_reference_id: Reference ID of the report request
 
     Returns:
@@ -152,11 +234,15 @@ def check_download_status(cookie: dict, report_reference_id: str):
         None: If the request to Amazon fails
     """
     try:
-        status_url = BASE_URL + "/getDownloadReportStatus"
-        response = requests.get(url=status_url, params=[("referenceIds", report_reference_id)], cookies=cookie)
-        response.raise_for_status()
-        json_data = response.json()
-        status = json_data[0] if json_data else None
+        status_url = portal_client.url("/getDownloadReportStatus")
+        with span("poll") as record:
+            response = rate_limited_request(
+                "GET", url=status_url, params=[("referenceIds", report_reference_id)], cookies=portal_client.cookie
+            )
+            response.raise_for_status()
+            json_data = response.json()
+            status = json_data[0] if json_data else None
+            record["report_status"] = status
 
         logger.info(f"Executed Check Download status function. Status: {status}")
 
@@ -167,45 +253,122 @@ def check_download_status(cookie: dict, report_reference_id: str):
         return None
 
 
-def download_report_data(cookie: dict, report_reference_id: str, file_format: str):
+def check_download_statuses(portal_client: FulfillmentClient, report_reference_ids: list) -> dict:
+    """
+    Check the status of several report download requests in one call.
+
+    Args:
+        portal_client: Session of the account
+        report_reference_ids: Reference IDs of the report requests
+
+    Returns:
+        dict: Status per reference ID ('Done', 'InQueue', 'InProgress', etc.)
+        None: If the request to Amazon fails
+    """
+    try:
+        status_url = portal_client.url("/getDownloadReportStatus")
+        with span("poll", reports=len(report_reference_ids)) as record:
+            response = rate_limited_request(
+                "GET",
+                url=status_url,
+                params=[("referenceIds", report_reference_id) for report_reference_id in report_reference_ids],
+                cookies=portal_client.cookie,
+            )
+            response.raise_for_status()
+            # Statuses are returned in the order of the referenceIds
+            statuses = dict(zip(report_reference_ids, response.json()))
+            record["done"] = sum(status == "Done" for status in statuses.values())
+
+        logger.info(f"Executed Check Download statuses function. Statuses: {statuses}")
+
+        return statuses
+
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Request failed: {e}")
+        return None
+
+
+def download_report_data(portal_client: FulfillmentClient, report_reference_id: str, file_format: str):
     """
     Download a ready report from Amazon Seller Central.
 
     Args:
-        cookie: Configured session cookie dict
+        portal_client: Session of the account
         report_reference_id: Reference ID of the report to download
         file_format: Format of the report file (default: "TSV")
 
     Returns:
-        tuple: A tuple containing (status_code, report_content)
-        None: If the download fails
+        tuple: A tuple containing (status_code, report_content), report_content is None if Amazon answered
+            with an error status
+
+    Raises:
+        requests.exceptions.RequestException: If the connection fails or drops while the report is read
     """
 
     logger.info("Downloading report...")
     try:
-        download_url = BASE_URL + "/downloadFile"
-        response = requests.get(
-            url=download_url,
-            params=[("referenceId", report_reference_id), ("fileFormat", file_format)],
-            cookies=cookie,
-        )
-        response.raise_for_status()
+        download_url = portal_client.url("/downloadFile")
+        with span("download") as record:
+            response = rate_limited_request(
+                "GET",
+                url=download_url,
+                params=[("referenceId", report_reference_id), ("fileFormat", file_format)],
+                cookies=portal_client.cookie,
+                stream=True,
+            )
+            response.raise_for_status()
+            report_content = read_response(response, suffix=f".{file_format.lower()}")
+            record["bytes"] = content_size(report_content)
         logger.info(f"{file_format} data saved successfully for report with reference id:{report_reference_id} ")
 
-    except Exception as e:
-        logger.error(f"Failed to save data. Status code: {response.status_code}")
-        return response.status_code, None
+    except requests.exceptions.HTTPError as e:
+        logger.error(f"Failed to save data. Status code: {e.response.status_code}")
+        return e.response.status_code, None
 
-    report_content = response.content if isinstance(response.content, bytes) else response.text.encode("utf-8")
     return response.status_code, report_content
 
 
-def convert_tsv_to_csv(tsv_data: bytes) -> None:
+def convert_tsv_to_csv_in_chunks(tsv_data: Content) -> tuple:
     """
-    Convert TSV data to CSV format and save to file.
+    Convert TSV data to a CSV file chunk by chunk, so only CHUNK_ROWS rows are in memory at a time.
+
+    Values are kept as the text in the report (TSV_READ_OPTIONS), like convert_tsv_to_csv does in memory.
 
     Args:
-        tsv_data: String containing TSV formatted data
+        tsv_data: TSV data as bytes, or the path of a spilled TSV file (removed once converted)
+
+    Returns:
+        tuple: (path of the spilled CSV file, number of rows)
+    """
+    import pandas as pd
+
+    source = tsv_data if isinstance(tsv_data, Path) else BytesIO(tsv_data)
+    csv_path = new_spill_file(".csv")
+    rows = 0
+
+    with open(csv_path, "w", encoding="utf-8", newline="") as file:
+        chunks = pd.read_csv(source, chunksize=CHUNK_ROWS, **TSV_READ_OPTIONS)
+        for chunk in chunks:
+            chunk.to_csv(file, index=False, header=rows == 0)
+            rows += len(chunk)
+
+    if isinstance(tsv_data, Path):
+        tsv_data.unlink()
+
+    return csv_path, rows
+
+
+def convert_tsv_to_csv(tsv_data: Content) -> Content:
+    """
+    Convert TSV data to CSV format.
+
+    Data over the memory budget, or already spilled to disk, is converted in chunks to a spilled CSV file.
+
+    Args:
+        tsv_data: TSV data as bytes, or the path of a spilled TSV file
+
+    Returns:
+        Content: CSV data as bytes, or the path of the spilled CSV file
 
     Raises:
         Exception: If there's an error during conversion or file saving
@@ -213,13 +376,23 @@ def convert_tsv_to_csv(tsv_data: bytes) -> None:
 
     try:
         logger.info("Started converting TSV data to CSV file")
-        tsv_data = tsv_data.decode("utf-8")
-        # Read TSV data
-        string_buffer = StringIO(tsv_data)
-        df = pd.read_csv(string_buffer, sep="\t", encoding="utf-8")
+        with span("transform", bytes=content_size(tsv_data)) as record:
+            if isinstance(tsv_data, Path) or exceeds_budget(len(tsv_data)):
+                logger.info(f"Report exceeds the {MEMORY_BUDGET_MB} MB memory budget, converting in chunks")
+                csv_data, record["rows"] = convert_tsv_to_csv_in_chunks(tsv_data)
+                record["chunked"] = True
+                return csv_data
 
-        # Convert DataFrame to CSV string
-        csv_data = df.to_csv(index=False, encoding="utf-8").encode("utf-8")
+            import pandas as pd
+
+            tsv_data = tsv_data.decode("utf-8")
+            # Read TSV data
+            string_buffer = StringIO(tsv_data)
+            df = pd.read_csv(string_buffer, **TSV_READ_OPTIONS)
+
+            # Convert DataFrame to CSV string
+            csv_data = df.to_csv(index=False, encoding="utf-8").encode("utf-8")
+            record["rows"] = len(df)
 
         return csv_data
 
@@ -235,15 +408,17 @@ def download_filfillments_report(
     params: dict,
     folder_name: str,
     file_prefix: str,
-    cookie: dict,
-    headers: dict,
+    portal_client: FulfillmentClient,
     client: str = "nexusbrand",
     brandname: str = "ExplodingKittens",
     bucket_name: str = "rpa_validation_bucket",
+    reuse_existing: bool = True,
 ):
     """
     Download report from Amazon Seller Central and upload to Google Cloud Storage.
 
+    A report of a final period that is in the report cache is uploaded from there, without a request.
+
     Args:
         report_start_date: Start date in YYYY/MM/DD format
         report_end_date: End date in YYYY/MM/DD format
@@ -251,9 +426,11 @@ def download_filfillments_report(
         params: Parameters for the report request
         folder_name: Folder name to save the report
         file_prefix: Prefix for the output file
+        portal_client: Session of the account
         client: Client name for GCS path organization (default: "nexusbrand")
         brandname: Brand name for filename and GCS path (default: "ExplodingKittens")
         bucket_name: Google Cloud Storage bucket name (default: "rpa_validation_bucket")
+        reuse_existing: Download a matching report generated earlier instead of requesting a new one (default: True)
 
     Raises:
         ValueError: If date parameters are invalid
@@ -264,46 +441,319 @@ def download_filfillments_report(
 
         validate_parameters(report_start_date, report_end_date)
 
-        report_reference_id, report_status = request_report(cookie=cookie, params=params, headers=headers)
+        cache_key = report_key(portal_client=portal_client, params=params)
+        cached_data = load_cached_report(cache_key, suffix=f".{reportFileFormat.lower()}")
+        if cached_data is not None:
+            upload_report_data(
+                data=cached_data,
+                report_start_date=report_start_date,
+                report_end_date=report_end_date,
+                reportFileFormat=reportFileFormat,
+                folder_name=folder_name,
+                file_prefix=file_prefix,
+                client=client,
+                brandname=brandname,
+                bucket_name=bucket_name,
+                cache_key=cache_key,
+            )
+            return
+
+        report_reference_id = (
+            find_existing_report(portal_client=portal_client, params=params) if reuse_existing else None
+        )
+        if report_reference_id:
+            report_status = "Done"
+        else:
+            report_reference_id, report_status = request_report(portal_client=portal_client, params=params)
 
         logger.info(f"Report Reference ID: {report_reference_id}    Report Status: {report_status}")
 
         if report_status != "Done":
-            download_request_status = check_download_status(cookie=cookie, report_reference_id=report_reference_id)
+            download_request_status = check_download_status(
+                portal_client=portal_client, report_reference_id=report_reference_id
+            )
 
             if download_request_status != "Done":
                 logger.error("Maximum retry reached. Report can not be downloaded")
                 return
 
-        status_code, data = download_report_data(
-            cookie=cookie, report_reference_id=report_reference_id, file_format=reportFileFormat
+        download_and_upload_report(
+            report_reference_id=report_reference_id,
+            report_start_date=report_start_date,
+            report_end_date=report_end_date,
+            reportFileFormat=reportFileFormat,
+            folder_name=folder_name,
+            file_prefix=file_prefix,
+            portal_client=portal_client,
+            client=client,
+            brandname=brandname,
+            bucket_name=bucket_name,
+            cache_key=cache_key,
         )
 
-        if status_code == 200 and data != None:
+    except Exception as e:
+        logger.error("Some Error ocurred while downloading")
+        raise e
 
-            start_date_formatted = datetime.strptime(report_start_date, "%Y/%m/%d").strftime("%Y%m%d")
-            end_date_formatted = datetime.strptime(report_end_date, "%Y/%m/%d").strftime("%Y%m%d")
 
-            output_file = f"{file_prefix}_{brandname}_{start_date_formatted}_{end_date_formatted}.csv"
-            if reportFileFormat == "TSV":
-                data = convert_tsv_to_csv(tsv_data=data)
+def report_key(portal_client: FulfillmentClient, params: dict) -> str:
+    """
+    Report cache key of a report request, None unless its date range is final.
+
+    Reports without a date range, like FBA Inventory, are requested for today and never cached.
+    """
+    return report_cache_key(
+        "fulfillment",
+        params,
+        portal_client.market_place,
+        portal_client.account,
+        params.get("reportStartDate"),
+        params.get("reportEndDate"),
+    )
 
-            # Save using the utility function
-            file_path = save_content_to_file(content=data, folder_name=folder_name, file_name=output_file)
 
-            # Extract year and month from report_end_date
-            end_date = datetime.strptime(report_end_date, "%Y/%m/%d")
-            destination_blob_name = f"UIReport/AmazonSellingPartner/{client}/{brandname}/{file_prefix}/year={end_date.strftime('%Y')}/month={end_date.strftime('%m')}/{output_file}"
-            upload_to_gcs(
-                local_file_name=output_file,
-                local_folder_name=folder_name,
-                bucket_name=bucket_name,
-                destination_blob_name=destination_blob_name,
+def download_and_upload_report(
+    report_reference_id: str,
+    report_start_date: str,
+    report_end_date: str,
+    reportFileFormat: str,
+    folder_name: str,
+    file_prefix: str,
+    portal_client: FulfillmentClient,
+    client: str = "nexusbrand",
+    brandname: str = "ExplodingKittens",
+    bucket_name: str = "rpa_validation_bucket",
+    cache_key: str = None,
+):
+    """
+    Download a ready report, convert it to CSV, save it and upload it to Google Cloud Storage.
+
+    Args:
+        report_reference_id: Reference ID of the ready report
+        report_start_date: Start date in YYYY/MM/DD format
+        report_end_date: End date in YYYY/MM/DD format
+        reportFileFormat: Format of the report file
+        folder_name: Folder name to save the report
+        file_prefix: Prefix for the output file
+        portal_client: Session of the account
+        client: Client name for GCS path organization (default: "nexusbrand")
+        brandname: Brand name for filename and GCS path (default: "ExplodingKittens")
+        bucket_name: Google Cloud Storage bucket name (default: "rpa_validation_bucket")
+        cache_key: Report cache key from report_key, the download is cached under it (optional)
+
+    Raises:
+        RuntimeError: If the report could not be downloaded
+        QualityCheckError: If the report fails its data-quality rules, it is quarantined instead of uploaded
+    """
+    status_code, data = download_report_data(
+        portal_client=portal_client, report_reference_id=report_reference_id, file_format=reportFileFormat
+    )
+
+    if status_code != 200 or data is None:
+        raise RuntimeError(f"Report {report_reference_id} could not be downloaded, status code {status_code}")
+
+    store_cached_report(cache_key, data)
+    upload_report_data(
+        data=data,
+        report_start_date=report_start_date,
+        report_end_date=report_end_date,
+        reportFileFormat=reportFileFormat,
+        folder_name=folder_name,
+        file_prefix=file_prefix,
+        client=client,
+        brandname=brandname,
+        bucket_name=bucket_name,
+        cache_key=cache_key,
+    )
+
+
+def upload_report_data(
+    data: Content,
+    report_start_date: str,
+    report_end_date: str,
+    reportFileFormat: str,
+    folder_name: str,
+    file_prefix: str,
+    client: str = "nexusbrand",
+    brandname: str = "ExplodingKittens",
+    bucket_name: str = "rpa_validation_bucket",
+    cache_key: str = None,
+):
+    """
+    Convert downloaded or cached report data to CSV, save it and upload it to Google Cloud Storage.
+
+    Args:
+        data: Report data as bytes, or the path of a spilled file (removed once saved)
+        report_start_date: Start date in YYYY/MM/DD format
+        report_end_date: End date in YYYY/MM/DD format
+        reportFileFormat: Format of the report file
+        folder_name: Folder name to save the report
+        file_prefix: Prefix for the output file
+        client: Client name for GCS path organization (default: "nexusbrand")
+        brandname: Brand name for filename and GCS path (default: "ExplodingKittens")
+        bucket_name: Google Cloud Storage bucket name (default: "rpa_validation_bucket")
+        cache_key: Report cache key of the data, removed from the cache if the report fails its checks (optional)
+
+    Raises:
+        QualityCheckError: If the report fails its data-quality rules, it is quarantined instead of uploaded
+    """
+    start_date_formatted = datetime.strptime(report_start_date, "%Y/%m/%d").strftime("%Y%m%d")
+    end_date_formatted = datetime.strptime(report_end_date, "%Y/%m/%d").strftime("%Y%m%d")
+
+    output_file = f"{file_prefix}_{brandname}_{start_date_formatted}_{end_date_formatted}.csv"
+    if reportFileFormat == "TSV":
+        data = convert_tsv_to_csv(tsv_data=data)
+
+    # Save using the utility function
+    file_path = save_content_to_file(content=data, folder_name=folder_name, file_name=output_file)
+
+    from helper.quality import check_landed_report
+
+    check_landed_report(
+        file_path=file_path,
+        folder_name=folder_name,
+        start_date=report_start_date,
+        end_date=report_end_date,
+        cache_key=cache_key,
+    )
+
+    # Extract year and month from report_end_date
+    end_date = datetime.strptime(report_end_date, "%Y/%m/%d")
+    destination_blob_name = f"UIReport/AmazonSellingPartner/{client}/{brandname}/{file_prefix}/year={end_date.strftime('%Y')}/month={end_date.strftime('%m')}/{output_file}"
+    upload_to_gcs(
+        local_file_name=output_file,
+        local_folder_name=folder_name,
+        bucket_name=bucket_name,
+        destination_blob_name=destination_blob_name,
+    )
+
+
+def download_fulfillment_reports_batch(
+    report_configs: dict,
+    report_start_date: str,
+    report_end_date: str,
+    portal_client: FulfillmentClient,
+    client: str = "nexusbrand",
+    brandname: str = "ExplodingKittens",
+    bucket_name: str = "rpa_validation_bucket",
+    poll_interval: float = STATUS_POLL_INTERVAL,
+    max_polls: int = STATUS_MAX_POLLS,
+    reuse_existing: bool = True,
+):
+    """
+    Submit every report first, then poll all of them with one status call per interval and download
+    each report as soon as it is Done. Reports of a final period that are in the report cache are not
+    submitted at all. Cached reports and reused ones that are already Done are only landed once every
+    other report has been submitted, so a long download does not hold up the submissions after it.
+
+    Args:
+        report_configs: Report name to its config from load_report_from_yaml
+        report_start_date: Start date in YYYY/MM/DD format
+        report_end_date: End date in YYYY/MM/DD format
+        portal_client: Session of the account
+        client: Client name for GCS path organization (default: "nexusbrand")
+        brandname: Brand name for filename and GCS path (default: "ExplodingKittens")
+        bucket_name: Google Cloud Storage bucket name (default: "rpa_validation_bucket")
+        poll_interval: Seconds between status calls (default: STATUS_POLL_INTERVAL)
+        max_polls: Status calls before giving up on the reports still pending (default: STATUS_MAX_POLLS)
+        reuse_existing: Download matching reports generated earlier instead of requesting new ones (default: True)
+
+    Raises:
+        ValueError: If date parameters are invalid
+        RuntimeError: If any report could not be requested, downloaded or uploaded
+    """
+    validate_parameters(report_start_date, report_end_date)
+
+    pending = {}
+    # Reports already available when they are submitted, landed once every report has been submitted
+    ready = []
+    failed = []
+    cache_keys = {}
+
+    def land(report_name: str, report_reference_id: str = None, cached_data: Content = None):
+        report_config = report_configs[report_name]
+        report_fields = dict(
+            report_start_date=report_start_date,
+            report_end_date=report_end_date,
+            reportFileFormat=report_config["params"].get("reportFileFormat"),
+            folder_name=report_config.get("folder_name"),
+            file_prefix=report_config.get("file_prefix"),
+            client=client,
+            brandname=brandname,
+            bucket_name=bucket_name,
+        )
+        with metrics_context(report=report_name):
+            logger.info(f"DOWNLOADING REPORT {report_name}")
+            try:
+                if cached_data is not None:
+                    upload_report_data(data=cached_data, cache_key=cache_keys[report_name], **report_fields)
+                else:
+                    download_and_upload_report(
+                        report_reference_id=report_reference_id,
+                        portal_client=portal_client,
+                        cache_key=cache_keys.get(report_name),
+                        **report_fields,
+                    )
+            except Exception as e:
+                logger.error(f"Some Error ocurred while downloading {report_name}: {e}")
+                failed.append(report_name)
+
+    for report_name, report_config in report_configs.items():
+        with metrics_context(report=report_name):
+            params = report_config.get("params")
+            cache_keys[report_name] = report_key(portal_client=portal_client, params=params)
+            cached_data = load_cached_report(
+                cache_keys[report_name], suffix=f".{params.get('reportFileFormat', 'csv').lower()}"
+            )
+        if cached_data is not None:
+            ready.append((report_name, None, cached_data))
+            continue
+
+        with metrics_context(report=report_name):
+            logger.info(f"GENERATING REPORT FOR {report_name}")
+            report_reference_id = (
+                find_existing_report(portal_client=portal_client, params=params) if reuse_existing else None
             )
+            if report_reference_id:
+                report_status = "Done"
+            else:
+                report_reference_id, report_status = request_report(portal_client=portal_client, params=params)
+            logger.info(f"Report Reference ID: {report_reference_id}    Report Status: {report_status}")
+
+        if report_reference_id is None:
+            failed.append(report_name)
+        elif report_status == "Done":
+            ready.append((report_name, report_reference_id, None))
+        else:
+            pending[report_reference_id] = report_name
 
-    except Exception as e:
-        logger.error("Some Error ocurred while downloading")
-        raise e
+    for report_name, report_reference_id, cached_data in ready:
+        land(report_name, report_reference_id, cached_data=cached_data)
+
+    for poll in range(max_polls):
+        if not pending:
+            break
+        if poll:
+            time.sleep(poll_interval)
+
+        statuses = check_download_statuses(portal_client=portal_client, report_reference_ids=list(pending))
+        if statuses is None:
+            continue
+
+        for report_reference_id, status in statuses.items():
+            if status == "Done":
+                land(pending.pop(report_reference_id), report_reference_id)
+            elif status not in PENDING_STATUSES:
+                report_name = pending.pop(report_reference_id)
+                logger.error(f"Report {report_name} ended with status {status}")
+                failed.append(report_name)
+
+    for report_name in pending.values():
+        logger.error(f"Maximum retry reached. Report {report_name} can not be downloaded")
+        failed.append(report_name)
+
+    if failed:
+        raise RuntimeError(f"{len(failed)} of {len(report_configs)} fulfillment report(s) failed: {failed}")
 
 
 if __name__ == "__main__":
@@ -312,47 +762,71 @@ if __name__ == "__main__":
         date_format="YYYY/MM/DD",
         optional_args=True,
         amazon_fulfillment=True,
+        reuse_reports=True,
     )
 
-    report_list = args.report_list.split(",")
-
-    cookie = {}
-    headers = {}
-
-    while len(cookie) == 0 or len(headers) == 0:
-        reset_cookie(cookie_storage_path=COOKIE_STORAGE_PATH)
+    start_run(portal="fulfillment", marketplace=args.market_place, brand=args.brandname)
 
-        cookie, headers = login_and_get_cookie(
-            amazon_fulfillment=True,
-            market_place=args.market_place,
-            username=args.user_name,
-            password=args.password,
-            otp_secret=args.otp_secret,
-            account=args.account,
-        )
+    report_list = args.report_list.split(",")
 
-    for report_name in report_list:
+    portal_client = FulfillmentClient(
+        market_place=args.market_place,
+        username=args.user_name,
+        password=args.password,
+        otp_secret=args.otp_secret,
+        account=args.account,
+    )
 
-        logger.info(f"GENERATING REPORT FOR {report_name}")
-        report_config = load_report_from_yaml(
-            report_name=report_name, start_date=args.start_date, end_date=args.end_date, market_place=args.market_place
-        )
+    # A session without the CSRF token is logged in again
+    while not portal_client.has_session():
+        portal_client.login()
 
-        params = report_config.get("params")
-        folder_name = report_config.get("folder_name")
-        file_prefix = report_config.get("file_prefix")
-        reportFileFormat = params.get("reportFileFormat")
+    if args.batch:
+        report_configs = {
+            report_name: load_report_from_yaml(
+                report_name=report_name,
+                start_date=args.start_date,
+                end_date=args.end_date,
+            )
+            for report_name in report_list
+        }
 
-        download_filfillments_report(
+        download_fulfillment_reports_batch(
+            report_configs=report_configs,
             report_start_date=args.start_date,
             report_end_date=args.end_date,
-            params=params,
-            reportFileFormat=reportFileFormat,
-            file_prefix=file_prefix,
-            folder_name=folder_name,
             client=args.client,
             brandname=args.brandname,
             bucket_name=args.bucket_name,
-            cookie=cookie,
-            headers=headers,
+            portal_client=portal_client,
+            reuse_existing=not args.no_reuse,
         )
+
+    else:
+        for report_name in report_list:
+            with metrics_context(report=report_name):
+                logger.info(f"GENERATING REPORT FOR {report_name}")
+                report_config = load_report_from_yaml(
+                    report_name=report_name,
+                    start_date=args.start_date,
+                    end_date=args.end_date,
+                )
+
+                params = report_config.get("params")
+                folder_name = report_config.get("folder_name")
+                file_prefix = report_config.get("file_prefix")
+                reportFileFormat = params.get("reportFileFormat")
+
+                download_filfillments_report(
+                    report_start_date=args.start_date,
+                    report_end_date=args.end_date,
+                    params=params,
+                    reportFileFormat=reportFileFormat,
+                    file_prefix=file_prefix,
+                    folder_name=folder_name,
+                    client=args.client,
+                    brandname=args.brandname,
+                    bucket_name=args.bucket_name,
+                    portal_client=portal_client,
+                    reuse_existing=not args.no_reuse,
+                )
@@ -5,19 +5,23 @@ sys.path.append(str(Path(__file__).resolve().parent.parent))
 import requests
 from datetime import datetime
 from tenacity import retry, stop_after_attempt, wait_fixed, retry_if_result
-from helper.utils import save_content_to_file, parse_args, upload_to_gcs, reset_cookie
+from helper.utils import save_content_to_file, parse_args, upload_to_gcs
 from helper.logging import logger
-from auth import login_and_get_cookie
-import yaml
+from helper.memory import content_size, read_response
+from helper.rate_limit import rate_limited_request
+from helper.metrics import span, start_run
+from helper.report_cache import load_cached_report, report_cache_key, store_cached_report
+from portal_client import PortalClient
 
-COOKIE_STORAGE_PATH = Path(__file__).parent / "auth_state.json"
+REPORT_TYPE = "SELLER_TRANSACTION_DATE_RANGE"
+# Lists the reports generated so far, as on the Payments "Date Range Reports" page
+GENERATED_REPORTS_PATH = "/generated-reports"
 
-MARKET_PLACE_CONFIG_FILE_PATH = Path(__file__).parent / "report_config" / "market_place_config.yaml"
-with open(MARKET_PLACE_CONFIG_FILE_PATH, "r") as file:
-    market_place_config = yaml.safe_load(file)
-marketplace_config = None
 
-BASE_URL = None
+class PaymentsClient(PortalClient):
+    """Session of one account on the Payments date range reports API of a marketplace"""
+
+    BASE_URL = "https://sellercentral.amazon.{pay_url_domain}/payments/reports/api"
 
 
 def validate_parameters(report_start_date: str, report_end_date: str):
@@ -44,20 +48,17 @@ def validate_parameters(report_start_date: str, report_end_date: str):
         raise e
 
 
-def request_report(cookie: dict, report_start_date: str, report_end_date: str) -> str:
+def report_date_range(report_start_date: str, report_end_date: str) -> dict:
     """
-    Request a report from Amazon Seller Central.
+    Date range fields of a report request, from the start of the first day to the end of the last day.
 
     Args:
-        cookie (dict): Authentication cookie
         report_start_date (str): Start date in YYYY/MM/DD format
         report_end_date (str): End date in YYYY/MM/DD format
 
     Returns:
-        str: Report reference ID and report status
+        dict: startDate and endDate as epoch milliseconds, startDateISO and endDateISO
     """
-    url = BASE_URL + "/request-report"
-
     start_date_iso = datetime.strptime(report_start_date, "%Y/%m/%d").strftime("%Y-%m-%dT%H:%M:%S+05:30")
     end_date_iso = (
         datetime.strptime(report_end_date, "%Y/%m/%d")
@@ -68,21 +69,90 @@ def request_report(cookie: dict, report_start_date: str, report_end_date: str) -
     start_date_timestamp = int((datetime.strptime(report_start_date, "%Y/%m/%d").timestamp()) * 1000)
     end_date_timestamp = int((datetime.strptime(end_date_iso, "%Y-%m-%dT%H:%M:%S+05:30").timestamp()) * 1000)
 
-    data = {
-        "accountType": "PAYABLE",  # "ALL", we should pass All to get actual data but German account is not supporting it
-        "reportType": "SELLER_TRANSACTION_DATE_RANGE",
+    return {
         "startDate": start_date_timestamp,
         "startDateISO": start_date_iso,
         "endDate": end_date_timestamp,
         "endDateISO": end_date_iso,
+    }
+
+
+def find_existing_report(portal_client: PaymentsClient, report_start_date: str, report_end_date: str) -> str:
+    """
+    Look for a downloadable transaction report of the same date range that was generated before, e.g. by
+    an earlier run, so it can be downloaded without waiting for a new one.
+
+    Only reports generated after the end of their date range are reused, earlier ones may miss transactions.
+
+    Args:
+        portal_client (PaymentsClient): Session of the account
+        report_start_date (str): Start date in YYYY/MM/DD format
+        report_end_date (str): End date in YYYY/MM/DD format
+
+    Returns:
+        str: Report ID of the matching report, None if there is none or the list could not be read
+    """
+    url = portal_client.url(GENERATED_REPORTS_PATH)
+    date_range = report_date_range(report_start_date, report_end_date)
+
+    try:
+        logger.info("Looking for an existing report...")
+        with span("lookup") as record:
+            response = rate_limited_request(
+                "GET", url, params={"reportType": REPORT_TYPE}, cookies=portal_client.cookie
+            )
+            response.raise_for_status()
+            reports = response.json().get("reports") or []
+
+            for report in reports:
+                if (
+                    report.get("reportType") == REPORT_TYPE
+                    and report.get("status") == "DOWNLOADABLE"
+                    and report.get("startDate") == date_range["startDate"]
+                    and report.get("endDate") == date_range["endDate"]
+                    and (report.get("generatedDate") or 0) > date_range["endDate"]
+                ):
+                    record["reused"] = True
+                    logger.info(f"Reusing report {report['reportId']} generated at {report['generatedDate']}")
+                    return report["reportId"]
+
+            record["reused"] = False
+
+        logger.info("No existing report found")
+        return None
+
+    except (requests.exceptions.RequestException, ValueError, TypeError, AttributeError, KeyError) as e:
+        logger.warning(f"Could not look up existing reports, generating a new one: {e}")
+        return None
+
+
+def request_report(portal_client: PaymentsClient, report_start_date: str, report_end_date: str) -> str:
+    """
+    Request a report from Amazon Seller Central.
+
+    Args:
+        portal_client (PaymentsClient): Session of the account
+        report_start_date (str): Start date in YYYY/MM/DD format
+        report_end_date (str): End date in YYYY/MM/DD format
+
+    Returns:
+        str: Report reference ID and report status
+    """
+    url = portal_client.url("/request-report")
+
+    data = {
+        "accountType": "PAYABLE",  # "ALL", we should pass All to get actual data but German account is not supporting it
+        "reportType": REPORT_TYPE,
+        **report_date_range(report_start_date, report_end_date),
         "timeRangeType": "CUSTOM",
     }
 
     try:
 
         logger.info("Requesting report...")
-        response = requests.post(url, json=data, cookies=cookie)
-        response.raise_for_status()
+        with span("submit"):
+            response = rate_limited_request("POST", url, json=data, cookies=portal_client.cookie)
+            response.raise_for_status()
         response_json = response.json()
         logger.info(f"Report ID: {response_json['reportId']}")
         report_status = response_json.get("generatedReport", {}).get("status")
@@ -98,25 +168,27 @@ def request_report(cookie: dict, report_start_date: str, report_end_date: str) -
     wait=wait_fixed(30),
     retry=retry_if_result(lambda result: result is None or result != "DOWNLOADABLE"),
 )
-def check_download_status(cookie: dict, report_reference_id: str) -> dict:
+def check_download_status(portal_client: PaymentsClient, report_reference_id: str) -> dict:
     """
     Check the download status of the requested report.
 
     Args:
-        cookie (dict): Authentication cookie
+        portal_client (PaymentsClient): Session of the account
         report_reference_id (str): Report reference ID
 
     Returns:
         dict: Report status
     """
-    url = BASE_URL + "/report"
+    url = portal_client.url("/report")
     params = {"reportId": report_reference_id}
 
     try:
         logger.info("Checking report status...")
-        response = requests.get(url, params=params, cookies=cookie)
-        response.raise_for_status()
-        response_json = response.json()
+        with span("poll") as record:
+            response = rate_limited_request("GET", url, params=params, cookies=portal_client.cookie)
+            response.raise_for_status()
+            response_json = response.json()
+            record["report_status"] = response_json["status"]
 
         logger.info(f"Report status: {response_json['status']}")
         return response_json["status"]
@@ -125,27 +197,31 @@ def check_download_status(cookie: dict, report_reference_id: str) -> dict:
         return None
 
 
-def download_report_data(cookie: dict, report_reference_id: str) -> str:
+def download_report_data(portal_client: PaymentsClient, report_reference_id: str) -> str:
     """
     Download the report data from Amazon Seller Central.
 
     Args:
-        cookie (dict): Authentication cookie
+        portal_client (PaymentsClient): Session of the account
         report_reference_id (str): Report reference ID
 
     Returns:
         str: HTTP status code and report content
     """
-    url = BASE_URL + "/download-report"
+    url = portal_client.url("/download-report")
     params = {"reportId": report_reference_id}
 
     try:
 
         logger.info("Downloading report...")
-        response = requests.get(url, params=params, cookies=cookie)
-        response.raise_for_status()
+        with span("download") as record:
+            response = rate_limited_request("GET", url, params=params, cookies=portal_client.cookie, stream=True)
+            response.raise_for_status()
+            # Spilled to disk when over the memory budget
+            content = read_response(response, suffix=".csv")
+            record["bytes"] = content_size(content)
         logger.info("Report downloaded successfully.")
-        return response.status_code, response.content
+        return response.status_code, content
 
     except requests.exceptions.RequestException as e:
         logger.error(f"Report Download failed: {e}")
@@ -156,26 +232,35 @@ def download_transaction_report(
     report_start_date: str,
     report_end_date: str,
     marketplace: str,
-    user_name: str,
-    password: str,
-    otp_secret: str,
-    account: str,
+    user_name: str = None,
+    password: str = None,
+    otp_secret: str = None,
+    account: str = None,
     client: str = "nexusbrand",
     brandname: str = "ExplodingKittens",
     bucket_name: str = "rpa_validation_bucket",
+    reuse_existing: bool = True,
+    portal_client: PaymentsClient = None,
 ):
     """
     Download payment Transaction report from Amazon Seller Central and upload to Google Cloud Storage.
 
+    A report of a final period that is in the report cache is uploaded from there, without logging in.
+
     Args:
         report_start_date (str): Start date in YYYY/MM/DD format
         report_end_date (str): End date in YYYY/MM/DD format
         client (str): Client name for GCS path organization (default: "nexusbrand")
         brandname (str): Brand name for filename and GCS path (default: "ExplodingKittens")
         bucket_name (str): Google Cloud Storage bucket name (default: "rpa_validation_bucket")
+        reuse_existing (bool): Download a matching report generated earlier instead of requesting a new one
+            (default: True)
+        portal_client (PaymentsClient): Session to use, e.g. one shared with other reports of the account
+            (default: a new one for marketplace and the credentials)
 
     Raises:
         ValueError: If date parameters are invalid
+        QualityCheckError: If the report fails its data-quality rules, it is quarantined instead of uploaded
         Exception: If any error occurs during download or upload process
     """
 
@@ -183,47 +268,80 @@ def download_transaction_report(
 
         validate_parameters(report_start_date, report_end_date)
 
-        cookie, headers = login_and_get_cookie(
-            market_place=marketplace,
-            username=user_name,
-            password=password,
-            otp_secret=otp_secret,
-            account=account,
+        portal_client = portal_client or PaymentsClient(
+            market_place=marketplace, username=user_name, password=password, otp_secret=otp_secret, account=account
         )
 
-        report_reference_id, report_status = request_report(
-            cookie=cookie, report_start_date=report_start_date, report_end_date=report_end_date
+        cache_key = report_cache_key(
+            "payments",
+            {"reportType": REPORT_TYPE},
+            portal_client.market_place,
+            portal_client.account,
+            report_start_date,
+            report_end_date,
         )
+        data = load_cached_report(cache_key, suffix=".csv")
+
+        if data is None:
+            portal_client.login()
+
+            report_reference_id = None
+            if reuse_existing:
+                report_reference_id = find_existing_report(
+                    portal_client=portal_client, report_start_date=report_start_date, report_end_date=report_end_date
+                )
+
+            if report_reference_id:
+                report_status = "DOWNLOADABLE"
+            else:
+                report_reference_id, report_status = request_report(
+                    portal_client=portal_client, report_start_date=report_start_date, report_end_date=report_end_date
+                )
+
+            logger.info(f"Report Reference ID: {report_reference_id}    Report Status: {report_status}")
 
-        logger.info(f"Report Reference ID: {report_reference_id}    Report Status: {report_status}")
+            if report_status != "DOWNLOADABLE":
+                download_request_status = check_download_status(
+                    portal_client=portal_client, report_reference_id=report_reference_id
+                )
 
-        if report_status != "DOWNLOADABLE":
-            download_request_status = check_download_status(cookie=cookie, report_reference_id=report_reference_id)
+                if download_request_status != "DOWNLOADABLE":
+                    logger.error("Maximum retry reached. Report can not be downloaded")
+                    return
 
-            if download_request_status != "DOWNLOADABLE":
-                logger.error("Maximum retry reached. Report can not be downloaded")
+            status_code, data = download_report_data(
+                portal_client=portal_client, report_reference_id=report_reference_id
+            )
+            if status_code != 200 or data is None:
                 return
+            store_cached_report(cache_key, data)
 
-        status_code, data = download_report_data(cookie=cookie, report_reference_id=report_reference_id)
+        start_date_formatted = datetime.strptime(report_start_date, "%Y/%m/%d").strftime("%Y%m%d")
+        end_date_formatted = datetime.strptime(report_end_date, "%Y/%m/%d").strftime("%Y%m%d")
 
-        if status_code == 200 and data != None:
+        output_file = f"PaymentTransaction_{brandname}_{start_date_formatted}_{end_date_formatted}.csv"
+        # Save using the utility function
+        file_path = save_content_to_file(content=data, folder_name="payment_transaction", file_name=output_file)
 
-            start_date_formatted = datetime.strptime(report_start_date, "%Y/%m/%d").strftime("%Y%m%d")
-            end_date_formatted = datetime.strptime(report_end_date, "%Y/%m/%d").strftime("%Y%m%d")
+        from helper.quality import check_landed_report
 
-            output_file = f"PaymentTransaction_{brandname}_{start_date_formatted}_{end_date_formatted}.csv"
-            # Save using the utility function
-            file_path = save_content_to_file(content=data, folder_name="payment_transaction", file_name=output_file)
+        check_landed_report(
+            file_path=file_path,
+            folder_name="payment_transaction",
+            start_date=report_start_date,
+            end_date=report_end_date,
+            cache_key=cache_key,
+        )
 
-            # Extract year and month from report_end_date
-            end_date = datetime.strptime(report_end_date, "%Y/%m/%d")
-            destination_blob_name = f"UIReport/AmazonSellingPartner/{client}/{brandname}/PaymentTransaction/year={end_date.strftime('%Y')}/month={end_date.strftime('%m')}/{output_file}"
-            upload_to_gcs(
-                local_file_name=output_file,
-                local_folder_name="payment_transaction",
-                bucket_name=bucket_name,
-                destination_blob_name=destination_blob_name,
-            )
+        # Extract year and month from report_end_date
+        end_date = datetime.strptime(report_end_date, "%Y/%m/%d")
+        destination_blob_name = f"UIReport/AmazonSellingPartner/{client}/{brandname}/PaymentTransaction/year={end_date.strftime('%Y')}/month={end_date.strftime('%m')}/{output_file}"
+        upload_to_gcs(
+            local_file_name=output_file,
+            local_folder_name="payment_transaction",
+            bucket_name=bucket_name,
+            destination_blob_name=destination_blob_name,
+        )
 
     except Exception as e:
         logger.error("Some Error ocurred while downloading")
@@ -236,11 +354,9 @@ if __name__ == "__main__":
         description="Download Amazon Payments Transaction reports for a date range",
         date_format="YYYY/MM/DD",
         optional_args=True,
+        reuse_reports=True,
     )
-    marketplace_config = market_place_config.get("marketplace_config", {}).get(args.market_place)
-    BASE_URL = f"https://sellercentral.amazon.{marketplace_config["pay_url_domain"]}/payments/reports/api"
-
-    reset_cookie(cookie_storage_path=COOKIE_STORAGE_PATH)
+    start_run(portal="payments", report="PaymentTransaction", marketplace=args.market_place, brand=args.brandname)
 
     download_transaction_report(
         report_start_date=args.start_date,
@@ -250,4 +366,5 @@ if __name__ == "__main__":
         password=args.password,
         otp_secret=args.otp_secret,
         account=args.account,
+        reuse_existing=not args.no_reuse,
     )
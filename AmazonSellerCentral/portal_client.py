@@ -0,0 +1,105 @@
+import threading
+from pathlib import Path
+from auth import login_and_get_cookie
+from helper.config import ConfigError, load_config
+
+MARKET_PLACE_CONFIG_FILE_PATH = Path(__file__).parent / "report_config" / "market_place_config.yaml"
+market_place_config = load_config(MARKET_PLACE_CONFIG_FILE_PATH)
+
+
+class PortalClient:
+    """
+    Session of one account on one marketplace of an Amazon portal: the portal's base URL, the account's
+    credentials and its cookies and headers.
+
+    Everything a report function needs for its requests comes from its client, so reports for different
+    marketplaces or accounts can run at the same time in one process, on threads or with
+    asyncio.to_thread. Jobs of the same account may share a client, only one of them logs in again when
+    the session is rejected.
+    """
+
+    # API root of the portal, formatted with the marketplace's entry in market_place_config.yaml
+    BASE_URL = None
+    # Which CSRF token the login has to capture, see login_and_get_cookie
+    amazon_ads = False
+    amazon_fulfillment = False
+
+    def __init__(
+        self,
+        market_place: str,
+        username: str = None,
+        password: str = None,
+        otp_secret: str = None,
+        account: str = None,
+        cookie: dict = None,
+        headers: dict = None,
+    ):
+        """
+        Args:
+            market_place (str): Marketplace, e.g. "United States".
+            username (str): Amazon user name.
+            password (str): Amazon password.
+            otp_secret (str): TOTP secret of the 2FA.
+            account (str): Account to select after the login.
+            cookie (dict): Session cookies of an earlier login, the client logs in on first use otherwise.
+            headers (dict): Session headers of that login.
+
+        Raises:
+            ConfigError: If the marketplace is not in market_place_config.yaml.
+        """
+        marketplace_config = market_place_config["marketplace_config"].get(market_place)
+        if marketplace_config is None:
+            raise ConfigError(
+                f"Unknown marketplace '{market_place}', available marketplaces: "
+                f"{', '.join(market_place_config['marketplace_config'])}"
+            )
+
+        self.market_place = market_place
+        self.marketplace_config = marketplace_config
+        self.base_url = self.BASE_URL.format(**self.url_fields())
+        self.username = username
+        self.password = password
+        self.otp_secret = otp_secret
+        self.account = account
+        self.cookie = cookie
+        self.headers = headers or {}
+        self._login_lock = threading.Lock()
+
+    def url_fields(self) -> dict:
+        """Values of the BASE_URL placeholders, the marketplace's config by default"""
+        return dict(self.marketplace_config)
+
+    def has_session(self) -> bool:
+        """Whether the client has cookies and, for ads and fulfillment, the CSRF token"""
+        needs_headers = self.amazon_ads or self.amazon_fulfillment
+        return bool(self.cookie) and (bool(self.headers) or not needs_headers)
+
+    def login(self, expired_cookie: dict = None) -> None:
+        """
+        Log in, unless the client already has a session that was not rejected.
+
+        Args:
+            expired_cookie (dict): Cookie Amazon rejected. If another job sharing this client already
+                replaced it, its new session is kept.
+
+        Raises:
+            AmazonAuthError: If the login fails.
+        """
+        with self._login_lock:
+            if self.has_session() and (expired_cookie is None or self.cookie != expired_cookie):
+                return
+
+            self.cookie, self.headers = login_and_get_cookie(
+                market_place=self.market_place,
+                username=self.username,
+                password=self.password,
+                otp_secret=self.otp_secret,
+                account=self.account,
+                amazon_ads=self.amazon_ads,
+                amazon_fulfillment=self.amazon_fulfillment,
+                expired_cookie=expired_cookie or self.cookie or None,
+            )
+
+    def url(self, path: str = "") -> str:
+        """URL of an API path of the portal, e.g. "/report"."""
+        return self.base_url + path
@@ -2,21 +2,85 @@ import sys
 from pathlib import Path
 
 sys.path.append(str(Path(__file__).resolve().parent.parent))
-from datetime import datetime
+from datetime import datetime, timedelta
 import requests
-from tenacity import retry, stop_after_attempt, wait_fixed, retry_if_result
-from auth import login_and_get_cookie
-from helper.utils import save_content_to_file, parse_args, upload_to_gcs, reset_cookie
+from tenacity import RetryCallState, retry, retry_if_exception, stop_after_attempt, wait_exponential
+from auth import SessionExpiredError
+from helper.utils import save_content_to_file, parse_args, upload_to_gcs
 from helper.logging import logger
-import yaml
+from helper.memory import Content, content_size, read_response
+from helper.rate_limit import rate_limited_request
+from helper.metrics import span, metrics_context, start_run
+from helper.config import get_report_config, load_config
+from helper.report_cache import load_cached_report, report_cache_key, store_cached_report
+from portal_client import PortalClient
 
-COOKIE_STORAGE_PATH = Path(__file__).parent / "auth_state.json"
-MARKET_PLACE_CONFIG_FILE_PATH = Path(__file__).parent / "report_config" / "market_place_config.yaml"
-with open(MARKET_PLACE_CONFIG_FILE_PATH, "r") as file:
-    market_place_config = yaml.safe_load(file)
-marketplace_config = None
+CONFIG_FILE_PATH = Path(__file__).parent / "report_config" / "sales_traffic_report_config.yaml"
+config = load_config(CONFIG_FILE_PATH)
+DEFAULT_REPORT = "Sales and Traffic"
 
-BASE_URL = None
+# A failed step is retried with the same session, a new login only happens when the session is rejected
+STEP_MAX_ATTEMPTS = 5
+MAX_LOGINS = 3
+
+# getReportDataDownload requests combined into one GraphQL document, enough for a month of daily windows
+MAX_QUERIES_PER_REQUEST = 31
+
+
+class SalesTrafficClient(PortalClient):
+    """Session of one account on the Business Reports GraphQL API of a marketplace"""
+
+    BASE_URL = "https://sellercentral.amazon.{sales_url_domain}/business-reports/api"
+
+    def url_fields(self) -> dict:
+        # Only marketplaces whose business reports are served from another domain set sales_url_domain
+        return {"sales_url_domain": self.marketplace_config["url_domain"], **self.marketplace_config}
+
+
+class MissingDownloadUrlError(Exception):
+    """Raised when the report request succeeds but the response has no download URL"""
+
+    pass
+
+
+def is_transient_error(exception: BaseException) -> bool:
+    """
+    Whether a failed step is worth retrying with the same session.
+
+    Connection errors, timeouts, throttling (429), server errors (5xx) and responses without a
+    download URL are transient. Rejected sessions and other client errors are not.
+    """
+    if isinstance(exception, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return True
+    if isinstance(exception, requests.exceptions.HTTPError) and exception.response is not None:
+        return exception.response.status_code == 429 or exception.response.status_code >= 500
+    return isinstance(exception, MissingDownloadUrlError)
+
+
+def log_step_retry(retry_state: RetryCallState) -> None:
+    """Log a step retry with the error that caused it"""
+    logger.info(
+        f"Retrying {retry_state.fn.__name__} (attempt {retry_state.attempt_number + 1} of {STEP_MAX_ATTEMPTS}) "
+        f"after: {retry_state.outcome.exception()}"
+    )
+
+
+def raise_for_status(response: requests.Response) -> None:
+    """
+    Raise SessionExpiredError if Amazon rejected the session, or HTTPError for other failed responses.
+    """
+    if response.status_code in (401, 403):
+        raise SessionExpiredError(f"Session rejected with status {response.status_code} for {response.url}")
+    response.raise_for_status()
+
+
+retry_transient_errors = retry(
+    retry=retry_if_exception(is_transient_error),
+    stop=stop_after_attempt(STEP_MAX_ATTEMPTS),
+    wait=wait_exponential(multiplier=1, min=2, max=30),
+    before_sleep=log_step_retry,
+    reraise=True,
+)
 
 
 def validate_parameters(report_start_date: str, report_end_date: str):
@@ -43,96 +107,176 @@ def validate_parameters(report_start_date: str, report_end_date: str):
         raise e
 
 
-def request_sales_traffic_report(report_start_date: str, report_end_date: str, cookie: dict, granularity: str = "DAY"):
+def split_date_range(report_start_date: str, report_end_date: str, window_days: int = None) -> list:
     """
-    Request sales and traffic report from Amazon Seller Central.
+    Split a date range into consecutive windows.
 
     Args:
         report_start_date: Start date in YYYY-MM-DD format
         report_end_date: End date in YYYY-MM-DD format
-        granularity: Report granularity (DAY/WEEK/MONTH)
-        cookie: Configured session cookie dict
+        window_days: Days per window, the whole range is one window if None
 
     Returns:
-        str: download_url if successful
-        None: If the request fails
+        list: (start date, end date) tuples in YYYY-MM-DD format, the last window may be shorter
+    """
+    if not window_days:
+        return [(report_start_date, report_end_date)]
+
+    start_date = datetime.strptime(report_start_date, "%Y-%m-%d")
+    end_date = datetime.strptime(report_end_date, "%Y-%m-%d")
+    windows = []
+    while start_date <= end_date:
+        window_end = min(start_date + timedelta(days=window_days - 1), end_date)
+        windows.append((start_date.strftime("%Y-%m-%d"), window_end.strftime("%Y-%m-%d")))
+        start_date = window_end + timedelta(days=1)
+    return windows
+
+
+def build_report_input(report_input: dict, report_start_date: str, report_end_date: str, granularity: str = None):
+    """Report definition from the YAML config with the dates, and optionally the granularity, of one request."""
+    return {
+        **report_input,
+        "startDate": report_start_date,
+        "endDate": report_end_date,
+        **({"granularity": granularity} if granularity else {}),
+    }
 
-    Raises:
-        requests.exceptions.RequestException: If there's an error making the request
+
+def build_batched_query(report_inputs: list) -> dict:
+    """
+    Combine several getReportDataDownload requests into one GraphQL document.
+
+    Each request gets its own $input<i> variable and is aliased as report<i>, so the URL in the
+    response can be mapped back to its request.
+
+    Args:
+        report_inputs: GetReportDataInput of every request
+
+    Returns:
+        dict: The GraphQL payload
     """
+    variables = ", ".join(f"$input{i}: GetReportDataInput" for i in range(len(report_inputs)))
+    fields = "\n".join(
+        f"    report{i}: getReportDataDownload(input: $input{i}) {{ url __typename }}"
+        for i in range(len(report_inputs))
+    )
 
-    logger.info("Requesting report download URL...")
-
-    url = BASE_URL
-
-    payload = {
-        "operationName": "reportDataDownloadQuery",
-        "variables": {
-            "input": {
-                "legacyReportId": "102:SalesTrafficTimeSeries",
-                "startDate": report_start_date,
-                "endDate": report_end_date,
-                "granularity": granularity,
-                "userSelectedRows": [],
-                "selectedColumns": [
-                    "SC_MA_Date_25913",
-                    "SC_MA_OrderedProductSales_40591",
-                    "SC_MA_UnitsOrdered_40590",
-                    "SC_MA_TotalOrderItems_1",
-                    "SC_MA_SalesPerOrderItem_1",
-                    "SC_MA_UnitsPerOrderItem_1",
-                    "SC_MA_AverageSellingPrice_25919",
-                    "SC_MA_MobileAppPageViews",
-                    "SC_MA_BrowserPageViews",
-                    "SC_MA_PageViews_Total",
-                    "SC_MA_MobileAppSessions",
-                    "SC_MA_BrowserSessions",
-                    "SC_MA_Sessions_Total",
-                    "SC_MA_BuyBoxPercentage_25956",
-                    "SC_MA_OrderItemSessionPercentage_1",
-                    "SC_MA_UnitSessionPercentage_25957",
-                    "SC_MA_AverageOfferCount_25954",
-                    "SC_MA_AverageParentItems_25958",
-                    "SC_MA_UnitsRefunded_25980",
-                    "SC_MA_RefundRate_25981",
-                    "SC_MA_FeedbackReceived_25982",
-                    "SC_MA_NegativeFeedbackReceived_25983",
-                    "SC_MA_ReceivedNegativeFeedbackRate_25984",
-                    "SC_MA_AToZClaimsGranted_25985",
-                    "SC_MA_ClaimsAmount_25986",
-                    "SC_MA_ShippedProductSales_0002",
-                    "SC_MA_UnitsShipped_0001",
-                    "SC_MA_OrdersShipped_0001",
-                ],
-            }
-        },
-        "query": """
-            query reportDataDownloadQuery($input: GetReportDataInput) {
-                getReportDataDownload(input: $input) {
-                    url
-                    __typename
-                }
-            }
-        """,
+    return {
+        "operationName": "reportDataDownloadBatchQuery",
+        "variables": {f"input{i}": report_input for i, report_input in enumerate(report_inputs)},
+        "query": f"query reportDataDownloadBatchQuery({variables}) {{\n{fields}\n}}",
     }
 
+
+@retry_transient_errors
+def request_download_url_batch(report_inputs: list, portal_client: SalesTrafficClient) -> list:
+    """
+    Request the download URLs of up to MAX_QUERIES_PER_REQUEST reports in one round trip.
+
+    Args:
+        report_inputs: GetReportDataInput of every report
+        portal_client: Session of the account
+
+    Returns:
+        list: download_url of every report, in the order of report_inputs
+
+    Raises:
+        SessionExpiredError: If Amazon rejected the session
+        MissingDownloadUrlError: If the response has no download URL for some of the reports
+        requests.exceptions.RequestException: If there's an error making the request
+    """
     try:
-        response = requests.post(url=url, json=payload, cookies=cookie)
-        response.raise_for_status()
+        with span("submit", reports=len(report_inputs)):
+            response = rate_limited_request(
+                "POST", url=portal_client.url(), json=build_batched_query(report_inputs), cookies=portal_client.cookie
+            )
+            raise_for_status(response)
 
         json_response = response.json()
-        download_url = json_response.get("data", {}).get("getReportDataDownload", {}).get("url")
+        data = json_response.get("data") or {}
+        download_urls = [(data.get(f"report{i}") or {}).get("url") for i in range(len(report_inputs))]
+
+        missing = [i for i, download_url in enumerate(download_urls) if not download_url]
+        if missing:
+            raise MissingDownloadUrlError(
+                f"No download URL for {len(missing)} of {len(report_inputs)} reports: {json_response.get('errors')}"
+            )
 
-        logger.info(f"Download URL fetched: {download_url}")
-        return download_url
+        return download_urls
 
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error making request for Sales Traffic download url: {e}")
-        return None
+    except (requests.exceptions.RequestException, MissingDownloadUrlError) as e:
+        logger.error(f"Error making request for Sales Traffic download urls: {e}")
+        raise e
+
+
+def request_download_urls(report_inputs: list, portal_client: SalesTrafficClient) -> list:
+    """
+    Request the download URLs of any number of reports, MAX_QUERIES_PER_REQUEST per round trip.
+
+    Args:
+        report_inputs: GetReportDataInput of every report
+        portal_client: Session of the account
+
+    Returns:
+        list: download_url of every report, in the order of report_inputs
+    """
+    logger.info(f"Requesting {len(report_inputs)} report download URLs...")
+
+    download_urls = []
+    for i in range(0, len(report_inputs), MAX_QUERIES_PER_REQUEST):
+        download_urls.extend(
+            request_download_url_batch(
+                report_inputs=report_inputs[i : i + MAX_QUERIES_PER_REQUEST], portal_client=portal_client
+            )
+        )
+
+    logger.info(f"{len(download_urls)} download URLs fetched")
+    return download_urls
+
+
+def request_sales_traffic_report(
+    report_start_date: str,
+    report_end_date: str,
+    portal_client: SalesTrafficClient,
+    report_input: dict = None,
+    granularity: str = None,
+):
+    """
+    Request sales and traffic report from Amazon Seller Central.
+
+    Args:
+        report_start_date: Start date in YYYY-MM-DD format
+        report_end_date: End date in YYYY-MM-DD format
+        portal_client: Session of the account
+        report_input: Report definition (legacyReportId, granularity, selectedColumns, ...) from
+            sales_traffic_report_config.yaml (default: the "Sales and Traffic" report)
+        granularity: Report granularity (DAY/WEEK/MONTH), overrides the one in report_input
+
+    Returns:
+        str: download_url
+
+    Raises:
+        SessionExpiredError: If Amazon rejected the session
+        MissingDownloadUrlError: If the response has no download URL
+        requests.exceptions.RequestException: If there's an error making the request
+    """
+    report_input = report_input or load_report_from_yaml(DEFAULT_REPORT)["input"]
+    download_url = request_download_url_batch(
+        report_inputs=[build_report_input(report_input, report_start_date, report_end_date, granularity)],
+        portal_client=portal_client,
+    )[0]
+
+    logger.info(f"Download URL fetched: {download_url}")
+    return download_url
 
 
+@retry_transient_errors
 def download_report_data(
-    download_url: str, report_start_date: str, report_end_date: str, cookie: dict, output_file: str
+    download_url: str,
+    report_start_date: str,
+    report_end_date: str,
+    portal_client: SalesTrafficClient,
+    output_file: str,
 ):
     """
     Download and save the sales traffic report locally.
@@ -141,115 +285,311 @@ def download_report_data(
         download_url: URL to download the report
         report_start_date: Start date of the report in YYYY-MM-DD format
         report_end_date: End date of the report in YYYY-MM-DD format
-        cookie: Session cookie dict for authentication
+        portal_client: Session of the account
         output_file: Output filename for saving the report
 
     Returns:
-        Path: Path object pointing to the saved file if successful
-        None: If the download or save operation fails
+        Content: The report as bytes, or the path of the spilled file
 
     Raises:
+        SessionExpiredError: If Amazon rejected the session
         requests.exceptions.RequestException: If there's an error downloading the report
     """
     try:
         logger.info("Download URL obtained, started downloading...")
-        response = requests.get(url=download_url, cookies=cookie)
-        response.raise_for_status()
+        with span("download") as record:
+            response = rate_limited_request("GET", url=download_url, cookies=portal_client.cookie, stream=True)
+            raise_for_status(response)
+            # Spilled to disk when over the memory budget
+            csv_data = read_response(response, suffix=".csv")
+            record["bytes"] = content_size(csv_data)
 
         logger.info(f"Report downloaded successfully, started saving")
 
-        csv_data = response.content
         return csv_data
 
     except requests.exceptions.RequestException as e:
         logger.error(f"Error downloading report: {e}")
+        raise e
+
+
+def load_report_from_yaml(report_name: str) -> dict:
+    """
+    Get a copy of a Sales and Traffic report definition from the YAML config.
+
+    Args:
+        report_name: Name of the report definition in sales_traffic_report_config.yaml
+
+    Returns:
+        dict: The report definition with input, folder_name and file_prefix
+
+    Raises:
+        ConfigError: If the report is not defined
+    """
+    return get_report_config(config, "sales_traffic_report_config", report_name)
+
+
+def download_and_upload_report(
+    report_config: dict,
+    download_url: str,
+    report_start_date: str,
+    report_end_date: str,
+    portal_client: SalesTrafficClient,
+    client: str = "nexusbrand",
+    brandname: str = "ExplodingKittens",
+    bucket_name: str = "rpa_validation_bucket",
+    cache_key: str = None,
+) -> str:
+    """
+    Download and save one requested Sales and Traffic report and upload it to Google Cloud Storage.
+
+    Args:
+        report_config: Report definition from sales_traffic_report_config.yaml
+        download_url: URL to download the report
+        report_start_date: Start date in YYYY-MM-DD format
+        report_end_date: End date in YYYY-MM-DD format
+        portal_client: Session of the account
+        client: Client name for GCS path organization
+        brandname: Brand name for filename and GCS path organization
+        bucket_name: Google Cloud Storage bucket name
+        cache_key: Report cache key from report_key, the download is cached under it (optional)
+
+    Returns:
+        str: GCS blob name of the uploaded report, None if it was not uploaded
+
+    Raises:
+        QualityCheckError: If the report fails its data-quality rules, it is quarantined instead of uploaded
+    """
+    csv_data = download_report_data(
+        download_url=download_url,
+        report_start_date=report_start_date,
+        report_end_date=report_end_date,
+        portal_client=portal_client,
+        output_file=report_file_name(report_config, report_start_date, report_end_date, brandname),
+    )
+    store_cached_report(cache_key, csv_data)
+
+    return upload_report_data(
+        report_config=report_config,
+        csv_data=csv_data,
+        report_start_date=report_start_date,
+        report_end_date=report_end_date,
+        client=client,
+        brandname=brandname,
+        bucket_name=bucket_name,
+        cache_key=cache_key,
+    )
+
+
+def report_file_name(report_config: dict, report_start_date: str, report_end_date: str, brandname: str) -> str:
+    """Name of the saved CSV file of a report and date range"""
+    start_date_formatted = datetime.strptime(report_start_date, "%Y-%m-%d").strftime("%Y%m%d")
+    end_date_formatted = datetime.strptime(report_end_date, "%Y-%m-%d").strftime("%Y%m%d")
+    return f"{report_config['file_prefix']}_{brandname}_{start_date_formatted}_{end_date_formatted}.csv"
+
+
+def report_key(
+    report_config: dict, report_start_date: str, report_end_date: str, portal_client: SalesTrafficClient
+) -> str:
+    """Report cache key of a report and date range, None unless the range is final"""
+    return report_cache_key(
+        "sales_traffic",
+        report_config["input"],
+        portal_client.market_place,
+        portal_client.account,
+        report_start_date,
+        report_end_date,
+    )
+
+
+def upload_report_data(
+    report_config: dict,
+    csv_data: Content,
+    report_start_date: str,
+    report_end_date: str,
+    client: str = "nexusbrand",
+    brandname: str = "ExplodingKittens",
+    bucket_name: str = "rpa_validation_bucket",
+    cache_key: str = None,
+) -> str:
+    """
+    Save downloaded or cached Sales and Traffic report data and upload it to Google Cloud Storage.
+
+    Args:
+        report_config: Report definition from sales_traffic_report_config.yaml
+        csv_data: The report as bytes, or the path of a spilled file
+        report_start_date: Start date in YYYY-MM-DD format
+        report_end_date: End date in YYYY-MM-DD format
+        client: Client name for GCS path organization
+        brandname: Brand name for filename and GCS path organization
+        bucket_name: Google Cloud Storage bucket name
+        cache_key: Report cache key of the data, removed from the cache if the report fails its checks (optional)
+
+    Returns:
+        str: GCS blob name of the uploaded report, None if it was not uploaded
+
+    Raises:
+        QualityCheckError: If the report fails its data-quality rules, it is quarantined instead of uploaded
+    """
+    file_prefix = report_config["file_prefix"]
+    folder_name = report_config["folder_name"]
+    output_file = report_file_name(report_config, report_start_date, report_end_date, brandname)
+
+    file_path = save_content_to_file(content=csv_data, folder_name=folder_name, file_name=output_file)
+
+    if not file_path:
+        logger.error("Failed to save report")
         return None
 
+    from helper.quality import check_landed_report
+
+    check_landed_report(
+        file_path=file_path,
+        folder_name=folder_name,
+        start_date=report_start_date,
+        end_date=report_end_date,
+        cache_key=cache_key,
+    )
+
+    # Extract year and month from end_date
+    end_date_obj = datetime.strptime(report_end_date, "%Y-%m-%d")
+    year = end_date_obj.strftime("%Y")
+    month = end_date_obj.strftime("%m")
+
+    destination_blob_name = (
+        f"UIReport/AmazonSellingPartner/{client}/{brandname}/{file_prefix}/year={year}/month={month}/{output_file}"
+    )
+    upload_to_gcs(
+        local_file_name=output_file,
+        local_folder_name=folder_name,
+        bucket_name=bucket_name,
+        destination_blob_name=destination_blob_name,
+    )
+
+    return destination_blob_name
+
 
-@retry(stop=stop_after_attempt(10), wait=wait_fixed(10), retry=retry_if_result(lambda result: result is None))
 def download_sales_traffic_report(
     report_start_date: str,
     report_end_date: str,
     market_place: str,
-    user_name: str,
-    password: str,
-    otp_secret: str,
-    account: str,
+    user_name: str = None,
+    password: str = None,
+    otp_secret: str = None,
+    account: str = None,
     client: str = "nexusbrand",
     brandname: str = "ExplodingKittens",
     bucket_name: str = "rpa_validation_bucket",
-) -> None:
+    report_list: list = None,
+    window_days: int = None,
+    portal_client: SalesTrafficClient = None,
+) -> dict:
     """
-    Download sales and traffic report from Amazon Seller Central and upload to Google Cloud Storage.
+    Download sales and traffic reports from Amazon Seller Central and upload to Google Cloud Storage.
+
+    All report definitions are downloaded with one login, and the download URLs of every report and
+    date window are requested together in batched GraphQL queries. Windows of a final period that are in
+    the report cache are uploaded from there, without a request.
 
     Args:
         report_start_date: Start date in YYYY-MM-DD format
         report_end_date: End date in YYYY-MM-DD format
-        granularity: Report granularity (DAY/WEEK/MONTH)
-        headless: Whether to run browser in headless mode
+        market_place: Marketplace to log in to
         client: Client name for GCS path organization
         brandname: Brand name for filename and GCS path organization
         bucket_name: Google Cloud Storage bucket name
+        report_list: Names of report definitions in sales_traffic_report_config.yaml (default: ["Sales and Traffic"])
+        window_days: Split the date range into windows of this many days, one file per window (default: one window)
+        portal_client: Session to use, e.g. one shared with other reports of the account (default: a new one for
+            market_place and the credentials)
 
     Returns:
-        None
+        dict: GCS blob name of the uploaded file per (report name, start date, end date)
 
     Raises:
-        ValueError: If date parameters are invalid
+        ValueError: If date parameters are invalid or a report is not defined
+        SessionExpiredError: If Amazon still rejects the session after MAX_LOGINS logins
         Exception: If any error occurs during download or upload process
     """
     try:
 
         validate_parameters(report_start_date, report_end_date)
 
-        cookie, headers = login_and_get_cookie(
-            market_place=market_place,
-            username=user_name,
-            password=password,
-            otp_secret=otp_secret,
-            account=account,
-        )
-
-        download_url = request_sales_traffic_report(
-            report_start_date=report_start_date, report_end_date=report_end_date, cookie=cookie
+        report_configs = {
+            report_name: load_report_from_yaml(report_name) for report_name in report_list or [DEFAULT_REPORT]
+        }
+        windows = split_date_range(report_start_date, report_end_date, window_days)
+        pending = [
+            (report_name, start_date, end_date) for report_name in report_configs for start_date, end_date in windows
+        ]
+        uploaded = {}
+        expired_cookie = None
+        portal_client = portal_client or SalesTrafficClient(
+            market_place=market_place, username=user_name, password=password, otp_secret=otp_secret, account=account
         )
 
-        if download_url:
-            start_date_formatted = datetime.strptime(report_start_date, "%Y-%m-%d").strftime("%Y%m%d")
-            end_date_formatted = datetime.strptime(report_end_date, "%Y-%m-%d").strftime("%Y%m%d")
-            output_file = f"SalesAndTraffic_{brandname}_{start_date_formatted}_{end_date_formatted}.csv"
-
-            csv_data = download_report_data(
-                download_url=download_url,
-                report_start_date=report_start_date,
-                report_end_date=report_end_date,
-                cookie=cookie,
-                output_file=output_file,
-            )
-
-            file_path = save_content_to_file(content=csv_data, folder_name="sales_traffic", file_name=output_file)
-
-            if file_path:
-                # Extract year and month from end_date
-                end_date_obj = datetime.strptime(report_end_date, "%Y-%m-%d")
-                year = end_date_obj.strftime("%Y")
-                month = end_date_obj.strftime("%m")
-
-                destination_blob_name = f"UIReport/AmazonSellingPartner/{client}/{brandname}/SalesAndTraffic/year={year}/month={month}/{output_file}"
-                upload_to_gcs(
-                    local_file_name=output_file,
-                    local_folder_name="sales_traffic",
+        cache_keys = {
+            job: report_key(report_configs[job[0]], job[1], job[2], portal_client=portal_client) for job in pending
+        }
+        for job in list(pending):
+            cached_data = load_cached_report(cache_keys[job], suffix=".csv")
+            if cached_data is None:
+                continue
+            report_name, start_date, end_date = job
+            with metrics_context(report=report_name, start_date=start_date, end_date=end_date):
+                uploaded[job] = upload_report_data(
+                    report_config=report_configs[report_name],
+                    csv_data=cached_data,
+                    report_start_date=start_date,
+                    report_end_date=end_date,
+                    client=client,
+                    brandname=brandname,
                     bucket_name=bucket_name,
-                    destination_blob_name=destination_blob_name,
+                    cache_key=cache_keys[job],
+                )
+            pending.remove(job)
+
+        # Transient errors are retried inside each step, only a rejected session means logging in again
+        for login_attempt in range(1, MAX_LOGINS + 1):
+            if not pending:
+                break
+            portal_client.login(expired_cookie=expired_cookie)
+            cookie = portal_client.cookie
+
+            try:
+                download_urls = request_download_urls(
+                    report_inputs=[
+                        build_report_input(report_configs[report_name]["input"], start_date, end_date)
+                        for report_name, start_date, end_date in pending
+                    ],
+                    portal_client=portal_client,
                 )
-            else:
-                logger.error("Failed to download report")
-                return None
-        else:
-            logger.error("Failed to get download URL")
-            return None
 
-        return destination_blob_name
+                for job, download_url in zip(list(pending), download_urls):
+                    report_name, start_date, end_date = job
+                    with metrics_context(report=report_name, start_date=start_date, end_date=end_date):
+                        logger.info(f"GENERATING REPORT FOR {report_name} from {start_date} to {end_date}")
+                        uploaded[job] = download_and_upload_report(
+                            report_config=report_configs[report_name],
+                            download_url=download_url,
+                            report_start_date=start_date,
+                            report_end_date=end_date,
+                            portal_client=portal_client,
+                            client=client,
+                            brandname=brandname,
+                            bucket_name=bucket_name,
+                            cache_key=cache_keys[job],
+                        )
+                    pending.remove(job)
+                break
+
+            except SessionExpiredError as e:
+                if login_attempt == MAX_LOGINS:
+                    raise e
+                logger.info(f"{e}, logging in again ({login_attempt} of {MAX_LOGINS})")
+                expired_cookie = cookie
+
+        return uploaded
 
     except Exception as e:
         logger.error("Some Error occurred while downloading: ")
@@ -261,12 +601,10 @@ if __name__ == "__main__":
         description="Download Sales and Traffic Report from Amazon Seller Central",
         date_format="YYYY-MM-DD",
         optional_args=True,
+        sales_traffic=True,
     )
 
-    marketplace_config = market_place_config.get("marketplace_config", {}).get(args.market_place)
-    BASE_URL = f"https://sellercentral.amazon.{marketplace_config["sales_url_domain"]}/business-reports/api"
-
-    reset_cookie(cookie_storage_path=COOKIE_STORAGE_PATH)
+    start_run(portal="sales_traffic", marketplace=args.market_place, brand=args.brandname)
 
     download_sales_traffic_report(
         report_start_date=args.start_date,
@@ -279,4 +617,6 @@ if __name__ == "__main__":
         password=args.password,
         otp_secret=args.otp_secret,
         account=args.account,
+        report_list=args.report_list.split(","),
+        window_days=args.window_days,
     )
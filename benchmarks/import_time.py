@@ -0,0 +1,120 @@
+"""
+Startup benchmark of the report scripts: how long `<script> --help` takes and which heavy dependencies
+importing each script loads.
+
+With --against, the same is measured for another git revision (checked out to a temporary worktree)
+to show the difference.
+
+Usage:
+    python benchmarks/import_time.py --runs 10 --against HEAD~1
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+SCRIPTS = ["sales_traffic", "payment_transaction", "fulfillment_all_reports", "amazon_ads_all_reports"]
+
+# Dependencies that should only be imported by the stage that needs them
+HEAVY_MODULES = [
+    "pandas",
+    "numpy",
+    "pyarrow",
+    "openpyxl",
+    "google.cloud.storage",
+    "google.cloud.bigquery",
+    "playwright",
+]
+
+LOADED_MODULES_CODE = """
+import json, sys
+sys.argv = [sys.argv[0]]
+sys.path[:0] = [{root!r}, {scripts!r}]
+import {script}
+print(json.dumps([module for module in {heavy!r} if module in sys.modules]))
+"""
+
+
+def script_environment(work_dir: Path) -> dict:
+    """Environment that keeps the logs and metrics of the measured runs out of the repository."""
+    return {
+        **os.environ,
+        "LOG_FILE": str(work_dir / "logfile.txt"),
+        "METRICS_FILE": str(work_dir / "metrics.jsonl"),
+        "CONFIG_CACHE_DIR": str(work_dir / "config_cache"),
+    }
+
+
+def measure(root: Path, runs: int, work_dir: Path) -> dict:
+    """Median wall time of `<script> --help` and the heavy modules importing the script loads."""
+    environment = script_environment(work_dir)
+    scripts_dir = root / "AmazonSellerCentral"
+    results = {}
+
+    for script in SCRIPTS:
+        timings = []
+        # The first run compiles the bytecode and the config cache, it is not counted
+        for run in range(runs + 1):
+            started = time.perf_counter()
+            subprocess.run(
+                [sys.executable, str(scripts_dir / f"{script}.py"), "--help"],
+                cwd=scripts_dir,
+                env=environment,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                check=True,
+            )
+            if run:
+                timings.append(time.perf_counter() - started)
+
+        code = LOADED_MODULES_CODE.format(root=str(root), scripts=str(scripts_dir), script=script, heavy=HEAVY_MODULES)
+        output = subprocess.run(
+            [sys.executable, "-c", code], cwd=scripts_dir, env=environment, capture_output=True, text=True, check=True
+        ).stdout
+
+        results[script] = {
+            "help_median_s": round(statistics.median(timings), 3),
+            "heavy_modules_loaded": json.loads(output.strip().splitlines()[-1]),
+        }
+
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Measure the startup time of the report scripts")
+    parser.add_argument("--runs", type=int, default=10, help="Runs per script (default: 10)")
+    parser.add_argument("--against", type=str, default=None, help="Git revision to compare with, e.g. HEAD~1")
+    args = parser.parse_args()
+
+    work_dir = Path(tempfile.mkdtemp(prefix="rpa_import_time_"))
+    try:
+        results = {"current": measure(REPO_ROOT, args.runs, work_dir)}
+
+        if args.against:
+            worktree = work_dir / "against"
+            subprocess.run(
+                ["git", "worktree", "add", "--detach", "--quiet", str(worktree), args.against],
+                cwd=REPO_ROOT,
+                check=True,
+            )
+            try:
+                results[args.against] = measure(worktree, args.runs, work_dir)
+            finally:
+                subprocess.run(["git", "worktree", "remove", "--force", str(worktree)], cwd=REPO_ROOT, check=True)
+
+        print(json.dumps(results, indent=2))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
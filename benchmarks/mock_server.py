@@ -0,0 +1,426 @@
+"""
+Local stand-in for the Amazon Seller Central, Amazon Ads and Google Cloud Storage endpoints the report
+scripts call, used by run_benchmark.py to measure throughput without real credentials.
+
+Every response is delayed by --latency seconds, reports become ready --ready_after seconds after they
+are requested and downloads contain --rows rows, spread over every day of the range for Sales and
+Traffic reports. With --max_rps, Amazon requests over that rate are answered with 429 and a
+Retry-After header, and --error_rate of them fail with 502. Fulfillment and payments reports generated
+so far are listed by the report history endpoints.
+
+Usage:
+    python benchmarks/mock_server.py --port 8765 --latency 0.05 --ready_after 2 --rows 50000
+"""
+
+import argparse
+import collections
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qs, urlparse
+
+ALL_ORDERS_COLUMNS = [
+    "amazon-order-id",
+    "purchase-date",
+    "order-status",
+    "fulfillment-channel",
+    "sku",
+    "asin",
+    "quantity",
+    "currency",
+    "item-price",
+]
+
+
+def build_all_orders(rows: int, separator: str = "\t") -> bytes:
+    lines = [separator.join(ALL_ORDERS_COLUMNS)]
+    for i in range(rows):
+        lines.append(
+            separator.join(
+                [
+                    f"111-{i:07d}-0000000",
+                    f"2024-01-{i % 28 + 1:02d}T10:00:00+00:00",
+                    "Shipped",
+                    "Amazon",
+                    f"SKU-{i % 500}",
+                    f"B0{i % 500:08d}",
+                    str(i % 3 + 1),
+                    "USD",
+                    f"{(i % 100) + 0.99:.2f}",
+                ]
+            )
+        )
+    return "\n".join(lines).encode("utf-8")
+
+
+def build_sales_traffic(rows: int, start_date: str, end_date: str) -> bytes:
+    lines = ['"Date","Ordered Product Sales","Units Ordered","Total Order Items","Sessions - Total"']
+    first_day = date.fromisoformat(start_date)
+    days = (date.fromisoformat(end_date) - first_day).days + 1
+    total = max(rows, days)
+    for i in range(total):
+        day = first_day + timedelta(days=i * days // total)
+        lines.append(f'"{day:%m/%d/%Y}","${(i % 1000) * 10:,.2f}","{i % 1000}","{i % 900}","{i % 5000}"')
+    return "\n".join(lines).encode("utf-8")
+
+
+def build_payments(rows: int) -> bytes:
+    lines = [
+        f'"Includes Amazon Marketplace, Fulfillment by Amazon (FBA), and Amazon Webstore transactions {i}"'
+        for i in range(7)
+    ]
+    lines.append('"date/time","settlement id","type","order id","sku","quantity","product sales","total"')
+    for i in range(rows):
+        lines.append(
+            f'"Jan {i % 28 + 1}, 2024 12:00:00 AM PST","1234","Order","111-{i:07d}-0000000","SKU-{i % 500}","1","19.99","17.50"'
+        )
+    return "\n".join(lines).encode("utf-8")
+
+
+def build_ads_excel(rows: int) -> bytes:
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(["Date", "Campaign Name", "Ad Group Name", "Impressions", "Clicks", "Spend", "7 Day Total Sales"])
+    for i in range(rows):
+        sheet.append(
+            [f"2024-01-{i % 28 + 1:02d}", f"Campaign {i % 50}", f"Ad Group {i % 200}", i % 10000, i % 100, 1.25, 19.99]
+        )
+    buffer = BytesIO()
+    workbook.save(buffer)
+    return buffer.getvalue()
+
+
+class MockState:
+    """Reports requested so far and the payloads served for them."""
+
+    def __init__(self, latency: float, ready_after: float, rows: int, max_rps: float = None, error_rate: float = 0):
+        self.latency = latency
+        self.ready_after = ready_after
+        self.rows = rows
+        self.max_rps = max_rps
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.reports = {}
+        self.generated = {}
+        self.uploads = {}
+        self.payloads = {}
+        self.recent_requests = collections.deque()
+        self.stats = {"requests": 0, "throttled": 0, "errors": 0, "bytes_served": 0, "bytes_uploaded": 0, "routes": {}}
+
+    def is_throttled(self) -> bool:
+        """Count an Amazon request and tell whether it exceeds max_rps over the last second."""
+        if not self.max_rps:
+            return False
+        now = time.monotonic()
+        with self.lock:
+            while self.recent_requests and now - self.recent_requests[0] > 1:
+                self.recent_requests.popleft()
+            if len(self.recent_requests) >= self.max_rps:
+                self.stats["throttled"] += 1
+                return True
+            self.recent_requests.append(now)
+            return False
+
+    def create_report(self, kind: str = None, **fields) -> str:
+        """Start generating a report, those of a kind are listed with their fields by generated_reports."""
+        report_id = uuid.uuid4().hex
+        with self.lock:
+            self.reports[report_id] = time.monotonic()
+            if kind:
+                self.generated[report_id] = {"kind": kind, "requested": int(time.time() * 1000), **fields}
+        return report_id
+
+    def generated_reports(self, kind: str) -> list:
+        with self.lock:
+            reports = [(report_id, dict(fields)) for report_id, fields in self.generated.items()]
+        return [(report_id, fields) for report_id, fields in reports if fields.pop("kind") == kind]
+
+    def is_ready(self, report_id: str) -> bool:
+        with self.lock:
+            requested_at = self.reports.get(report_id)
+        return requested_at is not None and time.monotonic() - requested_at >= self.ready_after
+
+    def report_fields(self, report_id: str) -> dict:
+        with self.lock:
+            return dict(self.generated.get(report_id, {}))
+
+    def payload(self, kind: str, *dates: str) -> bytes:
+        with self.lock:
+            if (kind, *dates) not in self.payloads:
+                builders = {
+                    "tsv": lambda: build_all_orders(self.rows, "\t"),
+                    "csv": lambda: build_all_orders(self.rows, ","),
+                    "sales_traffic": lambda: build_sales_traffic(self.rows, *dates),
+                    "payments": lambda: build_payments(self.rows),
+                    "excel": lambda: build_ads_excel(self.rows),
+                }
+                self.payloads[(kind, *dates)] = builders[kind]()
+            return self.payloads[(kind, *dates)]
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state: MockState = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send(self, status: int, body, content_type: str = "application/json", headers: dict = None):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8") if content_type == "application/json" else str(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        with self.state.lock:
+            self.state.stats["bytes_served"] += len(body)
+
+    def _route(self, method: str):
+        url = urlparse(self.path)
+        path, query = url.path, parse_qs(url.query)
+        body = self._body()
+
+        with self.state.lock:
+            self.state.stats["requests"] += 1
+            route = f"{method} {re.sub(r'[0-9a-f]{32}', '{id}', path)}"
+            self.state.stats["routes"][route] = self.state.stats["routes"].get(route, 0) + 1
+
+        if path == "/__stats":
+            return self._send(200, self.state.stats)
+
+        time.sleep(self.state.latency)
+
+        if not path.startswith("/upload/storage/") and self.state.is_throttled():
+            return self._send(429, {"error": "Rate exceeded"}, headers={"Retry-After": "1"})
+        if not path.startswith("/upload/storage/") and random.random() < self.state.error_rate:
+            with self.state.lock:
+                self.state.stats["errors"] += 1
+            return self._send(502, {"error": "Bad gateway"})
+
+        # Fulfillment report central
+        if path.endswith("/submitDownloadReport"):
+            report_id = self.state.create_report(
+                "fulfillment",
+                reportFRPId=query.get("reportFRPId", [None])[0],
+                reportStartDate=query.get("reportStartDate", [None])[0],
+                reportEndDate=query.get("reportEndDate", [None])[0],
+            )
+            return self._send(200, {"reportReferenceId": report_id, "reportStatus": "InQueue"})
+        if path.endswith("/getDownloadReportHistory"):
+            frp_id = query.get("reportFRPId", [None])[0]
+            history = [
+                {
+                    "reportReferenceId": report_id,
+                    "reportStartDate": fields["reportStartDate"],
+                    "reportEndDate": fields["reportEndDate"],
+                    "status": "Done" if self.state.is_ready(report_id) else "InProgress",
+                    "requestDate": fields["requested"],
+                }
+                for report_id, fields in self.state.generated_reports("fulfillment")
+                if fields["reportFRPId"] == frp_id
+            ]
+            return self._send(200, history)
+        if path.endswith("/getDownloadReportStatus"):
+            statuses = ["Done" if self.state.is_ready(i) else "InProgress" for i in query.get("referenceIds", [])]
+            return self._send(200, statuses)
+        if path.endswith("/downloadFile"):
+            kind = "tsv" if query.get("fileFormat", ["TSV"])[0] == "TSV" else "csv"
+            return self._send(200, self.state.payload(kind), "text/plain")
+
+        # Amazon Ads entity lookup, subscriptions and downloads
+        if path.endswith("/widgets/link-farm/settings"):
+            payload = {"merchantLevelDataResponses": [{"encMerchantId": "MOCKMERCHANT"}]}
+            return self._send(200, {"responsePayload": json.dumps(payload)})
+        if path.startswith("/reports/ref="):
+            return self._send(200, '<script>var config = {"entityId": "ENTITYMOCK"};</script>', "text/html")
+        if path.startswith("/reports/api/subscriptions") and method == "PUT":
+            return self._send(201, self.state.create_report(), "text/plain")
+        if path.startswith("/reports/api/subscriptions") and method == "POST":
+            report_id = json.loads(body or b"{}").get("filters", [{}])[0].get("values", [None])[0]
+            if self.state.is_ready(report_id):
+                summary = {
+                    "earliestUnprocessedReportSummary": {},
+                    "latestProcessedReportSummary": {
+                        "status": "COMPLETED",
+                        "urlString": f"/reports/download/{report_id}",
+                    },
+                }
+            else:
+                summary = {
+                    "earliestUnprocessedReportSummary": {"status": "IN_PROGRESS"},
+                    "latestProcessedReportSummary": {},
+                }
+            return self._send(200, {"subscriptions": [summary]})
+        if path.startswith("/reports/download/"):
+            return self._send(200, self.state.payload("excel"), "application/octet-stream")
+
+        # Business reports GraphQL API, one getReportDataDownload field per alias in batched queries
+        if path.endswith("/business-reports/api"):
+            request = json.loads(body or b"{}")
+            aliases = re.findall(r"(\w+)\s*:\s*getReportDataDownload", request.get("query", ""))
+            variables = request.get("variables") or {}
+            # report<i> is requested with $input<i>, an unbatched query with $input
+            inputs = {alias: variables.get(f"input{alias[len('report'):]}", {}) for alias in aliases} or {
+                "getReportDataDownload": variables.get("input", {})
+            }
+            host = self.headers.get("Host")
+            data = {}
+            for alias, report_input in inputs.items():
+                report_id = self.state.create_report(
+                    "sales_traffic",
+                    startDate=report_input.get("startDate", "2024-01-01"),
+                    endDate=report_input.get("endDate", "2024-01-28"),
+                )
+                data[alias] = {"url": f"http://{host}/business-reports/download/{report_id}"}
+            return self._send(200, {"data": data})
+        if path.startswith("/business-reports/download/"):
+            fields = self.state.report_fields(path.rsplit("/", 1)[-1])
+            payload = self.state.payload("sales_traffic", fields["startDate"], fields["endDate"])
+            return self._send(200, payload, "text/csv")
+
+        # Payments reports
+        if path.endswith("/request-report"):
+            request = json.loads(body or b"{}")
+            report_id = self.state.create_report(
+                "payments",
+                reportType=request.get("reportType"),
+                startDate=request.get("startDate"),
+                endDate=request.get("endDate"),
+            )
+            return self._send(200, {"reportId": report_id, "generatedReport": {"status": "IN_PROGRESS"}})
+        if path.endswith("/payments/reports/api/generated-reports"):
+            reports = [
+                {
+                    "reportId": report_id,
+                    "reportType": fields["reportType"],
+                    "startDate": fields["startDate"],
+                    "endDate": fields["endDate"],
+                    "status": "DOWNLOADABLE" if self.state.is_ready(report_id) else "IN_PROGRESS",
+                    "generatedDate": fields["requested"],
+                }
+                for report_id, fields in self.state.generated_reports("payments")
+                if fields["reportType"] == query.get("reportType", [None])[0]
+            ]
+            return self._send(200, {"reports": reports})
+        if path.endswith("/payments/reports/api/report"):
+            ready = self.state.is_ready(query.get("reportId", [None])[0])
+            return self._send(200, {"status": "DOWNLOADABLE" if ready else "IN_PROGRESS"})
+        if path.endswith("/download-report"):
+            return self._send(200, self.state.payload("payments"), "text/csv")
+
+        # Google Cloud Storage JSON API uploads
+        match = re.match(r"^/upload/storage/v1/b/([^/]+)/o$", path)
+        if match:
+            return self._gcs_upload(method, match.group(1), query, body)
+
+        return self._send(404, {"error": f"No mock for {method} {path}"})
+
+    def _gcs_upload(self, method: str, bucket: str, query: dict, body: bytes):
+        upload_type = query.get("uploadType", [""])[0]
+
+        if upload_type == "multipart":
+            name = re.search(rb'"name":\s*"([^"]+)"', body)
+            with self.state.lock:
+                self.state.stats["bytes_uploaded"] += len(body)
+            return self._send(
+                200, {"bucket": bucket, "name": name.group(1).decode() if name else "", "size": str(len(body))}
+            )
+
+        if upload_type == "resumable" and "upload_id" not in query:
+            upload_id = uuid.uuid4().hex
+            name = json.loads(body or b"{}").get("name") or query.get("name", [""])[0]
+            with self.state.lock:
+                self.state.uploads[upload_id] = {"name": name, "size": 0}
+            location = f"http://{self.headers.get('Host')}{urlparse(self.path).path}?uploadType=resumable&upload_id={upload_id}"
+            return self._send(200, b"", headers={"Location": location})
+
+        if upload_type == "resumable":
+            upload = self.state.uploads[query["upload_id"][0]]
+            with self.state.lock:
+                upload["size"] += len(body)
+                self.state.stats["bytes_uploaded"] += len(body)
+            content_range = self.headers.get("Content-Range", "")
+            total = content_range.rsplit("/", 1)[-1]
+            if total != "*" and upload["size"] >= int(total):
+                return self._send(200, {"bucket": bucket, "name": upload["name"], "size": str(upload["size"])})
+            return self._send(308, b"", headers={"Range": f"bytes=0-{upload['size'] - 1}"})
+
+        return self._send(400, {"error": f"Unsupported uploadType {upload_type}"})
+
+    def do_GET(self):
+        self._route("GET")
+
+    def do_POST(self):
+        self._route("POST")
+
+    def do_PUT(self):
+        self._route("PUT")
+
+
+def serve(
+    port: int,
+    latency: float,
+    ready_after: float,
+    rows: int,
+    max_rps: float = None,
+    error_rate: float = 0,
+    ready_event=None,
+) -> None:
+    """
+    Run the mock server until the process is stopped.
+
+    Args:
+        port: Port to listen on, 0 picks a free one
+        latency: Seconds added to every response
+        ready_after: Seconds after a request until its report is ready
+        rows: Rows in every downloaded report
+        max_rps: Amazon requests per second answered before throttling with 429, unlimited if None
+        error_rate: Fraction of Amazon requests that fail with 502
+        ready_event: Optional multiprocessing queue receiving the bound port once listening
+    """
+    MockHandler.state = MockState(
+        latency=latency, ready_after=ready_after, rows=rows, max_rps=max_rps, error_rate=error_rate
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", port), MockHandler)
+    server.daemon_threads = True
+    if ready_event is not None:
+        ready_event.put(server.server_address[1])
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Local mock of the Amazon and GCS endpoints used by the report scripts"
+    )
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on (default: 8765)")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to every response (default: 0.05)")
+    parser.add_argument("--ready_after", type=float, default=2, help="Seconds until a report is ready (default: 2)")
+    parser.add_argument("--rows", type=int, default=10000, help="Rows per downloaded report (default: 10000)")
+    parser.add_argument("--max_rps", type=float, default=None, help="Throttle Amazon requests above this rate")
+    parser.add_argument("--error_rate", type=float, default=0, help="Fraction of Amazon requests failing with 502")
+    args = parser.parse_args()
+
+    print(f"Mock server listening on http://127.0.0.1:{args.port}")
+    serve(
+        port=args.port,
+        latency=args.latency,
+        ready_after=args.ready_after,
+        rows=args.rows,
+        max_rps=args.max_rps,
+        error_rate=args.error_rate,
+    )
@@ -0,0 +1,309 @@
+"""
+End-to-end benchmark of the report scripts against the local mock in mock_server.py.
+
+Runs N reports through the same functions the scripts' __main__ blocks use (request, poll, download,
+transform, save and GCS upload), with portal clients that are already logged in with a fixed cookie, and reports
+throughput, time to completion and peak memory.
+
+Usage:
+    python benchmarks/run_benchmark.py --portal fulfillment --reports 20 --workers 4 --rows 50000
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlsplit, urlunsplit
+from urllib.request import urlopen
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(REPO_ROOT))
+sys.path.append(str(REPO_ROOT / "AmazonSellerCentral"))
+
+from mock_server import serve
+
+MOCK_COOKIE = {"session-id": "benchmark"}
+MOCK_HEADERS = {"anti-csrftoken-a2z": "benchmark"}
+START_DATE = "2024/01/01"
+END_DATE = "2024/01/28"
+FULFILLMENT_REPORTS = ["All Orders", "FBA Customer Returns", "FBA Inventory"]
+
+
+def start_mock_server(
+    latency: float, ready_after: float, rows: int, max_rps: float = None, error_rate: float = 0
+) -> tuple:
+    """Start the mock server in its own process so its memory does not count towards the benchmark."""
+    port_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=serve,
+        kwargs={
+            "port": 0,
+            "latency": latency,
+            "ready_after": ready_after,
+            "rows": rows,
+            "max_rps": max_rps,
+            "error_rate": error_rate,
+            "ready_event": port_queue,
+        },
+        daemon=True,
+    )
+    process.start()
+    return process, port_queue.get(timeout=60)
+
+
+def route_amazon_to_mock(port: int) -> None:
+    """Send every request for an Amazon host to the mock server instead."""
+    from requests.adapters import HTTPAdapter
+
+    original_send = HTTPAdapter.send
+
+    def send(self, request, **kwargs):
+        parts = urlsplit(request.url)
+        if parts.hostname and (
+            parts.hostname.startswith("sellercentral.amazon.") or parts.hostname.startswith("advertising.amazon.")
+        ):
+            request.url = urlunsplit(("http", f"127.0.0.1:{port}", parts.path, parts.query, parts.fragment))
+        return original_send(self, request, **kwargs)
+
+    HTTPAdapter.send = send
+
+
+def prepare_modules(work_dir: Path, poll_interval: float, cache: bool = False) -> dict:
+    """
+    Import the report modules with local storage, a fixed login and short poll intervals.
+
+    The report cache is off unless cache is set: the benchmark's reports only differ by brand, which is not
+    part of the cache key, so every report after the first of a portal would be a cache hit.
+    """
+    from tenacity import wait_fixed
+    import helper.quality
+    import helper.report_cache
+    import helper.utils
+    import amazon_ads_all_reports
+    import fulfillment_all_reports
+    import payment_transaction
+    import sales_traffic
+
+    helper.utils.STORAGE_STATE_PATH = work_dir / "data"
+    helper.quality.QUARANTINE_PATH = work_dir / "quarantine"
+
+    # The mock fills --rows by repeating Sales and Traffic days, which real daily reports never do
+    get_quality_rules = helper.quality.get_quality_rules
+    helper.quality.get_quality_rules = lambda folder_name: {
+        key: value
+        for key, value in get_quality_rules(folder_name).items()
+        if not (folder_name.startswith("sales_traffic") and key == "unique_key")
+    }
+    helper.report_cache.REPORT_CACHE_PATH = work_dir / "cache"
+    if not cache:
+        helper.report_cache.REPORT_CACHE_MAX_MB = 0
+
+    fulfillment_all_reports.check_download_status.retry.wait = wait_fixed(poll_interval)
+    payment_transaction.check_download_status.retry.wait = wait_fixed(poll_interval)
+    sales_traffic.request_download_url_batch.retry.wait = wait_fixed(poll_interval)
+    sales_traffic.download_report_data.retry.wait = wait_fixed(poll_interval)
+
+    return {
+        "ads": amazon_ads_all_reports,
+        "fulfillment": fulfillment_all_reports,
+        "payments": payment_transaction,
+        "sales_traffic": sales_traffic,
+    }
+
+
+def mock_client(client_class):
+    """Portal client of the report's account, already logged in with the fixed cookie."""
+    return client_class(market_place="United States", cookie=MOCK_COOKIE, headers=MOCK_HEADERS)
+
+
+def run_report(
+    modules: dict, portal: str, index: int, poll_interval: float, window_days: int = None, reuse: bool = False
+) -> None:
+    """Run one report end to end, like the script's __main__ block does for one --report_list entry."""
+    brandname = f"Benchmark{index}"
+
+    if portal == "fulfillment":
+        module = modules["fulfillment"]
+        report_config = module.load_report_from_yaml(report_name="All Orders", start_date=START_DATE, end_date=END_DATE)
+        params = report_config.get("params")
+        module.download_filfillments_report(
+            report_start_date=START_DATE,
+            report_end_date=END_DATE,
+            params=params,
+            reportFileFormat=params.get("reportFileFormat"),
+            file_prefix=report_config.get("file_prefix"),
+            folder_name=report_config.get("folder_name"),
+            brandname=brandname,
+            portal_client=mock_client(module.FulfillmentClient),
+            reuse_existing=reuse,
+        )
+
+    elif portal == "fulfillment_batch":
+        module = modules["fulfillment"]
+        report_configs = {
+            report_name: module.load_report_from_yaml(report_name=report_name, start_date=START_DATE, end_date=END_DATE)
+            for report_name in FULFILLMENT_REPORTS
+        }
+        module.download_fulfillment_reports_batch(
+            report_configs=report_configs,
+            report_start_date=START_DATE,
+            report_end_date=END_DATE,
+            brandname=brandname,
+            portal_client=mock_client(module.FulfillmentClient),
+            poll_interval=poll_interval,
+            reuse_existing=reuse,
+        )
+
+    elif portal == "ads":
+        module = modules["ads"]
+        report_config = module.load_report_from_yaml(
+            report_name="Sponsored Products Advertised product report",
+            report_start_date=START_DATE,
+            report_end_date=END_DATE,
+            market_place="United States",
+        )
+        module.download_actual_report(
+            report_start_date=START_DATE,
+            report_end_date=END_DATE,
+            url=report_config.get("url"),
+            params=report_config.get("params"),
+            payload=report_config.get("payload"),
+            file_prefix=report_config.get("file_prefix"),
+            folder_name=report_config.get("folder_name"),
+            retry_wait_time=poll_interval,
+            brandname=brandname,
+            portal_client=mock_client(module.AdsClient),
+        )
+
+    elif portal == "sales_traffic":
+        module = modules["sales_traffic"]
+        module.download_sales_traffic_report(
+            report_start_date=START_DATE.replace("/", "-"),
+            report_end_date=END_DATE.replace("/", "-"),
+            market_place="United States",
+            brandname=brandname,
+            window_days=window_days,
+            portal_client=mock_client(module.SalesTrafficClient),
+        )
+
+    elif portal == "payments":
+        module = modules["payments"]
+        module.download_transaction_report(
+            report_start_date=START_DATE,
+            report_end_date=END_DATE,
+            marketplace="United States",
+            brandname=brandname,
+            reuse_existing=reuse,
+            portal_client=mock_client(module.PaymentsClient),
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the report scripts against a local mock of Amazon and GCS")
+    parser.add_argument(
+        "--portal",
+        choices=["fulfillment", "fulfillment_batch", "ads", "sales_traffic", "payments", "all"],
+        default="all",
+        help="Reports to run",
+    )
+    parser.add_argument("--reports", type=int, default=8, help="Number of reports per portal (default: 8)")
+    parser.add_argument("--workers", type=int, default=1, help="Reports run concurrently (default: 1)")
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="Seconds added to every mock response (default: 0.05)"
+    )
+    parser.add_argument(
+        "--ready_after", type=float, default=1, help="Seconds until a mock report is ready (default: 1)"
+    )
+    parser.add_argument("--rows", type=int, default=10000, help="Rows per downloaded report (default: 10000)")
+    parser.add_argument("--poll_interval", type=float, default=0.5, help="Seconds between status polls (default: 0.5)")
+    parser.add_argument("--max_rps", type=float, default=None, help="Mock throttles Amazon requests above this rate")
+    parser.add_argument(
+        "--error_rate", type=float, default=0, help="Fraction of Amazon requests the mock fails with 502 (default: 0)"
+    )
+    parser.add_argument(
+        "--window_days", type=int, default=None, help="Sales and Traffic date windows requested in one batched query"
+    )
+    parser.add_argument(
+        "--reuse", action="store_true", help="Download fulfillment and payments reports generated by earlier reports"
+    )
+    parser.add_argument(
+        "--cache", action="store_true", help="Reuse downloads through the report cache, only one download per portal"
+    )
+    parser.add_argument("--tracemalloc", action="store_true", help="Also report the peak of Python allocations")
+    args = parser.parse_args()
+
+    work_dir = Path(tempfile.mkdtemp(prefix="rpa_benchmark_"))
+    process, port = start_mock_server(
+        latency=args.latency,
+        ready_after=args.ready_after,
+        rows=args.rows,
+        max_rps=args.max_rps,
+        error_rate=args.error_rate,
+    )
+
+    os.environ["STORAGE_EMULATOR_HOST"] = f"http://127.0.0.1:{port}"
+    os.environ["METRICS_FILE"] = str(work_dir / "metrics.jsonl")
+    os.environ["SPILL_DIR"] = str(work_dir / "spill")
+    route_amazon_to_mock(port)
+    modules = prepare_modules(work_dir, poll_interval=args.poll_interval, cache=args.cache)
+
+    portals = ["fulfillment", "ads", "sales_traffic", "payments"] if args.portal == "all" else [args.portal]
+    jobs = [(portal, index) for portal in portals for index in range(args.reports)]
+
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = [
+            executor.submit(run_report, modules, portal, index, args.poll_interval, args.window_days, args.reuse)
+            for portal, index in jobs
+        ]
+        errors = [future.exception() for future in futures if future.exception() is not None]
+    elapsed = time.perf_counter() - started
+
+    with urlopen(f"http://127.0.0.1:{port}/__stats") as response:
+        mock_stats = json.load(response)
+
+    with open(os.environ["METRICS_FILE"]) as file:
+        spans = [json.loads(line) for line in file]
+
+    landed_bytes = sum(path.stat().st_size for path in (work_dir / "data").rglob("*") if path.is_file())
+    results = {
+        "portals": portals,
+        "reports": len(jobs),
+        "workers": args.workers,
+        "rows_per_report": args.rows,
+        "errors": len(errors),
+        "quarantined": len(list((work_dir / "quarantine").rglob("*.csv"))),
+        "cache_hits": sum(1 for record in spans if record["stage"] == "cache" and record.get("hit")),
+        "time_to_completion_s": round(elapsed, 3),
+        "reports_per_s": round(len(jobs) / elapsed, 3),
+        "landed_mb": round(landed_bytes / 1024**2, 2),
+        "landed_mb_per_s": round(landed_bytes / 1024**2 / elapsed, 2),
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "mock_requests": mock_stats["requests"],
+        "throttled_requests": mock_stats["throttled"],
+        "failed_requests": mock_stats["errors"],
+        "metrics_file": os.environ["METRICS_FILE"],
+    }
+    if args.tracemalloc:
+        results["peak_traced_mb"] = round(tracemalloc.get_traced_memory()[1] / 1024**2, 1)
+
+    for error in errors:
+        print(f"Report failed: {error!r}")
+    print(json.dumps(results, indent=2))
+
+    process.terminate()
+
+
+if __name__ == "__main__":
+    main()
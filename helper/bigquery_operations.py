@@ -1,8 +1,53 @@
-from google.cloud import bigquery
+from google.cloud import bigquery, bigquery_storage, storage
+from google.cloud.exceptions import NotFound
 import pandas as pd
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
 from pathlib import Path
+from fnmatch import fnmatchcase
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from decimal import Decimal
+import itertools
 import os
+import threading
+import uuid
 from google.oauth2 import service_account
+from helper.metrics import span
+
+
+def build_query_parameter(name: str, value):
+    """
+    Build a typed BigQuery query parameter from a Python value
+
+    Args:
+        name: Parameter name, referenced as @name in the query
+        value: Python value; lists become ARRAY parameters
+    Returns:
+        ScalarQueryParameter or ArrayQueryParameter
+    """
+    if isinstance(value, (list, tuple)):
+        element_type = build_query_parameter(name, value[0]).type_ if value else "STRING"
+        return bigquery.ArrayQueryParameter(name, element_type, list(value))
+
+    # bool before int and datetime before date, since they are subclasses
+    if isinstance(value, bool):
+        parameter_type = "BOOL"
+    elif isinstance(value, int):
+        parameter_type = "INT64"
+    elif isinstance(value, float):
+        parameter_type = "FLOAT64"
+    elif isinstance(value, Decimal):
+        parameter_type = "NUMERIC"
+    elif isinstance(value, datetime):
+        # An aware datetime is a point in time, a naive one a wall-clock time
+        parameter_type = "TIMESTAMP" if value.tzinfo is not None else "DATETIME"
+    elif isinstance(value, date):
+        parameter_type = "DATE"
+    else:
+        parameter_type = "STRING"
+
+    return bigquery.ScalarQueryParameter(name, parameter_type, value)
 
 
 class BigQueryOperations:
@@ -21,12 +66,28 @@ class BigQueryOperations:
 
             # Create BigQuery client with credentials
             self.client = bigquery.Client(credentials=credentials, project=credentials.project_id)
+            self.storage_client = storage.Client(credentials=credentials, project=credentials.project_id)
+
+            # Storage Read API client, created on first use since only Arrow fetches need it
+            self._credentials = credentials
+            self._bqstorage_client = None
+            self._bqstorage_lock = threading.Lock()
             print(f"Successfully connected to project: {credentials.project_id}")
 
         except Exception as e:
             print(f"Error initializing BigQuery client: {str(e)}")
             raise
 
+    @property
+    def bqstorage_client(self) -> bigquery_storage.BigQueryReadClient:
+        """
+        Storage Read API client, created the first time it is needed
+        """
+        with self._bqstorage_lock:
+            if self._bqstorage_client is None:
+                self._bqstorage_client = bigquery_storage.BigQueryReadClient(credentials=self._credentials)
+            return self._bqstorage_client
+
     def create_table_from_csv(
         self,
         csv_path: str,
@@ -34,9 +95,12 @@ class BigQueryOperations:
         table_id: str,
         schema: list = None,
         write_disposition: str = "WRITE_TRUNCATE",
-    ) -> None:
+    ) -> int:
         """
         Create or update BigQuery table from CSV file
+
+        Returns:
+            Number of rows loaded
         """
         try:
             # Verify CSV file exists
@@ -54,19 +118,348 @@ class BigQueryOperations:
 
             table_ref = f"{self.client.project}.{dataset_id}.{table_id}"
 
-            # Load the CSV file into BigQuery
-            with open(csv_path, "rb") as source_file:
-                job = self.client.load_table_from_file(source_file, table_ref, job_config=job_config)
+            with span("load", table=table_ref, bytes=os.path.getsize(csv_path)) as record:
+                # Load the CSV file into BigQuery
+                with open(csv_path, "rb") as source_file:
+                    job = self.client.load_table_from_file(source_file, table_ref, job_config=job_config)
 
-            # Wait for the job to complete
-            job.result()
+                # Wait for the job to complete
+                job.result()
+                record["rows"] = job.output_rows
 
             print(f"Loaded {job.output_rows} rows into {table_ref}")
 
+            return job.output_rows
+
         except Exception as e:
             print(f"Error creating table from CSV: {str(e)}")
             raise
 
+    def load_partitions_from_csv(
+        self,
+        csv_path: str,
+        dataset_id: str,
+        table_id: str,
+        partition_field: str,
+        schema: list = None,
+    ) -> int:
+        """
+        Incrementally load a CSV into a date-partitioned table, replacing only the partitions it covers
+
+        The file is loaded into a staging table of its own first, so loads into the same table can run at
+        the same time. The days it contains are then deleted from the target and re-inserted from staging
+        in one transaction, by column name. The target is created partitioned by partition_field (a DATE
+        column) or DATE(partition_field) (a TIMESTAMP or DATETIME column) if it does not exist yet.
+
+        Args:
+            csv_path: Path to the CSV file
+            dataset_id: Dataset of the target table
+            table_id: Date-partitioned target table
+            partition_field: Column holding the date (or timestamp) the table is partitioned on
+            schema: Optional table schema, autodetected when not provided
+        Returns:
+            Number of rows loaded
+        Raises:
+            ValueError: If the target is not date-partitioned, or the file has a column the target does not
+        """
+        table_ref = f"{self.client.project}.{dataset_id}.{table_id}"
+        staging_id = f"{table_id}_staging_{uuid.uuid4().hex[:12]}"
+        staging_ref = f"{self.client.project}.{dataset_id}.{staging_id}"
+
+        try:
+            rows = self.create_table_from_csv(
+                csv_path=csv_path,
+                dataset_id=dataset_id,
+                table_id=staging_id,
+                schema=schema,
+                write_disposition="WRITE_TRUNCATE",
+            )
+            staging = self.client.get_table(staging_ref)
+            staging_columns = [field.name for field in staging.schema]
+            staging_day = self._partition_day(staging, partition_field)
+
+            try:
+                table = self.client.get_table(table_ref)
+            except NotFound:
+                table = None
+
+            if table is None:
+                query = f"""
+                    CREATE TABLE `{table_ref}`
+                    PARTITION BY {staging_day}
+                    AS SELECT * FROM `{staging_ref}`
+                """
+            elif table.time_partitioning is None:
+                raise ValueError(f"Table {table_ref} is not date-partitioned, use create_table_from_csv instead")
+            else:
+                target_columns = {field.name for field in table.schema}
+                missing = [column for column in staging_columns if column not in target_columns]
+                if missing:
+                    raise ValueError(f"Columns {missing} of {csv_path} are not in {table_ref}")
+
+                # Inserted by name, the column order autodetect gives the staging table does not matter
+                columns = ", ".join(f"`{column}`" for column in staging_columns)
+
+                # The partition list is a script variable so the DELETE only touches those partitions
+                query = f"""
+                    DECLARE partitions ARRAY<DATE> DEFAULT (
+                        SELECT ARRAY_AGG(DISTINCT {staging_day}) FROM `{staging_ref}`
+                    );
+                    BEGIN TRANSACTION;
+                    DELETE FROM `{table_ref}` WHERE {self._partition_day(table, partition_field)} IN UNNEST(partitions);
+                    INSERT INTO `{table_ref}` ({columns}) SELECT {columns} FROM `{staging_ref}`;
+                    COMMIT TRANSACTION;
+                """
+
+            self.client.query(query).result()
+            print(f"Replaced partitions of {table_ref} with {rows} rows from {csv_path}")
+
+            return rows
+
+        except Exception as e:
+            print(f"Error loading partitions from CSV: {str(e)}")
+            raise
+
+        finally:
+            self.client.delete_table(staging_ref, not_found_ok=True)
+
+    @staticmethod
+    def _partition_day(table, partition_field: str) -> str:
+        """
+        SQL expression of the day a row of the table belongs to
+
+        Args:
+            table: BigQuery table holding partition_field
+            partition_field: DATE, DATETIME or TIMESTAMP column
+        Returns:
+            The column itself for a DATE column, DATE(column) otherwise
+        Raises:
+            ValueError: If the table has no such column
+        """
+        field_types = {field.name: field.field_type for field in table.schema}
+        if partition_field not in field_types:
+            raise ValueError(f"Table {table.table_id} has no column {partition_field}")
+        if field_types[partition_field] == "DATE":
+            return f"`{partition_field}`"
+        return f"DATE(`{partition_field}`)"
+
+    def list_gcs_uris(self, uri_pattern: str, bucket_name: str = "rpa_validation_bucket") -> list:
+        """
+        List the gs:// URIs of every object in a bucket matching a glob pattern
+
+        Args:
+            uri_pattern: Object name pattern, e.g. UIReport/AmazonSellingPartner/{client}/{brand}/AllOrders/year=*/month=*/*
+            bucket_name: Name of the GCS bucket
+        Returns:
+            Sorted list of matching gs:// URIs
+        """
+        # Only list below the static part of the pattern, then match the wildcards locally
+        static_prefix = uri_pattern.split("*", 1)[0].split("?", 1)[0].split("[", 1)[0]
+        blobs = self.storage_client.list_blobs(bucket_name, prefix=static_prefix)
+
+        return sorted(
+            f"gs://{bucket_name}/{blob.name}"
+            for blob in blobs
+            if not blob.name.endswith("/") and fnmatchcase(blob.name, uri_pattern)
+        )
+
+    def submit_gcs_load_job(
+        self,
+        uri_pattern: str,
+        dataset_id: str,
+        table_id: str,
+        bucket_name: str = "rpa_validation_bucket",
+        schema: list = None,
+        write_disposition: str = "WRITE_TRUNCATE",
+    ) -> bigquery.LoadJob:
+        """
+        Submit a single load job for every CSV in GCS matching a report prefix, without waiting for it
+
+        Hive partition keys in the object path (year=/month=) are detected and added as columns.
+
+        Args:
+            uri_pattern: Object name pattern, e.g. UIReport/AmazonSellingPartner/{client}/{brand}/AllOrders/year=*/month=*/*
+            dataset_id: Destination dataset
+            table_id: Destination table
+            bucket_name: Name of the GCS bucket
+            schema: Optional table schema, autodetected when not provided
+            write_disposition: BigQuery write disposition for the load
+        Returns:
+            The submitted load job
+        """
+        try:
+            source_uris = self.list_gcs_uris(uri_pattern, bucket_name)
+            if not source_uris:
+                raise FileNotFoundError(f"No objects found in gs://{bucket_name} matching: {uri_pattern}")
+
+            # Hive partitioning starts at the directory holding the first wildcard
+            static_prefix = uri_pattern.split("*", 1)[0]
+            hive_partitioning = bigquery.HivePartitioningOptions()
+            hive_partitioning.mode = "AUTO"
+            hive_partitioning.source_uri_prefix = f"gs://{bucket_name}/{static_prefix[: static_prefix.rfind('/') + 1]}"
+
+            job_config = bigquery.LoadJobConfig(
+                source_format=bigquery.SourceFormat.CSV,
+                skip_leading_rows=1,
+                autodetect=True if schema is None else False,
+                schema=schema,
+                write_disposition=write_disposition,
+                hive_partitioning=hive_partitioning,
+            )
+
+            table_ref = f"{self.client.project}.{dataset_id}.{table_id}"
+            job = self.client.load_table_from_uri(source_uris, table_ref, job_config=job_config)
+
+            print(f"Submitted load job {job.job_id} for {len(source_uris)} files into {table_ref}")
+
+            return job
+
+        except Exception as e:
+            print(f"Error submitting load job from GCS: {str(e)}")
+            raise
+
+    def wait_for_load_jobs(self, jobs: list) -> dict:
+        """
+        Wait for a set of submitted load jobs to finish
+
+        Args:
+            jobs: Load jobs returned by submit_gcs_load_job
+        Returns:
+            Dictionary of destination table to number of rows loaded
+        """
+        loaded_rows = {}
+        failed_jobs = []
+
+        # The jobs run server-side in parallel, waiting on them in turn only collects the results
+        for job in jobs:
+            table_ref = f"{job.destination.project}.{job.destination.dataset_id}.{job.destination.table_id}"
+            try:
+                with span("load", table=table_ref, files=len(job.source_uris)) as record:
+                    job.result()
+                    record["rows"] = job.output_rows
+                loaded_rows[table_ref] = job.output_rows
+                print(f"Loaded {job.output_rows} rows into {table_ref}")
+            except Exception as e:
+                print(f"Error loading {table_ref}: {str(e)}")
+                failed_jobs.append(table_ref)
+
+        if failed_jobs:
+            raise RuntimeError(f"Load jobs failed for: {', '.join(failed_jobs)}")
+
+        return loaded_rows
+
+    def load_tables_from_gcs(self, loads: list, bucket_name: str = "rpa_validation_bucket") -> dict:
+        """
+        Load several tables from GCS report prefixes concurrently, one load job per table
+
+        Args:
+            loads: List of dicts with uri_pattern, dataset_id, table_id and optionally schema and write_disposition
+            bucket_name: Name of the GCS bucket
+        Returns:
+            Dictionary of destination table to number of rows loaded
+        """
+        jobs = [self.submit_gcs_load_job(bucket_name=bucket_name, **load) for load in loads]
+        return self.wait_for_load_jobs(jobs)
+
+    def query_to_dataframe(self, query: str, parameters: dict = None, use_storage_api: bool = True) -> pd.DataFrame:
+        """
+        Run a query and return its results as a DataFrame
+
+        Args:
+            query: SQL query, parameters referenced as @name
+            parameters: Dictionary of query parameters
+            use_storage_api: Fetch the results over the Storage Read API
+        Returns:
+            DataFrame containing the results
+        """
+        try:
+            job_config = bigquery.QueryJobConfig(
+                query_parameters=[build_query_parameter(k, v) for k, v in (parameters or {}).items()]
+            )
+            results = self.client.query(query, job_config=job_config).result()
+
+            if use_storage_api:
+                return results.to_dataframe(bqstorage_client=self.bqstorage_client)
+            return results.to_dataframe(create_bqstorage_client=False)
+
+        except Exception as e:
+            print(f"Error running query: {str(e)}")
+            raise
+
+    def call_stored_procedure(
+        self,
+        procedure_name: str,
+        dataset_id: str,
+        parameters: dict = None,
+        output_dataset: str = None,
+        output_table: str = None,
+        use_storage_api: bool = False,
+    ) -> bigquery.table.RowIterator:
+        """
+        Run a stored procedure and return the iterator over its result rows
+
+        Args:
+            procedure_name: Name of the stored procedure
+            dataset_id: Dataset containing the stored procedure
+            parameters: Dictionary of parameters to pass to the stored procedure, in argument order
+            output_dataset: Optional dataset to save results
+            output_table: Optional table name to save results
+            use_storage_api: Return rows read from the result table, which the Storage Read API can fetch
+        Returns:
+            RowIterator over the results, not yet downloaded
+        """
+        parameters = parameters or {}
+
+        # Arguments are passed positionally as typed query parameters, so the query text stays constant
+        param_str = ", ".join([f"@{k}" for k in parameters])
+        query = f"CALL `{self.client.project}.{dataset_id}.{procedure_name}`({param_str})"
+
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[build_query_parameter(k, v) for k, v in parameters.items()]
+        )
+
+        # Configure job with destination if specified
+        if output_dataset and output_table:
+            destination = f"{self.client.project}.{output_dataset}.{output_table}"
+            job_config.destination = destination
+
+        # Execute the stored procedure
+        query_job = self.client.query(query, job_config=job_config)
+        results = query_job.result()
+
+        if output_dataset and output_table:
+            print(f"Results saved to {destination}")
+
+        if use_storage_api:
+            return self._script_result_rows(query_job, results)
+        return results
+
+    def _script_result_rows(self, query_job, results) -> bigquery.table.RowIterator:
+        """
+        Find the rows of a stored procedure's result in the table its final SELECT wrote to
+
+        A CALL runs as a script job, which has no destination table of its own, so the Storage Read API
+        cannot read its results. The child job of the SELECT that produced them does have one.
+
+        Args:
+            query_job: Finished script job
+            results: Rows returned by the script job
+        Returns:
+            RowIterator over the result table, or the script's own rows when no table is found
+        """
+        if query_job.destination is not None:
+            return results
+
+        # Child jobs are listed most recent first, so the first SELECT is the one whose rows were returned
+        for child_job in self.client.list_jobs(parent_job=query_job):
+            if getattr(child_job, "statement_type", None) == "SELECT" and child_job.destination is not None:
+                return self.client.list_rows(child_job.destination)
+
+        print(
+            f"Warning: no result table found for job {query_job.job_id}, fetching results without the Storage Read API"
+        )
+        return results
+
     def execute_stored_procedure(
         self,
         procedure_name: str,
@@ -74,6 +467,7 @@ class BigQueryOperations:
         parameters: dict = None,
         output_dataset: str = None,
         output_table: str = None,
+        use_storage_api: bool = False,
     ) -> pd.DataFrame:
         """
         Execute a stored procedure and optionally save results
@@ -84,37 +478,119 @@ class BigQueryOperations:
             parameters: Dictionary of parameters to pass to the stored procedure
             output_dataset: Optional dataset to save results
             output_table: Optional table name to save results
+            use_storage_api: Fetch the results as Arrow over the Storage Read API instead of the REST pager
         Returns:
             DataFrame containing the results
         """
         try:
-            # Build the CALL statement with parameters if provided
-            if parameters:
-                param_str = ", ".join([f"@{k}={v}" for k, v in parameters.items()])
-                query = f"CALL `{self.client.project}.{dataset_id}.{procedure_name}`({param_str})"
+            results = self.call_stored_procedure(
+                procedure_name=procedure_name,
+                dataset_id=dataset_id,
+                parameters=parameters,
+                output_dataset=output_dataset,
+                output_table=output_table,
+                use_storage_api=use_storage_api,
+            )
+
+            # Convert results to DataFrame
+            if use_storage_api:
+                df = results.to_dataframe(bqstorage_client=self.bqstorage_client)
             else:
-                query = f"CALL `{self.client.project}.{dataset_id}.{procedure_name}`()"
+                df = results.to_dataframe(create_bqstorage_client=False)
 
-            # Configure job with destination if specified
-            job_config = None
-            if output_dataset and output_table:
-                destination = f"{self.client.project}.{output_dataset}.{output_table}"
-                job_config = bigquery.QueryJobConfig(destination=destination)
+            return df
 
-            # Execute the stored procedure
-            query_job = self.client.query(query, job_config=job_config)
-            results = query_job.result()
+        except Exception as e:
+            print(f"Error executing stored procedure: {str(e)}")
+            raise
 
-            # Convert results to DataFrame
-            df = results.to_dataframe()
+    def execute_stored_procedure_sweep(
+        self,
+        procedure_name: str,
+        dataset_id: str,
+        parameter_grid: dict,
+        max_concurrent_jobs: int = 8,
+        use_storage_api: bool = False,
+    ) -> pd.DataFrame:
+        """
+        Execute a stored procedure for every combination of a parameter grid, several jobs at a time
 
-            if output_dataset and output_table:
-                print(f"Results saved to {destination}")
+        Args:
+            procedure_name: Name of the stored procedure
+            dataset_id: Dataset containing the stored procedure
+            parameter_grid: Dictionary of parameter name to list of values, in argument order,
+                e.g. {"brand": [...], "marketplace": [...], "month": [...]}
+            max_concurrent_jobs: Maximum number of jobs running at once
+            use_storage_api: Fetch the results over the Storage Read API
+        Returns:
+            DataFrame with the results of every call, with the call's parameters added as columns
+        """
+        names = list(parameter_grid)
+        combinations = [dict(zip(names, values)) for values in itertools.product(*parameter_grid.values())]
 
-            return df
+        print(f"Running {procedure_name} for {len(combinations)} parameter combinations")
+
+        def run(parameters: dict) -> pd.DataFrame:
+            df = self.execute_stored_procedure(
+                procedure_name=procedure_name,
+                dataset_id=dataset_id,
+                parameters=parameters,
+                use_storage_api=use_storage_api,
+            )
+            # Tag each row with the call it came from, unless the procedure already returns that column
+            return df.assign(**{k: v for k, v in parameters.items() if k not in df.columns})
+
+        frames = []
+        failed = []
+        with ThreadPoolExecutor(max_workers=max_concurrent_jobs) as executor:
+            futures = [executor.submit(run, parameters) for parameters in combinations]
+            for parameters, future in zip(combinations, futures):
+                try:
+                    frames.append(future.result())
+                except Exception as e:
+                    print(f"Error executing {procedure_name} with {parameters}: {str(e)}")
+                    failed.append(parameters)
+
+        if failed:
+            raise RuntimeError(f"{len(failed)} of {len(combinations)} calls to {procedure_name} failed")
+
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    def export_stored_procedure_results(
+        self,
+        procedure_name: str,
+        dataset_id: str,
+        output_path: str,
+        filename: str,
+        parameters: dict = None,
+        file_format: str = "csv",
+    ) -> str:
+        """
+        Execute a stored procedure and stream its results to a CSV or Parquet file
+
+        Rows are fetched as Arrow record batches over the Storage Read API and written batch by batch,
+        so memory stays bounded by the batch size rather than the result size.
+
+        Args:
+            procedure_name: Name of the stored procedure
+            dataset_id: Dataset containing the stored procedure
+            output_path: Directory to write the file to
+            filename: Name of the output file
+            parameters: Dictionary of parameters to pass to the stored procedure
+            file_format: "csv" or "parquet"
+        Returns:
+            Path to the written file
+        """
+        try:
+            results = self.call_stored_procedure(
+                procedure_name=procedure_name, dataset_id=dataset_id, parameters=parameters, use_storage_api=True
+            )
+            batches = results.to_arrow_iterable(bqstorage_client=self.bqstorage_client)
+
+            return self.save_record_batches(batches, output_path, filename, file_format=file_format)
 
         except Exception as e:
-            print(f"Error executing stored procedure: {str(e)}")
+            print(f"Error exporting stored procedure results: {str(e)}")
             raise
 
     def save_results_to_csv(self, df: pd.DataFrame, output_path: str, filename: str) -> str:
@@ -137,3 +613,53 @@ class BigQueryOperations:
         except Exception as e:
             print(f"Error saving results to CSV: {str(e)}")
             raise
+
+    def save_record_batches(self, batches, output_path: str, filename: str, file_format: str = "csv") -> str:
+        """
+        Stream Arrow record batches to a CSV or Parquet file, one batch at a time
+
+        Args:
+            batches: Iterable of pyarrow.RecordBatch sharing one schema
+            output_path: Directory to write the file to
+            filename: Name of the output file
+            file_format: "csv" or "parquet"
+        Returns:
+            Path to the written file
+        """
+        if file_format not in ("csv", "parquet"):
+            raise ValueError(f"Unsupported file format: {file_format}")
+
+        try:
+            # Ensure output directory exists
+            Path(output_path).mkdir(parents=True, exist_ok=True)
+
+            # Create full file path
+            file_path = os.path.join(output_path, filename)
+
+            writer = None
+            rows = 0
+            try:
+                for batch in batches:
+                    # The writer needs the schema, which is only known once the first batch arrives
+                    if writer is None:
+                        if file_format == "csv":
+                            writer = pa_csv.CSVWriter(file_path, batch.schema)
+                        else:
+                            writer = pq.ParquetWriter(file_path, batch.schema)
+                    writer.write_batch(batch)
+                    rows += batch.num_rows
+            finally:
+                if writer is not None:
+                    writer.close()
+
+            if writer is None:
+                # No batches, still leave an (empty) file behind for downstream steps
+                Path(file_path).touch()
+
+            print(f"Results saved to {file_path} ({rows} rows)")
+
+            return file_path
+
+        except Exception as e:
+            print(f"Error saving record batches: {str(e)}")
+            raise
@@ -0,0 +1,187 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from pathlib import Path
+from types import MappingProxyType
+from typing import Any, Mapping
+import yaml
+from helper.logging import logger
+
+CONFIG_PATH = Path(__file__).parent.parent / "AmazonSellerCentral" / "report_config"
+
+# Parsed and validated configs, keyed by the hash of their YAML, so unchanged files are not parsed again
+CONFIG_CACHE_PATH = Path(os.environ.get("CONFIG_CACHE_DIR", Path(__file__).parent.parent / "data" / "_config_cache"))
+
+# Keys every entry of a config section must have, nested keys are separated by dots
+REQUIRED_KEYS = {
+    "marketplace_config": ("fulfillment_url_domain", "url_domain", "pay_url_domain", "entityId", "locale"),
+    "fulfillment_reports_config": ("params.reportFileFormat", "params.reportFRPId", "folder_name", "file_prefix"),
+    "amazon_ads_report_config": (
+        "url",
+        "payload.reportStartDate",
+        "payload.reportEndDate",
+        "params",
+        "folder_name",
+        "file_prefix",
+    ),
+    "sales_traffic_report_config": ("input.legacyReportId", "folder_name", "file_prefix"),
+}
+
+# Placeholders such as {start_date} in config values, filled in per job by render
+PLACEHOLDER = re.compile(r"\{(\w+)\}")
+
+# libyaml is several times faster than the pure Python parser, if PyYAML was built with it
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+_configs = {}
+_configs_lock = threading.Lock()
+
+
+class ConfigError(ValueError):
+    """Raised when a config file is invalid or a report is not defined in it"""
+
+    pass
+
+
+def freeze(value: Any) -> Any:
+    """Read-only copy of parsed YAML: mappings become MappingProxyType and lists tuples."""
+    if isinstance(value, Mapping):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def validate_config(data: Any, file_name: str) -> None:
+    """
+    Check that every entry of the known sections has the keys the scripts read.
+
+    Args:
+        data: Parsed YAML.
+        file_name: Name of the file, for the error message.
+
+    Raises:
+        ConfigError: Listing every missing key.
+    """
+    if not isinstance(data, Mapping):
+        raise ConfigError(f"{file_name} must contain a mapping of config sections")
+
+    problems = []
+    for section, required_keys in REQUIRED_KEYS.items():
+        if section not in data:
+            continue
+        if not isinstance(data[section], Mapping):
+            problems.append(f"{section} must be a mapping")
+            continue
+        for name, entry in data[section].items():
+            for required_key in required_keys:
+                value = entry
+                for key in required_key.split("."):
+                    value = value.get(key) if isinstance(value, Mapping) else None
+                if value is None:
+                    problems.append(f"{section}.{name} has no {required_key}")
+
+    if problems:
+        raise ConfigError(f"Invalid {file_name}: " + "; ".join(problems))
+
+
+def _parse_config(file_path: Path, content: bytes, digest: str) -> Any:
+    """Parse and validate a config file, or read it from the on-disk cache if it was compiled before."""
+    cache_file = CONFIG_CACHE_PATH / f"{file_path.stem}-{digest[:16]}.json"
+    try:
+        with open(cache_file, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        pass
+
+    data = yaml.load(content, Loader=YamlLoader)
+    validate_config(data, file_path.name)
+
+    try:
+        CONFIG_CACHE_PATH.mkdir(parents=True, exist_ok=True)
+        temporary_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+        with open(temporary_file, "w", encoding="utf-8") as file:
+            json.dump(data, file)
+        os.replace(temporary_file, cache_file)
+    except (OSError, TypeError) as e:
+        logger.warning(f"Could not cache compiled {file_path.name}: {e}")
+
+    return data
+
+
+def load_config(file_name: str) -> Mapping:
+    """
+    Load a config file from report_config, validated and read-only.
+
+    Each file is parsed and validated once per content hash. Later loads, also by later runs through the
+    compiled copy in CONFIG_CACHE_PATH, only hash the file. The result is shared, use render to get a
+    copy for a job.
+
+    Args:
+        file_name: File name in report_config (e.g. "fulfillment_all_reports_config.yaml"), or a path.
+
+    Returns:
+        Mapping: The config, with mappings as MappingProxyType and lists as tuples.
+
+    Raises:
+        ConfigError: If the file is invalid.
+    """
+    file_path = CONFIG_PATH / file_name
+    content = file_path.read_bytes()
+    digest = hashlib.sha256(content).hexdigest()
+
+    with _configs_lock:
+        key = (str(file_path), digest)
+        if key not in _configs:
+            _configs[key] = freeze(_parse_config(file_path, content, digest))
+        return _configs[key]
+
+
+def render(template: Any, **fields) -> Any:
+    """
+    Copy a config entry for one job, filling in its {placeholders}.
+
+    A value that is only a placeholder takes the field as is (e.g. an int timestamp), placeholders inside
+    longer strings are formatted. Placeholders without a field are left as they are.
+
+    Args:
+        template: Config entry from load_config.
+        **fields: Values of the placeholders, e.g. start_date or url_domain.
+
+    Returns:
+        The entry as plain dicts and lists, owned by the caller.
+    """
+    if isinstance(template, Mapping):
+        return {key: render(value, **fields) for key, value in template.items()}
+    if isinstance(template, (list, tuple)):
+        return [render(value, **fields) for value in template]
+    if isinstance(template, str):
+        match = PLACEHOLDER.fullmatch(template)
+        if match and match.group(1) in fields:
+            return fields[match.group(1)]
+        return PLACEHOLDER.sub(lambda match: str(fields.get(match.group(1), match.group(0))), template)
+    return template
+
+
+def get_report_config(config: Mapping, section: str, report_name: str, **fields) -> dict:
+    """
+    Copy of one report definition with its placeholders filled in.
+
+    Args:
+        config: Config from load_config.
+        section: Section of the report definitions (e.g. "fulfillment_reports_config").
+        report_name: Name of the report.
+        **fields: Values of the placeholders, see render.
+
+    Returns:
+        dict: The report definition.
+
+    Raises:
+        ConfigError: If the report is not defined.
+    """
+    reports = config[section]
+    if report_name not in reports:
+        raise ConfigError(f"Unknown report '{report_name}' in {section}, available reports: {', '.join(reports)}")
+    return render(reports[report_name], **fields)
@@ -0,0 +1,363 @@
+import csv
+import hashlib
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+from helper.logging import logger
+from helper.utils import STORAGE_STATE_PATH
+from helper.validation import bigquery_column_name
+
+# Numeric sums are rounded before hashing so float summation order cannot change the digest
+NUMERIC_PRECISION = 2
+
+# Warehouse types that keep a value's text as it was in the file, so its length can be compared
+TEXT_TYPES = {"STRING"}
+
+# Warehouse types of a date column the per-date query converts to its YYYY-MM-DD day
+TIMESTAMP_TYPES = {"TIMESTAMP", "DATETIME"}
+
+
+def _digest(row_count: int, columns: dict) -> str:
+    """Hash a row count and per-column aggregates, identically for file and warehouse fingerprints."""
+    parts = [str(row_count)]
+    for column in sorted(columns):
+        stats = columns[column]
+        if stats["numeric_sum"] is not None:
+            parts.append(f"{column}:{stats['non_null']}:{stats['numeric_sum']:.{NUMERIC_PRECISION}f}")
+        elif stats["total_length"] is not None:
+            parts.append(f"{column}:{stats['non_null']}:{stats['total_length']}")
+        else:
+            parts.append(f"{column}:{stats['non_null']}")
+
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+
+def _numeric_or_none(array: pa.Array):
+    """Cast a string column to float64, or return None if any value is not a plain number."""
+    try:
+        return pc.cast(array, pa.float64())
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        return None
+
+
+def _new_stats() -> dict:
+    return {"non_null": 0, "total_length": 0, "numeric_sum": 0.0}
+
+
+def _finalise(columns: dict, numeric_columns: set, typed_columns: set) -> dict:
+    """
+    Keep the checksums the warehouse can reproduce: the rounded sum of numeric columns, the text length of
+    the other columns unless the warehouse stores them typed, where the text is formatted differently.
+    """
+    for column, stats in columns.items():
+        if column in numeric_columns:
+            stats["numeric_sum"] = round(stats["numeric_sum"] or 0.0, NUMERIC_PRECISION)
+            stats["total_length"] = None
+        else:
+            stats["numeric_sum"] = None
+            if column in typed_columns:
+                stats["total_length"] = None
+    return columns
+
+
+def typed_columns(bigquery_operations, table_ref: str) -> list:
+    """
+    Columns a warehouse table stores with a type other than STRING, e.g. autodetected TIMESTAMP, DATE or BOOL.
+
+    Args:
+        bigquery_operations (BigQueryOperations): Connected BigQuery helper.
+        table_ref (str): Fully qualified warehouse table.
+
+    Returns:
+        list: Column names, for fingerprint_file's typed_columns.
+    """
+    schema = bigquery_operations.client.get_table(table_ref).schema
+    return sorted(field.name for field in schema if field.field_type not in TEXT_TYPES)
+
+
+def fingerprint_file(
+    folder_name: str, file_name: str, date_column: str = None, date_format: str = None, typed_columns: list = None
+) -> dict:
+    """
+    Fingerprint a landed report without loading it into a DataFrame.
+
+    The file is memory-mapped and parsed in Arrow record batches, values are never turned into Python
+    objects. Per column the fingerprint holds the non-null count and either the numeric sum, for columns
+    where every value parses as a number, or the total character length. Per date it holds the row count
+    and a hash of the same aggregates for that date.
+
+    Args:
+        folder_name (str): The folder the report was saved in.
+        file_name (str): The name of the report file.
+        date_column (str): Report column holding the row's date, enables the per-date hashes.
+        date_format (str): strptime format of date_column, dates are normalised to YYYY-MM-DD when given.
+            Needed when the warehouse stores date_column as a DATE, DATETIME or TIMESTAMP.
+        typed_columns (list): Columns the warehouse stores with a type other than STRING, see typed_columns.
+            Their text is formatted differently there, so only their non-null count is compared.
+
+    Returns:
+        dict: row_count, columns (per-column aggregates), dates (per-date row_count and hash) and digest.
+    """
+    file_path = STORAGE_STATE_PATH / folder_name / file_name
+    logger.info(f"Fingerprinting {file_path}")
+
+    with open(file_path, "r", encoding="utf-8", newline="") as file:
+        header = next(csv.reader([file.readline()]), [])
+    names = [bigquery_column_name(name) for name in header]
+
+    # Read every column as a string, empty values become nulls like they do in a BigQuery load
+    read_options = pa_csv.ReadOptions(column_names=names, skip_rows=1)
+    convert_options = pa_csv.ConvertOptions(
+        column_types={name: pa.string() for name in names},
+        strings_can_be_null=True,
+    )
+
+    row_count = 0
+    columns = {name: _new_stats() for name in names}
+    numeric_columns = set(names)
+    typed_columns = set(typed_columns or [])
+    dates = {}
+
+    with pa.memory_map(str(file_path), "r") as source:
+        reader = pa_csv.open_csv(source, read_options=read_options, convert_options=convert_options)
+
+        for batch in reader:
+            row_count += batch.num_rows
+            per_row = {}
+
+            for name, array in zip(names, batch.columns):
+                lengths = pc.fill_null(pc.utf8_length(array), 0)
+                numeric = _numeric_or_none(array) if name in numeric_columns else None
+                if numeric is None:
+                    numeric_columns.discard(name)
+
+                stats = columns[name]
+                stats["non_null"] += len(array) - array.null_count
+                stats["total_length"] += pc.sum(lengths).as_py() or 0
+                if numeric is not None:
+                    stats["numeric_sum"] += pc.sum(numeric).as_py() or 0.0
+
+                per_row[f"{name}__non_null"] = pc.cast(pc.is_valid(array), pa.int64())
+                per_row[f"{name}__total_length"] = lengths
+                per_row[f"{name}__numeric_sum"] = numeric if numeric is not None else pa.nulls(len(array), pa.float64())
+
+            if date_column:
+                day = batch.column(names.index(bigquery_column_name(date_column)))
+                if date_format:
+                    day = pc.strftime(pc.strptime(day, format=date_format, unit="s"), format="%Y-%m-%d")
+
+                # One vectorized group-by per batch, merged into the running per-date totals
+                grouped = (
+                    pa.table({"__date": day, "__rows": pa.array(np.ones(len(day), dtype=np.int64)), **per_row})
+                    .group_by("__date")
+                    .aggregate([("__rows", "sum")] + [(key, "sum") for key in per_row])
+                    .to_pylist()
+                )
+                for group in grouped:
+                    totals = dates.setdefault(
+                        group["__date"], {"row_count": 0, "columns": {name: _new_stats() for name in names}}
+                    )
+                    totals["row_count"] += group["__rows_sum"]
+                    for name in names:
+                        for stat in ("non_null", "total_length", "numeric_sum"):
+                            totals["columns"][name][stat] = (totals["columns"][name][stat] or 0) + (
+                                group[f"{name}__{stat}_sum"] or 0
+                            )
+
+    columns = _finalise(columns, numeric_columns, typed_columns)
+    fingerprint = {
+        "row_count": row_count,
+        "columns": columns,
+        "dates": {
+            day: {
+                "row_count": totals["row_count"],
+                "hash": _digest(totals["row_count"], _finalise(totals["columns"], numeric_columns, typed_columns)),
+            }
+            for day, totals in sorted(dates.items(), key=lambda item: str(item[0]))
+        },
+        "digest": _digest(row_count, columns),
+    }
+    logger.info(f"Fingerprint of {file_name}: {row_count} rows, digest {fingerprint['digest']}")
+
+    return fingerprint
+
+
+def date_expression(date_column: str, column_type: str = "STRING", date_format: str = None) -> str:
+    """
+    SQL expression of a row's day, as the YYYY-MM-DD string fingerprint_file groups the file by.
+
+    Args:
+        date_column (str): Warehouse column holding the row's date.
+        column_type (str): BigQuery type of date_column.
+        date_format (str): Format of a STRING date_column, the same strptime format given to fingerprint_file.
+
+    Returns:
+        str: The expression.
+    """
+    if column_type in TIMESTAMP_TYPES:
+        return f"CAST(DATE(`{date_column}`) AS STRING)"
+    if column_type == "DATE":
+        return f"CAST(`{date_column}` AS STRING)"
+    if date_format:
+        return f"CAST(DATE(SAFE.PARSE_TIMESTAMP('{date_format}', `{date_column}`)) AS STRING)"
+    return f"`{date_column}`"
+
+
+def fingerprint_queries(
+    table_ref: str,
+    fingerprint: dict,
+    date_column: str = None,
+    where: str = None,
+    column_types: dict = None,
+    date_format: str = None,
+) -> tuple:
+    """
+    Build the BigQuery queries computing the same aggregates as fingerprint_file.
+
+    Args:
+        table_ref (str): Fully qualified warehouse table.
+        fingerprint (dict): File fingerprint, decides which columns are summed numerically and which lengths
+            are compared.
+        date_column (str): Warehouse column holding the row's date, for the per-date query.
+        where (str): Optional filter selecting the report's slice of the table.
+        column_types (dict): Warehouse column to its BigQuery type, decides how date_column becomes a day.
+        date_format (str): strptime format of date_column, as given to fingerprint_file.
+
+    Returns:
+        tuple: (total query, per-date query or None)
+    """
+    aggregates = ["COUNT(*) AS row_count"]
+    for column, stats in fingerprint["columns"].items():
+        aggregates.append(f"COUNT(`{column}`) AS `{column}__non_null`")
+        if stats["total_length"] is not None:
+            aggregates.append(f"SUM(LENGTH(`{column}`)) AS `{column}__total_length`")
+        if stats["numeric_sum"] is not None:
+            aggregates.append(f"SUM(SAFE_CAST(`{column}` AS FLOAT64)) AS `{column}__numeric_sum`")
+
+    select = ",\n    ".join(aggregates)
+    where_clause = f"\nWHERE {where}" if where else ""
+
+    total_query = f"SELECT\n    {select}\nFROM `{table_ref}`{where_clause}"
+    date_query = None
+    if date_column:
+        day = date_expression(date_column, (column_types or {}).get(date_column, "STRING"), date_format)
+        date_query = (
+            f"SELECT\n    {day} AS __date,\n    {select}\n" f"FROM `{table_ref}`{where_clause}\nGROUP BY __date"
+        )
+
+    return total_query, date_query
+
+
+def _fingerprint_from_row(row: dict, fingerprint: dict) -> dict:
+    columns = {}
+    for column, stats in fingerprint["columns"].items():
+        columns[column] = {
+            "non_null": row[f"{column}__non_null"] or 0,
+            "total_length": (row[f"{column}__total_length"] or 0) if stats["total_length"] is not None else None,
+            "numeric_sum": (
+                round(row[f"{column}__numeric_sum"] or 0.0, NUMERIC_PRECISION)
+                if stats["numeric_sum"] is not None
+                else None
+            ),
+        }
+    return columns
+
+
+def fingerprint_warehouse(
+    bigquery_operations,
+    table_ref: str,
+    fingerprint: dict,
+    date_column: str = None,
+    where: str = None,
+    date_format: str = None,
+) -> dict:
+    """
+    Compute the warehouse fingerprint matching a file fingerprint with aggregate queries in BigQuery.
+
+    Args:
+        bigquery_operations (BigQueryOperations): Connected BigQuery helper.
+        table_ref (str): Fully qualified warehouse table.
+        fingerprint (dict): File fingerprint from fingerprint_file.
+        date_column (str): Warehouse column holding the row's date.
+        where (str): Optional filter selecting the report's slice of the table.
+        date_format (str): strptime format of date_column, as given to fingerprint_file.
+
+    Returns:
+        dict: Fingerprint in the same shape as fingerprint_file.
+
+    Raises:
+        ValueError: If the file fingerprint compares text lengths of columns the warehouse stores typed.
+    """
+    column_types = {field.name: field.field_type for field in bigquery_operations.client.get_table(table_ref).schema}
+    typed = [
+        column
+        for column, stats in fingerprint["columns"].items()
+        if stats["total_length"] is not None and column_types.get(column, "STRING") not in TEXT_TYPES
+    ]
+    if typed:
+        raise ValueError(
+            f"{table_ref} stores {typed} typed, fingerprint the file with "
+            f"typed_columns=typed_columns(bigquery_operations, table_ref)"
+        )
+
+    total_query, date_query = fingerprint_queries(
+        table_ref,
+        fingerprint,
+        date_column=date_column,
+        where=where,
+        column_types=column_types,
+        date_format=date_format,
+    )
+
+    total = bigquery_operations.query_to_dataframe(total_query, use_storage_api=False).to_dict("records")[0]
+    columns = _fingerprint_from_row(total, fingerprint)
+
+    dates = {}
+    if date_query:
+        for row in bigquery_operations.query_to_dataframe(date_query, use_storage_api=False).to_dict("records"):
+            dates[row["__date"]] = {
+                "row_count": row["row_count"],
+                "hash": _digest(row["row_count"], _fingerprint_from_row(row, fingerprint)),
+            }
+
+    return {
+        "row_count": total["row_count"],
+        "columns": columns,
+        "dates": dict(sorted(dates.items(), key=lambda item: str(item[0]))),
+        "digest": _digest(total["row_count"], columns),
+    }
+
+
+def compare_fingerprints(file_fingerprint: dict, warehouse_fingerprint: dict) -> list:
+    """
+    List the differences between a file fingerprint and a warehouse fingerprint.
+
+    Args:
+        file_fingerprint (dict): Fingerprint from fingerprint_file.
+        warehouse_fingerprint (dict): Fingerprint from fingerprint_warehouse.
+
+    Returns:
+        list: Human readable mismatches, empty when the report equals the warehouse.
+    """
+    if file_fingerprint["digest"] == warehouse_fingerprint["digest"]:
+        return []
+
+    mismatches = []
+    if file_fingerprint["row_count"] != warehouse_fingerprint["row_count"]:
+        mismatches.append(
+            f"row_count: file {file_fingerprint['row_count']}, warehouse {warehouse_fingerprint['row_count']}"
+        )
+
+    for column, stats in file_fingerprint["columns"].items():
+        other = warehouse_fingerprint["columns"].get(column)
+        if other != stats:
+            mismatches.append(f"column {column}: file {stats}, warehouse {other}")
+
+    for day in sorted(set(file_fingerprint["dates"]) | set(warehouse_fingerprint["dates"]), key=str):
+        if file_fingerprint["dates"].get(day) != warehouse_fingerprint["dates"].get(day):
+            mismatches.append(
+                f"date {day}: file {file_fingerprint['dates'].get(day)}, warehouse {warehouse_fingerprint['dates'].get(day)}"
+            )
+
+    return mismatches
@@ -1,24 +1,125 @@
+import atexit
+import contextvars
+import json
 import logging
-from pathlib import Path
+import os
+import queue
 import sys
+from contextlib import contextmanager
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from pathlib import Path
 
-# Set up logging
-logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)  # Log both INFO and ERROR messages
+# Configurable through the environment
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "DEBUG").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text").lower()  # text or json
+LOG_FILE_PATH = Path(os.environ.get("LOG_FILE", Path(__file__).parent.parent / "logfile.txt"))
+LOG_MAX_BYTES = int(os.environ.get("LOG_MAX_BYTES", 10 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.environ.get("LOG_BACKUP_COUNT", 5))
+
+# Per-job fields (report, brand, marketplace, ...) attached to every record logged inside log_context
+_log_context = contextvars.ContextVar("log_context", default={})
+
+
+@contextmanager
+def log_context(**fields):
+    """
+    Attach fields such as report, brand and marketplace to every record logged inside the block.
+
+    Args:
+        **fields: Fields to add to the records.
+    """
+    token = _log_context.set({**_log_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
+
+
+def set_log_context(**fields) -> None:
+    """
+    Attach fields to every record logged from now on in the current context, e.g. for a whole script run.
+
+    Args:
+        **fields: Fields to add to the records.
+    """
+    _log_context.set({**_log_context.get(), **fields})
+
+
+class ContextQueueHandler(QueueHandler):
+    """
+    Queue handler that only captures the record on the calling thread.
+
+    The context fields are read here because context variables are not visible to the listener thread,
+    formatting and I/O happen on the listener.
+    """
 
-# formatter with a timestamp
-formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.context = _log_context.get()
+        # Resolve the arguments and traceback now, they may not be picklable or may change later
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class TextFormatter(logging.Formatter):
+    """The original "time - level - message" format, followed by the context fields if there are any."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        context = getattr(record, "context", None)
+        if context:
+            fields = " ".join(f"{key}={value}" for key, value in context.items())
+            first_line, _, rest = line.partition("\n")
+            line = f"{first_line} [{fields}]" + (f"\n{rest}" if rest else "")
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with the context fields as top-level keys."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+            **getattr(record, "context", {}),
+        }
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+if LOG_FORMAT == "json":
+    formatter = JsonFormatter()
+else:
+    formatter = TextFormatter("%(asctime)s - %(levelname)s - %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
 
 # stream handler to print log messages to command line
 stream_handler = logging.StreamHandler(sys.stdout)
 stream_handler.setFormatter(formatter)
 
-
-# file handler to write log messages text file
-log_file = Path(__file__).parent.parent / "logfile.txt"
-file_handler = logging.FileHandler(log_file)
+# file handler writing to logfile.txt, rotated once it reaches LOG_MAX_BYTES
+file_handler = RotatingFileHandler(
+    LOG_FILE_PATH, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"
+)
 file_handler.setFormatter(formatter)
 
-# Add both handlers to the logger
-logger.addHandler(stream_handler)
-logger.addHandler(file_handler)
+# Callers only put records on the queue, a single listener thread formats and writes them
+log_queue = queue.SimpleQueue()
+queue_handler = ContextQueueHandler(log_queue)
+listener = QueueListener(log_queue, stream_handler, file_handler, respect_handler_level=True)
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(LOG_LEVEL)
+logger.addHandler(queue_handler)
+
+listener.start()
+# Flush the queue before the interpreter exits
+atexit.register(listener.stop)
@@ -0,0 +1,124 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+from typing import Union
+import requests
+from helper.logging import logger
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Reports larger than this are streamed to disk and transformed in chunks instead of in memory
+MEMORY_BUDGET_MB = int(os.environ.get("MEMORY_BUDGET_MB", 256))
+MEMORY_BUDGET_BYTES = MEMORY_BUDGET_MB * 1024 * 1024
+
+# Spilled files go next to the landed reports, a tmpfs /tmp would count against the container memory
+SPILL_PATH = Path(os.environ.get("SPILL_DIR", Path(__file__).parent.parent / "data" / "_spill"))
+
+# Bytes read from the network, and rows converted, per step when spilling
+CHUNK_SIZE = 1024 * 1024
+CHUNK_ROWS = 100_000
+
+# Report content is either held in memory or, once over the budget, a spilled file
+Content = Union[bytes, Path]
+
+
+def exceeds_budget(size: int, expansion: float = 1) -> bool:
+    """
+    Check whether content of this size would not fit in the memory budget.
+
+    Args:
+        size (int): Size of the content in bytes.
+        expansion (float): How much larger the content gets once parsed, e.g. for compressed Excel files.
+
+    Returns:
+        bool: True if the content should be processed in chunks on disk.
+    """
+    return size * expansion > MEMORY_BUDGET_BYTES
+
+
+def new_spill_file(suffix: str = ".tmp") -> Path:
+    """
+    Create an empty file to spill content to.
+
+    Args:
+        suffix (str): File suffix, e.g. ".csv".
+
+    Returns:
+        Path: Path of the new file, it is deleted by whoever consumes it.
+    """
+    SPILL_PATH.mkdir(parents=True, exist_ok=True)
+    file_descriptor, file_path = tempfile.mkstemp(suffix=suffix, dir=SPILL_PATH)
+    os.close(file_descriptor)
+    return Path(file_path)
+
+
+def content_size(content: Content) -> int:
+    """Size in bytes of in-memory or spilled content."""
+    return content.stat().st_size if isinstance(content, Path) else len(content)
+
+
+def read_response(response: requests.Response, suffix: str = ".tmp") -> Content:
+    """
+    Read a streamed response body, spilling it to disk once it exceeds the memory budget.
+
+    The request must be made with stream=True, otherwise the body is already in memory.
+
+    Args:
+        response (requests.Response): The streamed response.
+        suffix (str): Suffix of the spill file.
+
+    Returns:
+        Content: The body as bytes, or the path of the spilled file.
+    """
+    content_length = int(response.headers.get("Content-Length") or 0)
+    chunks = []
+    size = 0
+    file = None
+    file_path = None
+
+    try:
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            size += len(chunk)
+            if file is None and exceeds_budget(max(size, content_length)):
+                file_path = new_spill_file(suffix)
+                logger.info(f"Response exceeds the {MEMORY_BUDGET_MB} MB memory budget, spilling to {file_path}")
+                file = open(file_path, "wb")
+                file.writelines(chunks)
+                chunks = []
+            if file is not None:
+                file.write(chunk)
+            else:
+                chunks.append(chunk)
+    except Exception:
+        if file is not None:
+            file.close()
+            file_path.unlink(missing_ok=True)
+        raise
+    finally:
+        response.close()
+
+    if file is not None:
+        file.close()
+        return file_path
+    return b"".join(chunks)
+
+
+def process_peak_rss_mb() -> float:
+    """
+    Peak resident memory of the whole process so far.
+
+    This is the process's high-water mark, not the memory of one report: with several reports in one
+    process (threads, the benchmark's workers) it is the largest peak any of them caused so far.
+
+    Returns:
+        float: Peak RSS in MB, None where it cannot be measured.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KiB on Linux
+    return round(peak / 1024**2 if sys.platform == "darwin" else peak / 1024, 1)
@@ -0,0 +1,148 @@
+import atexit
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from helper.logging import log_context, logger, set_log_context
+from helper.memory import process_peak_rss_mb
+from helper.profiling import profile_stage
+
+# JSON-lines sink for stage timings, next to logfile.txt unless overridden
+METRICS_FILE_PATH = Path(os.environ.get("METRICS_FILE", Path(__file__).parent.parent / "metrics.jsonl"))
+
+RUN_ID = uuid.uuid4().hex[:12]
+
+_lock = threading.Lock()
+_records = []
+_context = contextvars.ContextVar("metrics_context", default={})
+
+# The one stage each per-report figure is taken from, since every stage sees the same data again
+REPORT_BYTES_STAGE = "download"
+REPORT_ROWS_STAGE = "save"
+
+
+def _write(record: dict) -> None:
+    """Append a record to the metrics file and keep it for the run summary."""
+    line = json.dumps(record, default=str)
+    with _lock:
+        _records.append(record)
+        with open(METRICS_FILE_PATH, "a", encoding="utf-8") as file:
+            file.write(line + "\n")
+
+
+@contextmanager
+def metrics_context(**fields):
+    """
+    Attach fields such as report, marketplace and brand to every span opened and every record logged
+    inside the block.
+
+    Args:
+        **fields: Fields to add to the spans.
+    """
+    token = _context.set({**_context.get(), **fields})
+    try:
+        with log_context(**fields):
+            yield
+    finally:
+        _context.reset(token)
+
+
+@contextmanager
+def span(stage: str, **fields):
+    """
+    Time a pipeline stage and write it as one JSON line when it ends.
+
+    The yielded dict can be updated inside the block, e.g. with bytes or rows once they are known.
+    When profiling is enabled (--profile) the stage is also run under cProfile and tracemalloc.
+
+    Args:
+        stage (str): Name of the stage (login, submit, poll, download, transform, save, upload, load, ...).
+        **fields: Extra fields for this span.
+
+    Yields:
+        dict: The span record.
+    """
+    record = {"run_id": RUN_ID, "stage": stage, **_context.get(), **fields}
+    started_at = datetime.now().isoformat(timespec="milliseconds")
+    start = time.perf_counter()
+    try:
+        with profile_stage(stage, record):
+            yield record
+        record.setdefault("status", "ok")
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = str(e)
+        raise
+    finally:
+        record["started_at"] = started_at
+        record["duration_s"] = round(time.perf_counter() - start, 3)
+        record["process_peak_rss_mb"] = process_peak_rss_mb()
+        _write(record)
+
+
+def run_summary() -> dict:
+    """
+    Summarise the spans recorded in this run.
+
+    Returns:
+        dict: Per stage and per report/marketplace: span count, errors, total and max seconds, bytes and rows.
+        A report's bytes are those downloaded and its rows those saved, not a sum over its stages.
+        process_peak_rss_mb is the peak RSS of the whole process, which cannot be split between reports
+        running in the same process.
+    """
+    summary = {"stages": {}, "reports": {}, "process_peak_rss_mb": process_peak_rss_mb()}
+
+    with _lock:
+        records = list(_records)
+
+    for record in records:
+        report_key = f"{record.get('report', '-')} | {record.get('marketplace', '-')}"
+        for group, key in (("stages", record["stage"]), ("reports", report_key)):
+            totals = summary[group].setdefault(
+                key, {"count": 0, "errors": 0, "total_s": 0.0, "max_s": 0.0, "bytes": 0, "rows": 0}
+            )
+            totals["count"] += 1
+            totals["errors"] += record.get("status") == "error"
+            totals["total_s"] = round(totals["total_s"] + record["duration_s"], 3)
+            totals["max_s"] = max(totals["max_s"], record["duration_s"])
+            if group == "stages" or record["stage"] == REPORT_BYTES_STAGE:
+                totals["bytes"] += record.get("bytes") or 0
+            if group == "stages" or record["stage"] == REPORT_ROWS_STAGE:
+                totals["rows"] += record.get("rows") or 0
+
+    return summary
+
+
+def log_run_summary() -> None:
+    """Log the run summary and write it to the metrics file as a final summary record."""
+    if not _records:
+        return
+
+    summary = run_summary()
+    for stage, totals in sorted(summary["stages"].items(), key=lambda item: -item[1]["total_s"]):
+        logger.info(f"[metrics] {stage}: {totals}")
+    for report, totals in summary["reports"].items():
+        logger.info(f"[metrics] {report}: {totals}")
+    logger.info(f"[metrics] process peak RSS: {summary['process_peak_rss_mb']} MB")
+
+    line = json.dumps({"run_id": RUN_ID, "stage": "run_summary", **summary}, default=str)
+    with _lock:
+        with open(METRICS_FILE_PATH, "a", encoding="utf-8") as file:
+            file.write(line + "\n")
+
+
+def start_run(**fields) -> None:
+    """
+    Start collecting metrics for a script run, the summary is written when the process exits.
+
+    Args:
+        **fields: Fields added to every span and log record of the run, e.g. portal, brand and marketplace.
+    """
+    _context.set({**_context.get(), **fields})
+    set_log_context(**fields)
+    atexit.register(log_run_summary)
@@ -0,0 +1,118 @@
+import cProfile
+import itertools
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from helper.logging import logger
+
+PROFILES_PATH = Path(__file__).parent.parent / "profiles"
+
+# Allocation sites listed per stage in the top-allocations report
+TOP_ALLOCATIONS = 25
+
+_settings = {"enabled": False, "output_dir": None, "stages": None}
+_sequence = itertools.count(1)
+
+# cProfile allows one active profiler (per process since Python 3.12), so nested or concurrent
+# stages are skipped while another stage is being profiled
+_profiler_lock = threading.Lock()
+
+
+def enable_profiling(run_id: str, stages: str = "all") -> Path:
+    """
+    Profile every following pipeline stage with cProfile and tracemalloc.
+
+    Args:
+        run_id (str): Run id, the profiles are written to profiles/<run_id>.
+        stages (str): Comma-separated stages to profile (e.g. "transform,save,upload"), or "all".
+
+    Returns:
+        Path: The folder the .pstats files and allocation reports are written to.
+    """
+    output_dir = PROFILES_PATH / run_id
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    _settings["enabled"] = True
+    _settings["output_dir"] = output_dir
+    _settings["stages"] = None if stages == "all" else {stage.strip() for stage in stages.split(",")}
+
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+    logger.info(f"Profiling {stages} stages, writing profiles to {output_dir}")
+    return output_dir
+
+
+def _write_allocations_report(
+    file_path: Path, stage: str, fields: dict, before: tracemalloc.Snapshot, after: tracemalloc.Snapshot, peak: int
+) -> None:
+    """Write the allocation sites that grew the most during a stage."""
+    ignored = [
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    ]
+    differences = after.filter_traces(ignored).compare_to(before.filter_traces(ignored), "lineno")
+
+    with open(file_path, "w", encoding="utf-8") as file:
+        file.write(f"Stage: {stage} {fields}\n")
+        file.write(f"Peak memory allocated by the stage: {peak / 1024**2:.1f} MB\n")
+        file.write(f"Top {TOP_ALLOCATIONS} allocation sites by growth:\n")
+        for difference in differences[:TOP_ALLOCATIONS]:
+            file.write(f"{difference}\n")
+
+
+@contextmanager
+def profile_stage(stage: str, record: dict):
+    """
+    Profile a pipeline stage when profiling is enabled, otherwise do nothing.
+
+    Writes <sequence>_<stage>_<report>.pstats (open with `python -m pstats` or snakeviz) and a
+    matching _allocations.txt with the peak memory the stage allocated and the top allocation sites.
+    Taking the tracemalloc snapshots slows the run down, so only profile the stages of interest.
+
+    Args:
+        stage (str): Name of the stage.
+        record (dict): The metrics span record, the profile paths are added to it.
+    """
+    if not _settings["enabled"] or (_settings["stages"] is not None and stage not in _settings["stages"]):
+        yield
+        return
+
+    if not _profiler_lock.acquire(blocking=False):
+        yield
+        return
+
+    try:
+        profiler = cProfile.Profile()
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            elapsed = time.perf_counter() - start
+            # Memory the stage added at its peak, on top of what was allocated when it started
+            peak = tracemalloc.get_traced_memory()[1] - baseline
+            after = tracemalloc.take_snapshot()
+
+            label = re.sub(r"[^0-9A-Za-z_-]+", "_", str(record.get("report") or record.get("file") or ""))
+            base_name = f"{next(_sequence):03d}_{stage}" + (f"_{label}" if label else "")
+            stats_path = _settings["output_dir"] / f"{base_name}.pstats"
+            allocations_path = _settings["output_dir"] / f"{base_name}_allocations.txt"
+
+            pstats.Stats(profiler).dump_stats(stats_path)
+            _write_allocations_report(allocations_path, stage, record, before, after, peak)
+
+            record["profile"] = str(stats_path)
+            record["peak_traced_mb"] = round(peak / 1024**2, 1)
+            logger.info(f"Profiled {stage} in {elapsed:.2f}s, peak {peak / 1024**2:.1f} MB, written to {stats_path}")
+    finally:
+        _profiler_lock.release()
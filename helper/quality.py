@@ -0,0 +1,340 @@
+import csv
+import json
+import os
+import shutil
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Mapping
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+from helper.config import load_config
+from helper.logging import logger
+from helper.metrics import span
+from helper.report_cache import drop_cached_report
+from helper.utils import STORAGE_STATE_PATH
+
+QUALITY_RULES_FILE = "quality_rules.yaml"
+
+# Reports failing their rules are moved here with a <file>.quality.json summary instead of being uploaded
+QUARANTINE_PATH = Path(os.environ.get("QUARANTINE_DIR", STORAGE_STATE_PATH / "_quarantine"))
+
+# Bytes of the file Arrow parses at a time, fewer larger batches mean fewer kernel calls per file
+BLOCK_SIZE = 16 << 20
+
+# Date formats Arrow's ISO 8601 cast parses several times faster than strptime
+ISO_FORMATS = {"%Y-%m-%d": pa.timestamp("s"), "%Y-%m-%dT%H:%M:%S%z": pa.timestamp("s", "UTC")}
+
+# A plain number once currency symbols, thousands separators and percent signs are stripped
+NUMBER_PATTERN = r"^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$"
+
+
+class QualityCheckError(Exception):
+    """Raised when a report fails its data-quality rules, the file is quarantined instead of uploaded"""
+
+    pass
+
+
+def get_quality_rules(folder_name: str) -> dict:
+    """
+    Rules of a report from quality_rules.yaml, the defaults merged with the entry of its folder.
+
+    Args:
+        folder_name (str): The folder the report is saved in, e.g. "all_orders".
+
+    Returns:
+        dict: The rules, see quality_rules.yaml for the keys.
+    """
+    rules = load_config(QUALITY_RULES_FILE)["quality_rules"]
+    return {**rules.get("defaults", {}), **rules.get(folder_name, {})}
+
+
+def resolve_column(names: list, column: str) -> str:
+    """Find a column of a rule in the report header, ignoring case and surrounding whitespace, or None."""
+    if column in names:
+        return column
+    matches = {name.strip().lower(): name for name in names}
+    return matches.get(column.strip().lower())
+
+
+def parse_range_date(value: str) -> datetime:
+    """Parse a report start or end date, in YYYY-MM-DD or YYYY/MM/DD format."""
+    return datetime.strptime(value.replace("/", "-"), "%Y-%m-%d")
+
+
+def to_float(array: pa.Array) -> pa.Array:
+    """
+    Cast a string column to float64 like validation.to_numeric, values that are not numbers become nulls.
+
+    Args:
+        array (pa.Array): String column.
+
+    Returns:
+        pa.Array: Float column.
+    """
+    try:
+        return pc.cast(array, pa.float64())
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        cleaned = pc.replace_substring_regex(array, pattern=r"[^0-9eE.+\-]", replacement="")
+        cleaned = pc.if_else(pc.match_substring_regex(cleaned, NUMBER_PATTERN), cleaned, pa.scalar(None, pa.string()))
+        return pc.cast(cleaned, pa.float64())
+
+
+def to_days(array: pa.Array, date_format: str) -> pa.Array:
+    """Parse a date or timestamp column to calendar days, values not in date_format become nulls."""
+    if date_format in ISO_FORMATS:
+        try:
+            return pc.cast(pc.cast(array, ISO_FORMATS[date_format]), pa.date32())
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+            # The cast fails on the first value that is not ISO 8601, strptime turns those into nulls
+            pass
+
+    parsed = pc.strptime(array, format=date_format, unit="s", error_is_null=True)
+    return pc.cast(pc.cast(parsed, pa.timestamp("s")), pa.date32())
+
+
+def pick_date_format(array: pa.Array, date_formats: list, first_day: datetime, last_day: datetime) -> str:
+    """
+    Choose the format that puts the most values of a column in the requested range.
+
+    Used on the first batch only. Formats such as %m/%d/%Y and %d/%m/%Y both parse days up to the 12th,
+    the requested range tells them apart.
+    """
+    if len(date_formats) == 1:
+        return date_formats[0]
+
+    def in_range(date_format: str) -> int:
+        days = to_days(array, date_format)
+        inside = pc.and_(
+            pc.greater_equal(days, pa.scalar(first_day.date())), pc.less_equal(days, pa.scalar(last_day.date()))
+        )
+        return pc.sum(inside).as_py() or 0
+
+    return max(date_formats, key=in_range)
+
+
+def check_report(file_path: Path, rules: Mapping, start_date: str = None, end_date: str = None) -> dict:
+    """
+    Check a saved report against its data-quality rules without loading it into a DataFrame.
+
+    The file is memory-mapped and parsed in Arrow record batches, every statistic is computed with
+    Arrow compute kernels per batch: row count, null rate of the columns the rules read, the days of the
+    requested range the report covers, rows outside that range, duplicate keys and the range of numeric
+    columns.
+
+    Args:
+        file_path (Path): Path of the saved CSV report.
+        rules (Mapping): Rules of the report from get_quality_rules.
+        start_date (str): Start of the requested range, YYYY-MM-DD or YYYY/MM/DD. Date rules need both dates.
+        end_date (str): End of the requested range.
+
+    Returns:
+        dict: The statistics, failures (human readable rule violations) and passed.
+    """
+    file_path = Path(file_path)
+    failures = []
+    result = {"file": file_path.name, "row_count": 0, "failures": failures}
+
+    skip_rows = rules.get("skip_rows", 0)
+    with open(file_path, "r", encoding="utf-8", newline="") as file:
+        for _ in range(skip_rows):
+            file.readline()
+        names = next(csv.reader([file.readline()]), [])
+        has_rows = file.read(1) != ""
+
+    if not names:
+        failures.append("empty file")
+        result["passed"] = False
+        return result
+
+    date_formats = list(rules.get("date_formats") or [])
+    check_dates = bool(rules.get("date_column") and date_formats and start_date and end_date)
+
+    # A half-generated report can miss columns, every column a rule reads has to be there
+    rule_columns = list(rules.get("required_columns") or []) + list(rules.get("unique_key") or [])
+    rule_columns += list(rules.get("ranges") or {}) + list(rules.get("max_null_rate") or {})
+    rule_columns += [rules["date_column"]] if check_dates else []
+    columns = {column: resolve_column(names, column) for column in rule_columns}
+    missing = [column for column, name in columns.items() if name is None]
+    if missing:
+        failures.append(f"missing columns: {', '.join(missing)}")
+        result["passed"] = False
+        return result
+
+    key_columns = [columns[column] for column in rules.get("unique_key") or []]
+    key_batches = []
+    ranges = {columns[column]: dict(bounds) for column, bounds in (rules.get("ranges") or {}).items()}
+    range_stats = {column: {"min": None, "max": None, "violations": 0} for column in ranges}
+    max_null_rates = {columns[column]: rate for column, rate in (rules.get("max_null_rate") or {}).items()}
+
+    if check_dates:
+        date_column = columns[rules["date_column"]]
+        first_day = parse_range_date(start_date)
+        last_day = parse_range_date(end_date)
+        slack = timedelta(days=rules.get("date_slack_days", 0))
+        lowest_day = pa.scalar((first_day - slack).date())
+        highest_day = pa.scalar((last_day + slack).date())
+        date_format = None
+        seen_days = set()
+        rows_out_of_range = 0
+
+    # Only the columns the rules read are converted, as strings with empty values as nulls like in a BigQuery
+    # load. Every row is still split into all columns, so rows cut off by a truncated download fail to parse.
+    checked_columns = list(dict.fromkeys(columns.values()))
+    null_counts = {name: 0 for name in checked_columns}
+    read_options = pa_csv.ReadOptions(column_names=names, skip_rows=skip_rows + 1, block_size=BLOCK_SIZE)
+    convert_options = pa_csv.ConvertOptions(
+        column_types={name: pa.string() for name in names},
+        strings_can_be_null=True,
+        # An empty list would convert every column
+        include_columns=checked_columns or names[:1],
+    )
+
+    try:
+        with pa.memory_map(str(file_path), "r") as source:
+            # Arrow cannot open a file that ends after its header, it has no rows to check
+            reader = (
+                pa_csv.open_csv(source, read_options=read_options, convert_options=convert_options) if has_rows else []
+            )
+
+            for batch in reader:
+                result["row_count"] += batch.num_rows
+
+                for name in null_counts:
+                    null_counts[name] += batch.column(name).null_count
+
+                if key_columns:
+                    key_batches.append(batch.select(key_columns))
+
+                for column, bounds in ranges.items():
+                    array = batch.column(column)
+                    values = to_float(array)
+                    stats = range_stats[column]
+                    # Values that are present but not numbers count as violations
+                    stats["violations"] += values.null_count - array.null_count
+                    minimum, maximum = (value.as_py() for value in pc.min_max(values).values())
+                    if minimum is not None:
+                        stats["min"] = minimum if stats["min"] is None else min(stats["min"], minimum)
+                        stats["max"] = maximum if stats["max"] is None else max(stats["max"], maximum)
+                    if bounds.get("min") is not None:
+                        stats["violations"] += pc.sum(pc.less(values, bounds["min"])).as_py() or 0
+                    if bounds.get("max") is not None:
+                        stats["violations"] += pc.sum(pc.greater(values, bounds["max"])).as_py() or 0
+
+                if check_dates:
+                    array = batch.column(date_column)
+                    if date_format is None:
+                        date_format = pick_date_format(array, date_formats, first_day, last_day)
+                    days = to_days(array, date_format)
+                    inside = pc.and_(pc.greater_equal(days, lowest_day), pc.less_equal(days, highest_day))
+                    # Dates that do not parse count as outside the range, rows without a date do not
+                    rows_out_of_range += len(array) - array.null_count - (pc.sum(inside).as_py() or 0)
+                    seen_days.update(pc.unique(days.drop_null()).to_pylist())
+
+    except pa.ArrowInvalid as e:
+        # Rows cut off by a truncated download do not parse
+        failures.append(f"unparseable: {str(e).splitlines()[0]}")
+        result["passed"] = False
+        return result
+
+    row_count = result["row_count"]
+    result["null_rates"] = {
+        name: round(count / row_count, 4) if row_count else 0.0 for name, count in null_counts.items()
+    }
+
+    if row_count < rules.get("min_rows", 0):
+        failures.append(f"{row_count} rows, at least {rules['min_rows']} expected")
+
+    for column, max_rate in max_null_rates.items():
+        if result["null_rates"][column] > max_rate:
+            failures.append(f"{column} is null in {result['null_rates'][column]:.2%} of rows, at most {max_rate:.2%}")
+
+    if key_columns and key_batches:
+        keys = pa.Table.from_batches(key_batches)
+        result["duplicate_keys"] = keys.num_rows - keys.group_by(key_columns).aggregate([]).num_rows
+        if result["duplicate_keys"]:
+            failures.append(f"{result['duplicate_keys']} rows repeat a key of ({', '.join(key_columns)})")
+
+    if ranges:
+        result["ranges"] = range_stats
+        for column, stats in range_stats.items():
+            if stats["violations"]:
+                failures.append(
+                    f"{stats['violations']} values of {column} outside [{ranges[column].get('min')}, "
+                    f"{ranges[column].get('max')}] or not numeric"
+                )
+
+    if check_dates:
+        requested_days = (last_day - first_day).days + 1
+        covered_days = sum(1 for day in seen_days if first_day.date() <= day <= last_day.date())
+        result["date_coverage"] = round(covered_days / requested_days, 4)
+        result["rows_out_of_range"] = rows_out_of_range
+        if result["date_coverage"] < rules.get("min_date_coverage", 0):
+            failures.append(
+                f"rows for {covered_days} of {requested_days} requested days, "
+                f"at least {rules['min_date_coverage']:.0%} expected"
+            )
+        if rows_out_of_range:
+            failures.append(f"{rows_out_of_range} rows dated outside {start_date} - {end_date} or unparseable")
+
+    result["passed"] = not failures
+    return result
+
+
+def quarantine_report(file_path: Path, folder_name: str, result: dict) -> Path:
+    """
+    Move a report that failed its checks to QUARANTINE_PATH, with the check result next to it.
+
+    Args:
+        file_path (Path): Path of the saved report.
+        folder_name (str): The folder the report was saved in.
+        result (dict): Result of check_report.
+
+    Returns:
+        Path: The quarantined file.
+    """
+    quarantine_path = QUARANTINE_PATH / folder_name / file_path.name
+    quarantine_path.parent.mkdir(parents=True, exist_ok=True)
+    shutil.move(str(file_path), quarantine_path)
+
+    with open(quarantine_path.with_name(f"{file_path.name}.quality.json"), "w", encoding="utf-8") as file:
+        json.dump(result, file, indent=2, default=str)
+
+    return quarantine_path
+
+
+def check_landed_report(
+    file_path: Path, folder_name: str, start_date: str = None, end_date: str = None, cache_key: str = None
+) -> dict:
+    """
+    Data-quality gate between saving a report and uploading it.
+
+    Args:
+        file_path (Path): Path returned by save_content_to_file.
+        folder_name (str): The folder the report was saved in, selects its rules in quality_rules.yaml.
+        start_date (str): Start of the requested range, YYYY-MM-DD or YYYY/MM/DD.
+        end_date (str): End of the requested range.
+        cache_key (str): Report cache key the report was cached or loaded under, the entry is removed if the
+            report fails, so a bad download is not served again.
+
+    Returns:
+        dict: Result of check_report.
+
+    Raises:
+        QualityCheckError: If the report fails a rule, it was moved to QUARANTINE_PATH and must not be uploaded.
+    """
+    file_path = Path(file_path)
+
+    with span("check", file=file_path.name) as record:
+        result = check_report(file_path, get_quality_rules(folder_name), start_date=start_date, end_date=end_date)
+        record["rows"] = result["row_count"]
+        record["passed"] = result["passed"]
+
+    if result["passed"]:
+        logger.info(f"Quality checks passed for {file_path.name}: {result['row_count']} rows")
+        return result
+
+    drop_cached_report(cache_key)
+    quarantine_path = quarantine_report(file_path, folder_name, result)
+    logger.error(f"Quality checks failed for {file_path.name}, quarantined to {quarantine_path}")
+    raise QualityCheckError(f"{file_path.name} failed its quality checks: {'; '.join(result['failures'])}")
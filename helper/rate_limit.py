@@ -0,0 +1,160 @@
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+import requests
+from helper.logging import logger
+
+# Requests per second per host and account: where a bucket starts, and the bounds it adapts between
+RATE_LIMIT_INITIAL_RPS = float(os.environ.get("RATE_LIMIT_INITIAL_RPS", 2))
+RATE_LIMIT_MIN_RPS = float(os.environ.get("RATE_LIMIT_MIN_RPS", 0.1))
+RATE_LIMIT_MAX_RPS = float(os.environ.get("RATE_LIMIT_MAX_RPS", 10))
+# Requests that may be sent back to back before the rate applies
+RATE_LIMIT_BURST = int(os.environ.get("RATE_LIMIT_BURST", 5))
+
+# Until the first throttling response the rate grows by SLOW_START_FACTOR per successful request,
+# afterwards by INCREASE_STEP; throttling multiplies it by DECREASE_FACTOR
+SLOW_START_FACTOR = 1.1
+INCREASE_STEP = 0.05
+DECREASE_FACTOR = 0.5
+THROTTLE_STATUS_CODES = (429, 503)
+# Throttled requests are resent this many times before the response is returned to the caller
+MAX_THROTTLE_RETRIES = 5
+
+
+class TokenBucket:
+    """
+    Token bucket whose rate adapts to the server: it grows while requests succeed, quickly until the
+    server first throttles and slowly afterwards, and halves when the server throttles, pausing for
+    Retry-After if the server sent one.
+    """
+
+    def __init__(self, name: str, rate: float = RATE_LIMIT_INITIAL_RPS, capacity: int = RATE_LIMIT_BURST):
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self.slow_start = True
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self) -> None:
+        """Block until a request may be sent."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.blocked_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.blocked_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def succeeded(self) -> None:
+        """Raise the rate a little after a request that was not throttled."""
+        with self.lock:
+            increased = self.rate * SLOW_START_FACTOR if self.slow_start else self.rate + INCREASE_STEP
+            self.rate = min(RATE_LIMIT_MAX_RPS, increased)
+
+    def throttled(self, retry_after: float = None) -> None:
+        """
+        Halve the rate and pause the bucket after a 429 or 503.
+
+        Args:
+            retry_after (float): Seconds the server asked us to wait, if it sent Retry-After.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.slow_start = False
+            # Responses to requests that were already in flight count as one throttling event
+            if now - self.last_decrease >= 1 / self.rate:
+                self.rate = max(RATE_LIMIT_MIN_RPS, self.rate * DECREASE_FACTOR)
+                self.last_decrease = now
+            self.tokens = 0
+            pause = retry_after if retry_after is not None else 1 / self.rate
+            self.blocked_until = max(self.blocked_until, now + pause)
+            logger.warning(f"Throttled by {self.name}, pausing {pause:.1f}s, rate now {self.rate:.2f} requests/s")
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def get_bucket(host: str, account: str = None) -> TokenBucket:
+    """
+    Get the shared bucket of a host and account, creating it on first use.
+
+    Args:
+        host (str): Host name, e.g. sellercentral.amazon.com.
+        account (str): Account or session the requests are made for.
+
+    Returns:
+        TokenBucket: The bucket.
+    """
+    key = (host, account)
+    with _buckets_lock:
+        if key not in _buckets:
+            _buckets[key] = TokenBucket(name=host if account is None else f"{host} ({account})")
+        return _buckets[key]
+
+
+def parse_retry_after(value: str) -> float:
+    """
+    Parse a Retry-After header, given either in seconds or as an HTTP date.
+
+    Returns:
+        float: Seconds to wait, None if the header is missing or invalid.
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def rate_limited_request(method: str, url: str, cookies: dict = None, **kwargs) -> requests.Response:
+    """
+    Send a request through the rate limiter of its host and account.
+
+    Throttled requests (429 or 503) slow the bucket down and are resent up to MAX_THROTTLE_RETRIES times,
+    after that the throttled response is returned like any other.
+
+    Args:
+        method (str): HTTP method.
+        url (str): Request URL.
+        cookies (dict): Session cookies, their session-id identifies the account.
+        **kwargs: Passed on to requests.request.
+
+    Returns:
+        requests.Response: The response.
+    """
+    account = (cookies or {}).get("session-id")
+    bucket = get_bucket(urlsplit(url).hostname, account)
+
+    for attempt in range(MAX_THROTTLE_RETRIES + 1):
+        bucket.acquire()
+        response = requests.request(method, url, cookies=cookies, **kwargs)
+
+        if response.status_code not in THROTTLE_STATUS_CODES:
+            bucket.succeeded()
+            return response
+
+        bucket.throttled(parse_retry_after(response.headers.get("Retry-After")))
+        if attempt < MAX_THROTTLE_RETRIES:
+            response.close()
+
+    return response
@@ -0,0 +1,215 @@
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import yaml
+from helper.logging import logger
+from helper.utils import STORAGE_STATE_PATH
+from helper.validation import to_numeric
+
+RECONCILIATION_CONFIG_FILE_PATH = (
+    Path(__file__).parent.parent / "AmazonSellerCentral" / "report_config" / "reconciliation_config.yaml"
+)
+
+
+def load_reconciliation_config(config_path: Path = RECONCILIATION_CONFIG_FILE_PATH) -> dict:
+    """
+    Load the reconciliation sources and checks from YAML.
+
+    Args:
+        config_path (Path): Path to the reconciliation config file.
+
+    Returns:
+        dict: The reconciliation_config section, with sources and checks.
+    """
+    with open(config_path, "r") as file:
+        return yaml.safe_load(file)["reconciliation_config"]
+
+
+def _resolve_column(df: pd.DataFrame, column: str) -> str:
+    """Find a configured column in a report, ignoring case and surrounding whitespace."""
+    if column in df.columns:
+        return column
+    matches = {str(name).strip().lower(): name for name in df.columns}
+    if column.strip().lower() in matches:
+        return matches[column.strip().lower()]
+    raise KeyError(f"Column '{column}' not found, available columns: {list(df.columns)}")
+
+
+def parse_report_dates(series: pd.Series, timezone: str = None) -> pd.Series:
+    """
+    Parse report timestamps into calendar days.
+
+    Args:
+        series (pd.Series): Date or timestamp column as written in the report.
+        timezone (str): Timezone to convert offset-aware timestamps to before taking the day.
+
+    Returns:
+        pd.Series: Naive datetime64 days, unparseable values become NaT.
+    """
+    # Trailing zone abbreviations ("PST", "CET") are not understood by the parser
+    values = series.astype("string").str.replace(r"\s+[A-Z]{2,5}$", "", regex=True)
+
+    if timezone:
+        parsed = pd.to_datetime(values, format="mixed", errors="coerce", utc=True).dt.tz_convert(timezone)
+        return parsed.dt.tz_localize(None).dt.normalize()
+
+    return pd.to_datetime(values, format="mixed", errors="coerce").dt.normalize()
+
+
+def load_source(source: dict, brandname: str, start_date: str, end_date: str) -> pd.DataFrame:
+    """
+    Load the landed file of one report for a brand and date range.
+
+    Args:
+        source (dict): Source config with folder_name, file_prefix and optional skip_rows.
+        brandname (str): Brand name used in the file name.
+        start_date (str): Start date of the report range.
+        end_date (str): End date of the report range.
+
+    Returns:
+        pd.DataFrame: The report, every column as a string.
+    """
+    start_date_formatted = pd.Timestamp(start_date).strftime("%Y%m%d")
+    end_date_formatted = pd.Timestamp(end_date).strftime("%Y%m%d")
+    file_name = f"{source['file_prefix']}_{brandname}_{start_date_formatted}_{end_date_formatted}.csv"
+    file_path = STORAGE_STATE_PATH / source["folder_name"] / file_name
+
+    logger.info(f"Loading {file_path} for reconciliation")
+
+    return pd.read_csv(
+        file_path,
+        dtype="string[pyarrow]",
+        skiprows=source.get("skip_rows", 0),
+        engine="pyarrow" if not source.get("skip_rows") else "c",
+    )
+
+
+def daily_aggregates(df: pd.DataFrame, source: dict, prefix: str) -> pd.DataFrame:
+    """
+    Aggregate a report's metrics per day with one vectorized group-by.
+
+    Args:
+        df (pd.DataFrame): The report.
+        source (dict): Source config with date_column, metrics and optional include/exclude filters.
+        prefix (str): Source name, metric columns are named <prefix>.<metric>.
+
+    Returns:
+        pd.DataFrame: One row per day, one column per metric.
+    """
+    mask = np.ones(len(df), dtype=bool)
+    for column, values in source.get("include", {}).items():
+        mask &= df[_resolve_column(df, column)].isin(values).to_numpy(dtype=bool, na_value=False)
+    for column, values in source.get("exclude", {}).items():
+        mask &= ~df[_resolve_column(df, column)].isin(values).to_numpy(dtype=bool, na_value=False)
+    df = df.loc[mask]
+
+    frame = pd.DataFrame(
+        {"date": parse_report_dates(df[_resolve_column(df, source["date_column"])], source.get("timezone"))}
+    )
+    aggregations = {}
+    for metric, definition in source["metrics"].items():
+        name = f"{prefix}.{metric}"
+        if definition["agg"] == "count":
+            frame[name] = 1
+            aggregations[name] = "sum"
+        else:
+            frame[name] = to_numeric(df[_resolve_column(df, definition["column"])])
+            aggregations[name] = definition["agg"]
+
+    return frame.dropna(subset=["date"]).groupby("date").agg(aggregations)
+
+
+def run_checks(daily: pd.DataFrame, checks: dict) -> pd.DataFrame:
+    """
+    Evaluate the reconciliation checks on every day at once.
+
+    A day is flagged when |left - right| exceeds max(abs_tolerance, rel_tolerance * |right|), or for
+    less_equal checks when left exceeds right by more than that. Days where only one side has data
+    are flagged as well.
+
+    Args:
+        daily (pd.DataFrame): Daily metrics of all sources, one column per <source>.<metric>.
+        checks (dict): Check name to left, right, abs_tolerance, rel_tolerance and comparison.
+
+    Returns:
+        pd.DataFrame: The flagged days with check, date, left, right, difference and allowed difference.
+    """
+    flagged = []
+    for name, check in checks.items():
+        if check["left"] not in daily.columns or check["right"] not in daily.columns:
+            logger.info(f"Skipping check '{name}', {check['left']} or {check['right']} was not loaded")
+            continue
+
+        left = daily[check["left"]].to_numpy(dtype="float64")
+        right = daily[check["right"]].to_numpy(dtype="float64")
+        difference = left - right
+        allowed = np.maximum(check.get("abs_tolerance", 0), check.get("rel_tolerance", 0) * np.abs(right))
+
+        if check.get("comparison", "equal") == "less_equal":
+            failed = difference > allowed
+        else:
+            failed = np.abs(difference) > allowed
+        failed |= np.isnan(left) != np.isnan(right)
+
+        if failed.any():
+            flagged.append(
+                pd.DataFrame(
+                    {
+                        "check": name,
+                        "date": daily.index[failed],
+                        "left": left[failed],
+                        "right": right[failed],
+                        "difference": difference[failed],
+                        "allowed_difference": allowed[failed],
+                    }
+                )
+            )
+
+    if not flagged:
+        return pd.DataFrame(columns=["check", "date", "left", "right", "difference", "allowed_difference"])
+    return pd.concat(flagged, ignore_index=True)
+
+
+def reconcile_reports(
+    brandname: str,
+    start_date: str,
+    end_date: str,
+    config_path: Path = RECONCILIATION_CONFIG_FILE_PATH,
+) -> tuple:
+    """
+    Reconcile the landed reports of a brand and date range against each other.
+
+    Sources whose file has not been downloaded are skipped, together with the checks that need them.
+
+    Args:
+        brandname (str): Brand name used in the file names.
+        start_date (str): Start date of the report range (YYYY-MM-DD or YYYY/MM/DD).
+        end_date (str): End date of the report range (YYYY-MM-DD or YYYY/MM/DD).
+        config_path (Path): Path to the reconciliation config file.
+
+    Returns:
+        tuple: (daily metrics of every source, flagged days)
+    """
+    config = load_reconciliation_config(config_path)
+
+    frames = []
+    for name, source in config["sources"].items():
+        try:
+            df = load_source(source, brandname=brandname, start_date=start_date, end_date=end_date)
+        except FileNotFoundError:
+            logger.info(f"No landed {name} report for {brandname} {start_date} - {end_date}, skipping")
+            continue
+        frames.append(daily_aggregates(df, source, prefix=name))
+
+    daily = pd.concat(frames, axis=1).sort_index() if frames else pd.DataFrame()
+
+    # Only reconcile the requested range, order timestamps can spill into the neighbouring day
+    daily = daily.loc[pd.Timestamp(start_date) : pd.Timestamp(end_date)]
+
+    flagged = run_checks(daily, config["checks"])
+    if flagged.empty:
+        logger.info(f"All reconciliation checks passed for {brandname} {start_date} - {end_date}")
+    else:
+        logger.error(f"{len(flagged)} day(s) failed reconciliation for {brandname}:\n{flagged.to_string(index=False)}")
+
+    return daily, flagged
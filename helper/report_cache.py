@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any
+from helper.logging import logger
+from helper.memory import Content, content_size, exceeds_budget, new_spill_file
+from helper.metrics import span
+from helper.utils import STORAGE_STATE_PATH
+
+# Downloaded reports of closed periods, so backfills and re-validations of a period download it once
+REPORT_CACHE_PATH = Path(os.environ.get("REPORT_CACHE_DIR", STORAGE_STATE_PATH / "_cache"))
+
+# Least recently used reports are removed once the cache is larger than this, 0 turns the cache off
+REPORT_CACHE_MAX_MB = int(os.environ.get("REPORT_CACHE_MAX_MB", 2048))
+
+# Days after the end of its range until a portal no longer changes a report. Orders change status and
+# get returned, ads sales are attributed up to 14 days after the click.
+FINAL_AFTER_DAYS = {
+    "sales_traffic": 3,
+    "payments": 7,
+    "fulfillment": 30,
+    "ads": 30,
+}
+
+_evict_lock = threading.Lock()
+
+
+def parse_end_date(value: str) -> date:
+    """Parse a report end date, in YYYY-MM-DD or YYYY/MM/DD format."""
+    return datetime.strptime(value.replace("/", "-"), "%Y-%m-%d").date()
+
+
+def is_final(portal: str, end_date: str, today: date = None) -> bool:
+    """Whether a report of the portal ending on end_date is old enough that Amazon no longer changes it."""
+    if portal not in FINAL_AFTER_DAYS:
+        return False
+    return parse_end_date(end_date) + timedelta(days=FINAL_AFTER_DAYS[portal]) < (today or date.today())
+
+
+def report_cache_key(
+    portal: str, report_config: Any, market_place: str, account: str, start_date: str, end_date: str
+) -> str:
+    """
+    Cache key of one report, or None if its period is not final yet.
+
+    Args:
+        portal (str): Portal of the report, a key of FINAL_AFTER_DAYS.
+        report_config: Report definition the request is built from, any change to it is a new key.
+        market_place (str): Marketplace of the account.
+        account (str): Account the report is downloaded for.
+        start_date (str): Start of the report range, YYYY-MM-DD or YYYY/MM/DD.
+        end_date (str): End of the report range.
+
+    Returns:
+        str: Hex digest identifying the report, None if it must not be cached.
+    """
+    if REPORT_CACHE_MAX_MB <= 0 or not start_date or not end_date or not is_final(portal, end_date):
+        return None
+
+    config_hash = hashlib.sha256(json.dumps(report_config, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    fields = [
+        portal,
+        config_hash,
+        market_place,
+        account or "",
+        start_date.replace("/", "-"),
+        end_date.replace("/", "-"),
+    ]
+    return hashlib.sha256("|".join(fields).encode("utf-8")).hexdigest()
+
+
+def cache_file(key: str) -> Path:
+    """File of a cached report, spread over subfolders by the first characters of its key."""
+    return REPORT_CACHE_PATH / key[:2] / f"{key}.report"
+
+
+def load_cached_report(key: str, suffix: str = ".tmp") -> Content:
+    """
+    Get a cached report, as it was downloaded.
+
+    Args:
+        key (str): Key from report_cache_key, None is always a miss.
+        suffix (str): Suffix of the spill file, for reports over the memory budget.
+
+    Returns:
+        Content: The report as bytes, or the path of a spilled copy owned by the caller. None on a miss.
+    """
+    if key is None:
+        return None
+
+    file_path = cache_file(key)
+    content = None
+    with span("cache") as record:
+        try:
+            size = file_path.stat().st_size
+            if exceeds_budget(size):
+                content = new_spill_file(suffix)
+                shutil.copyfile(file_path, content)
+            else:
+                content = file_path.read_bytes()
+            # The modification time orders the reports for eviction
+            os.utime(file_path)
+        except FileNotFoundError:
+            # Not cached, or evicted by another job while it was read
+            if isinstance(content, Path):
+                content.unlink(missing_ok=True)
+            record["hit"] = False
+            return None
+
+        record["hit"] = True
+        record["bytes"] = size
+
+    logger.info(f"Using cached report {key[:12]}, skipping the request and download")
+    return content
+
+
+def store_cached_report(key: str, content: Content) -> None:
+    """
+    Cache a downloaded report and evict the least recently used reports over REPORT_CACHE_MAX_MB.
+
+    Caching is best effort, a report that cannot be written is only logged.
+
+    Args:
+        key (str): Key from report_cache_key, nothing is stored for None.
+        content (Content): The report as bytes or the path of a spilled file, which is copied and left in place.
+    """
+    if key is None or content is None:
+        return
+    if content_size(content) > REPORT_CACHE_MAX_MB * 1024 * 1024:
+        return
+
+    file_path = cache_file(key)
+    temporary_file = file_path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        if isinstance(content, Path):
+            shutil.copyfile(content, temporary_file)
+        else:
+            temporary_file.write_bytes(content)
+        os.replace(temporary_file, file_path)
+    except OSError as e:
+        temporary_file.unlink(missing_ok=True)
+        logger.warning(f"Could not cache report {key[:12]}: {e}")
+        return
+
+    evict(REPORT_CACHE_MAX_MB * 1024 * 1024)
+
+
+def drop_cached_report(key: str) -> None:
+    """Remove a cached report, e.g. one that failed its quality checks, so the next run downloads it again."""
+    if key is None:
+        return
+    file_path = cache_file(key)
+    if file_path.exists():
+        file_path.unlink(missing_ok=True)
+        logger.info(f"Removed cached report {key[:12]}")
+
+
+def evict(max_bytes: int) -> None:
+    """Remove the least recently used reports until the cache holds at most max_bytes."""
+    with _evict_lock:
+        entries = []
+        for file_path in REPORT_CACHE_PATH.glob("*/*.report"):
+            try:
+                stat = file_path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, file_path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, file_path in sorted(entries):
+            if total <= max_bytes:
+                break
+            file_path.unlink(missing_ok=True)
+            total -= size
+            logger.info(f"Evicted cached report {file_path.stem[:12]}")
@@ -1,19 +1,31 @@
+import io
 import os
-from google.cloud import storage
 from pathlib import Path
 import argparse
 from helper.logging import logger
+from helper.memory import Content
+from helper.metrics import RUN_ID, span
+from helper.profiling import enable_profiling
 
 STORAGE_STATE_PATH = Path(__file__).parent.parent / "data"
 SERVICE_ACCOUNT_PATH = Path(__file__).parent.parent / "solutionsdw_rpa_data_validation_bot.json"
 
 
-def save_content_to_file(content: bytes, folder_name: str, file_name: str) -> str:
+def _quote_csv_line(line: str) -> str:
+    """Add double quotes around the values of a CSV line if not already present."""
+    values = line.split(",")
+    quoted_values = [f'"{value}"' if not (value.startswith('"') and value.endswith('"')) else value for value in values]
+    return ",".join(quoted_values)
+
+
+def save_content_to_file(content: Content, folder_name: str, file_name: str) -> str:
     """
     Save content to a file, adding double quotes around CSV values if not already present.
 
+    Content that was spilled to disk is rewritten line by line and the spilled file is removed.
+
     Args:
-        content (bytes): The content to save.
+        content (Content): The content to save, as bytes or the path of a spilled file.
         folder_name (str): The folder to save the file in.
         file_name (str): The name of the file.
 
@@ -22,26 +34,39 @@ def save_content_to_file(content: bytes, folder_name: str, file_name: str) -> st
     """
     # Ensure the folder exists
     try:
-        file_path = STORAGE_STATE_PATH / folder_name / file_name
-        file_path.parent.mkdir(parents=True, exist_ok=True)
-
-        # Convert bytes content to string, replacing invalid bytes
-        content_str = content.decode("utf-8", errors="replace")
-
-        # Add double quotes around CSV values if not already present
-        lines = content_str.splitlines()
-        quoted_lines = []
-        for line in lines:
-            values = line.split(",")
-            quoted_values = [
-                f'"{value}"' if not (value.startswith('"') and value.endswith('"')) else value for value in values
-            ]
-            quoted_lines.append(",".join(quoted_values))
-        quoted_content = "\n".join(quoted_lines)
-
-        # Save the content to a file
-        with open(file_path, "w", encoding="utf-8") as file:
-            file.write(quoted_content)
+        with span("save", file=file_name) as record:
+            file_path = STORAGE_STATE_PATH / folder_name / file_name
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+
+            if isinstance(content, Path):
+                rows = 0
+                with open(content, "r", encoding="utf-8", errors="replace") as source, open(
+                    file_path, "w", encoding="utf-8"
+                ) as file:
+                    for line in source:
+                        file.write(("\n" if rows else "") + _quote_csv_line(line.rstrip("\r\n")))
+                        rows += 1
+
+                record["bytes"] = content.stat().st_size
+                record["rows"] = max(rows - 1, 0)
+                content.unlink()
+
+            else:
+                # Convert bytes content to string, replacing invalid bytes
+                content_str = content.decode("utf-8", errors="replace")
+
+                # Split on \r and \n only, as the spilled branch reads its file, unlike str.splitlines
+                lines = [line.rstrip("\r\n") for line in io.StringIO(content_str, newline=None)]
+
+                # Add double quotes around CSV values if not already present
+                quoted_content = "\n".join(_quote_csv_line(line) for line in lines)
+
+                # Save the content to a file
+                with open(file_path, "w", encoding="utf-8") as file:
+                    file.write(quoted_content)
+
+                record["bytes"] = len(content)
+                record["rows"] = max(len(lines) - 1, 0)
     except Exception as e:
         logger.error(f"Error saving file: {str(e)}")
         raise e
@@ -69,18 +94,26 @@ def upload_to_gcs(
 
         local_file_path = STORAGE_STATE_PATH / str(Path(local_folder_name)) / str(Path((local_file_name)))
 
-        logger.info(f"Creating Client")
+        with span("upload", file=local_file_name, bytes=local_file_path.stat().st_size):
+            # Imported here, the client library is slow to import and not needed for --help or failed downloads
+            from google.cloud import storage
 
-        storage_client = storage.Client.from_service_account_json(str(SERVICE_ACCOUNT_PATH))
+            logger.info(f"Creating Client")
 
-        logger.info(f"Getting Bucket")
-        bucket = storage_client.bucket(bucket_name)
+            # A local emulator (e.g. the benchmark's mock GCS) needs no service account
+            if os.environ.get("STORAGE_EMULATOR_HOST"):
+                storage_client = storage.Client()
+            else:
+                storage_client = storage.Client.from_service_account_json(str(SERVICE_ACCOUNT_PATH))
 
-        logger.info(f"Getting Blob")
-        blob = bucket.blob(destination_blob_name)
+            logger.info(f"Getting Bucket")
+            bucket = storage_client.bucket(bucket_name)
 
-        logger.info(f"Uploading File")
-        blob.upload_from_filename(local_file_path)
+            logger.info(f"Getting Blob")
+            blob = bucket.blob(destination_blob_name)
+
+            logger.info(f"Uploading File")
+            blob.upload_from_filename(local_file_path)
 
         logger.info(f"File {local_file_name} uploaded to {destination_blob_name} in bucket {bucket_name}")
 
@@ -95,6 +128,8 @@ def parse_args(
     optional_args: bool = False,
     amazon_ads: bool = False,
     amazon_fulfillment: bool = False,
+    sales_traffic: bool = False,
+    reuse_reports: bool = False,
 ) -> argparse.Namespace:
     """
     Parse command line arguments for report date range.
@@ -104,6 +139,9 @@ def parse_args(
         date_format: Date format string (e.g., 'YYYY/MM/DD' or 'YYYY-MM-DD')
         optional_args: Whether to include optional arguments for client, brand, and bucket
         amazon_ads: Whether to include optional argument for Amazon Ads report list
+        amazon_fulfillment: Whether to include optional argument for Fulfillment report list
+        sales_traffic: Whether to include optional argument for Sales and Traffic report list
+        reuse_reports: Whether to include optional argument to always generate new reports
     Returns:
         argparse.Namespace: Parsed command line arguments
     """
@@ -170,7 +208,52 @@ def parse_args(
             help="comma separeted names of Amazon Reports (can be found in readme)",
         )
 
-    return parser.parse_args()
+    if sales_traffic:
+        parser.add_argument(
+            "--report_list",
+            type=str,
+            default="Sales and Traffic",
+            help="(Optional) comma separeted names of Sales and Traffic reports from sales_traffic_report_config.yaml "
+            "(default: Sales and Traffic)",
+        )
+        parser.add_argument(
+            "--window_days",
+            type=int,
+            default=None,
+            help="(Optional) Split the date range into windows of this many days, one file per window, "
+            "requested together in batched GraphQL queries",
+        )
+
+    if amazon_fulfillment:
+        parser.add_argument(
+            "--batch",
+            action="store_true",
+            help="(Optional) Submit every report first, then poll all of them in one status call per interval",
+        )
+
+    if reuse_reports:
+        parser.add_argument(
+            "--no_reuse",
+            action="store_true",
+            help="(Optional) Always generate new reports instead of downloading matching ones generated earlier",
+        )
+
+    parser.add_argument(
+        "--profile",
+        type=str,
+        nargs="?",
+        const="all",
+        default=None,
+        help="(Optional) Profile the pipeline stages with cProfile and tracemalloc, optionally only the "
+        "comma separated stages given (e.g. transform,save,upload); profiles are written to profiles/<run id>",
+    )
+
+    args = parser.parse_args()
+
+    if args.profile:
+        enable_profiling(run_id=RUN_ID, stages=args.profile)
+
+    return args
 
 
 def reset_cookie(cookie_storage_path: str):
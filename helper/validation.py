@@ -0,0 +1,204 @@
+import re
+import numpy as np
+import pandas as pd
+from helper.logging import logger
+from helper.utils import STORAGE_STATE_PATH
+
+
+def bigquery_column_name(column: str) -> str:
+    """
+    Convert a report header to the column name BigQuery autodetect gives it on load.
+
+    Args:
+        column (str): Column header as it appears in the report file.
+
+    Returns:
+        str: Column name with every character BigQuery does not allow replaced by an underscore.
+    """
+    return re.sub(r"[^0-9a-zA-Z_]", "_", column.strip())
+
+
+def to_numeric(series: pd.Series) -> pd.Series:
+    """
+    Convert a column to floats, stripping currency symbols, thousands separators and percent signs.
+
+    Args:
+        series (pd.Series): Column to convert.
+
+    Returns:
+        pd.Series: Float column, unparseable values become NaN.
+    """
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype("float64")
+
+    # Arrow-backed strings keep the cleanup in Arrow compute kernels instead of a Python loop
+    values = series.astype("string[pyarrow]")
+    try:
+        return pd.to_numeric(values).astype("float64")
+    except (ValueError, TypeError):
+        cleaned = values.str.replace(r"[^0-9eE.+\-]", "", regex=True)
+        return pd.to_numeric(cleaned, errors="coerce").astype("float64")
+
+
+def load_landed_report(folder_name: str, file_name: str) -> pd.DataFrame:
+    """
+    Load a report saved by save_content_to_file from the local data folder.
+
+    Args:
+        folder_name (str): The folder the report was saved in.
+        file_name (str): The name of the report file.
+
+    Returns:
+        pd.DataFrame: The report, with BigQuery-compatible column names.
+    """
+    file_path = STORAGE_STATE_PATH / folder_name / file_name
+    logger.info(f"Loading landed report {file_path}")
+
+    # The pyarrow engine parses the file multi-threaded in C++
+    df = pd.read_csv(file_path, engine="pyarrow", dtype="string[pyarrow]")
+    df.columns = [bigquery_column_name(column) for column in df.columns]
+
+    return df
+
+
+def _aggregate_by_key(df: pd.DataFrame, key_columns: list, numeric_columns: list) -> pd.DataFrame:
+    """Normalise keys to strings and sum the numeric columns per key, so duplicate keys cannot fan out the join."""
+    keys = pd.DataFrame({column: df[column].astype("string[pyarrow]").str.strip() for column in key_columns})
+    values = pd.DataFrame({column: to_numeric(df[column]) for column in numeric_columns}, index=df.index)
+    values["row_count"] = 1
+
+    return pd.concat([keys, values], axis=1).groupby(key_columns, sort=False, dropna=False).sum().reset_index()
+
+
+def compare_frames(
+    report_df: pd.DataFrame,
+    warehouse_df: pd.DataFrame,
+    key_columns: list,
+    numeric_columns: list = None,
+    tolerance: float = 0.01,
+    relative_tolerance: float = 0.0,
+) -> dict:
+    """
+    Compare a report with the matching warehouse slice on key columns.
+
+    Both sides are aggregated by key and aligned with a single hash join, then every numeric column
+    is compared with one vectorized pass.
+
+    Args:
+        report_df (pd.DataFrame): The downloaded report.
+        warehouse_df (pd.DataFrame): The warehouse rows for the same period, with the same column names.
+        key_columns (list): Columns identifying a row, e.g. ["Date", "Campaign_Name"].
+        numeric_columns (list): Columns to compare numerically (default: none, only row presence is checked).
+        tolerance (float): Absolute difference allowed between numeric values.
+        relative_tolerance (float): Difference allowed relative to the warehouse value.
+
+    Returns:
+        dict: missing_rows (in the report, not the warehouse), extra_rows (in the warehouse, not the report),
+            numeric_differences (one row per key and column out of tolerance) and a summary dict.
+    """
+    numeric_columns = numeric_columns or []
+
+    missing_columns = [
+        column
+        for column in key_columns + numeric_columns
+        if column not in report_df.columns or column not in warehouse_df.columns
+    ]
+    if missing_columns:
+        raise ValueError(f"Columns missing from report or warehouse data: {missing_columns}")
+
+    report = _aggregate_by_key(report_df, key_columns, numeric_columns)
+    warehouse = _aggregate_by_key(warehouse_df, key_columns, numeric_columns)
+
+    merged = report.merge(
+        warehouse, on=key_columns, how="outer", suffixes=("_report", "_warehouse"), indicator=True, sort=False
+    )
+
+    missing_rows = merged.loc[merged["_merge"] == "left_only", key_columns].reset_index(drop=True)
+    extra_rows = merged.loc[merged["_merge"] == "right_only", key_columns].reset_index(drop=True)
+    matched = merged.loc[merged["_merge"] == "both"]
+
+    differences = []
+    for column in numeric_columns + ["row_count"]:
+        report_values = matched[f"{column}_report"].to_numpy(dtype="float64")
+        warehouse_values = matched[f"{column}_warehouse"].to_numpy(dtype="float64")
+
+        out_of_tolerance = ~np.isclose(
+            report_values, warehouse_values, rtol=relative_tolerance, atol=tolerance, equal_nan=True
+        )
+        if out_of_tolerance.any():
+            difference = matched.loc[out_of_tolerance, key_columns].copy()
+            difference["column"] = column
+            difference["report_value"] = report_values[out_of_tolerance]
+            difference["warehouse_value"] = warehouse_values[out_of_tolerance]
+            difference["difference"] = difference["report_value"] - difference["warehouse_value"]
+            differences.append(difference)
+
+    numeric_differences = (
+        pd.concat(differences, ignore_index=True)
+        if differences
+        else pd.DataFrame(columns=key_columns + ["column", "report_value", "warehouse_value", "difference"])
+    )
+
+    summary = {
+        "report_rows": len(report_df),
+        "warehouse_rows": len(warehouse_df),
+        "matched_keys": len(matched),
+        "missing_rows": len(missing_rows),
+        "extra_rows": len(extra_rows),
+        "numeric_differences": len(numeric_differences),
+        "passed": missing_rows.empty and extra_rows.empty and numeric_differences.empty,
+    }
+    logger.info(f"Validation summary: {summary}")
+
+    return {
+        "missing_rows": missing_rows,
+        "extra_rows": extra_rows,
+        "numeric_differences": numeric_differences,
+        "summary": summary,
+    }
+
+
+def validate_report_against_warehouse(
+    bigquery_operations,
+    folder_name: str,
+    file_name: str,
+    query: str,
+    key_columns: list,
+    numeric_columns: list = None,
+    query_parameters: dict = None,
+    tolerance: float = 0.01,
+    relative_tolerance: float = 0.0,
+) -> dict:
+    """
+    Validate a landed report against the matching slice of a BigQuery table.
+
+    Args:
+        bigquery_operations (BigQueryOperations): Connected BigQuery helper.
+        folder_name (str): The folder the report was saved in.
+        file_name (str): The name of the report file.
+        query (str): Query selecting the warehouse slice for the report's period.
+        key_columns (list): Columns identifying a row, as BigQuery column names.
+        numeric_columns (list): Columns to compare numerically, as BigQuery column names.
+        query_parameters (dict): Parameters for the query, e.g. start and end date.
+        tolerance (float): Absolute difference allowed between numeric values.
+        relative_tolerance (float): Difference allowed relative to the warehouse value.
+
+    Returns:
+        dict: The comparison result, see compare_frames.
+    """
+    try:
+        report_df = load_landed_report(folder_name=folder_name, file_name=file_name)
+        warehouse_df = bigquery_operations.query_to_dataframe(query, parameters=query_parameters)
+
+        return compare_frames(
+            report_df=report_df,
+            warehouse_df=warehouse_df,
+            key_columns=key_columns,
+            numeric_columns=numeric_columns,
+            tolerance=tolerance,
+            relative_tolerance=relative_tolerance,
+        )
+
+    except Exception as e:
+        logger.error(f"Error validating report {file_name}: {str(e)}")
+        raise e